@@ -0,0 +1,234 @@
+"""
+Admission control for the API's routers.
+
+Each configured router (matched by tag: ``auth``, ``sweets``,
+``inventory``) gets a concurrency limit with a short queue in front of it.
+Past the limit the queue behaves like CoDel. A request normally waits up
+to ``queue_interval_ms`` for a slot. Once the queue has gone a whole
+interval without draining, it is a standing queue, and new arrivals wait
+only ``queue_target_ms``. An overloaded router therefore answers 503 in
+milliseconds instead of letting every request time out.
+
+The limit itself adapts: every ADJUST_EVERY completions the p99 of recent
+service times is compared with ``p99_target_ms``. Over target, the limit
+is cut multiplicatively; under target, it grows by one back towards
+``max_concurrency``.
+
+Requests are also counted against a per-principal quota (the token's
+subject, or the client address when anonymous) and get 429 past it.
+
+State is per worker and lives on the event loop, so no locks are needed.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Pattern, Tuple
+from jose import JWTError
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from .config import RouteAdmission, settings
+from .rate_limit import InMemoryRateLimitBackend, SlidingWindowLimiter
+from .tokens import keyring
+
+# Service times kept per router, and how often the limit is re-evaluated
+LATENCY_SAMPLES = 1000
+ADJUST_EVERY = 100
+# Multiplicative decrease while p99 is over target
+BACKOFF = 0.9
+
+
+def _p99(samples) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+
+class RouteGroupLimiter:
+    """Adaptive concurrency limit with a CoDel-style queue"""
+
+    def __init__(self, name: str, limits: RouteAdmission):
+        self.name = name
+        self.max_concurrency = limits.max_concurrency
+        self.min_concurrency = min(limits.min_concurrency, limits.max_concurrency)
+        self.limit = limits.max_concurrency
+        self.max_queue = limits.max_queue
+        self.target_seconds = limits.queue_target_ms / 1000
+        self.interval_seconds = limits.queue_interval_ms / 1000
+        self.p99_target_seconds = limits.p99_target_ms / 1000
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_empty = time.monotonic()
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._completed = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def queue_timeout(self) -> float:
+        """How long a new arrival may wait for a slot"""
+        if self._waiters and time.monotonic() - self._last_empty > self.interval_seconds:
+            return self.target_seconds
+        return self.interval_seconds
+
+    async def acquire(self) -> bool:
+        """Take a slot, waiting briefly if none is free; False means shed"""
+        if not self._waiters and self.in_flight < self.limit:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            return False
+        timeout = self.queue_timeout()
+        if not self._waiters:
+            self._last_empty = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            self.shed += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # handed a slot just as the client went away
+            else:
+                self._discard(waiter)
+            raise
+        self.admitted += 1
+        return True
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, service_seconds: Optional[float] = None) -> None:
+        """Free a slot, handing it to the oldest waiter still within the limit"""
+        self.in_flight -= 1
+        if service_seconds is not None:
+            self._record(service_seconds)
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+        if not self._waiters:
+            self._last_empty = time.monotonic()
+
+    def _record(self, service_seconds: float) -> None:
+        self._latencies.append(service_seconds)
+        self._completed += 1
+        if self._completed % ADJUST_EVERY:
+            return
+        if _p99(self._latencies) > self.p99_target_seconds:
+            self.limit = max(self.min_concurrency, int(self.limit * BACKOFF))
+        elif self.limit < self.max_concurrency:
+            self.limit += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "p99_seconds": _p99(self._latencies) if self._latencies else 0.0,
+        }
+
+
+class AdmissionController:
+    """Per-router limiters and per-principal quotas"""
+
+    def __init__(self, routes: Dict[str, RouteAdmission]):
+        self.routes = routes
+        self._quota_backend = InMemoryRateLimitBackend(max_keys=settings.rate_limit_max_keys)
+        self.reset()
+
+    def reset(self) -> None:
+        self.groups = {name: RouteGroupLimiter(name, limits) for name, limits in self.routes.items()}
+        self.quotas = {
+            name: SlidingWindowLimiter(f"quota-{name}", limits.requests_per_minute, 60.0, self._quota_backend)
+            for name, limits in self.routes.items()
+        }
+        self._quota_backend.clear()
+        self._route_groups: Optional[List[Tuple[Pattern, str]]] = None
+
+    def group_for(self, scope: Scope) -> Optional[str]:
+        """The configured router whose route matches the request path, if any"""
+        if self._route_groups is None:
+            # Routers sharing a prefix (sweets, inventory, stream) are told
+            # apart by their routes, in the app's own matching order
+            self._route_groups = [
+                (route.path_regex, next((tag for tag in route.tags if tag in self.groups), None))
+                for route in scope["app"].routes
+                if hasattr(route, "tags")
+            ]
+        path = scope["path"]
+        for path_regex, group in self._route_groups:
+            if path_regex.match(path):
+                return group
+        return None
+
+    @staticmethod
+    def principal(scope: Scope) -> str:
+        """The token's subject, or the client address for anonymous requests"""
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    try:
+                        return f"user:{keyring.verify(token)['sub']}"
+                    except (JWTError, KeyError):
+                        break  # the route's own auth check rejects it
+                break
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        stats = {name: group.stats() for name, group in self.groups.items()}
+        for name, quota in self.quotas.items():
+            stats[name]["over_quota"] = quota.rejected
+        return stats
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware that admits, queues or rejects requests per router"""
+
+    def __init__(self, app: ASGIApp, controller: "AdmissionController"):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        group_name = self.controller.group_for(scope) if scope["type"] == "http" else None
+        if group_name is None:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = self.controller.quotas[group_name].hit(self.controller.principal(scope))
+        if retry_after:
+            response = JSONResponse(
+                {"detail": "Request quota exceeded, please retry later"},
+                status_code=429,
+                headers={"Retry-After": str(int(retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+
+        group = self.controller.groups[group_name]
+        if not await group.acquire():
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry shortly"},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            group.release(time.perf_counter() - started)
+
+
+admission_controller = AdmissionController(settings.admission_routes)
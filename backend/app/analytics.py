@@ -0,0 +1,55 @@
+"""
+Columnar helpers for the admin analytics endpoints.
+
+Aggregation happens in SQL wherever the database can do it; what is left
+(percentiles over a value histogram, re-bucketing hourly totals into days
+or weeks) runs here with NumPy over whole columns at once.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+BUCKET_HOURS = {"hour": 1, "day": 24, "week": 24 * 7}
+# 1970-01-01 was a Thursday; weeks start on Monday 1970-01-05
+_BUCKET_OFFSET_HOURS = {"hour": 0, "day": 0, "week": 96}
+
+
+def percentiles_from_histogram(
+    values: Sequence[float], counts: Sequence[int], quantiles: Sequence[float]
+) -> List[float]:
+    """
+    Nearest-rank percentiles of a distribution given as sorted distinct
+    values and how often each occurs (e.g. from SQL GROUP BY).
+    """
+    if not values:
+        return [0.0 for _ in quantiles]
+    cumulative = np.cumsum(np.asarray(counts, dtype=np.int64))
+    ranks = np.maximum(np.ceil(np.asarray(quantiles) / 100.0 * cumulative[-1]), 1)
+    indexes = np.searchsorted(cumulative, ranks)
+    return [float(v) for v in np.asarray(values, dtype=np.float64)[indexes]]
+
+
+def bucket_totals(
+    hours: Sequence[datetime], columns: Dict[str, Sequence[float]], bucket: str
+) -> List[Tuple[datetime, Dict[str, float]]]:
+    """
+    Re-bucket hourly totals into `bucket` ("hour", "day" or "week") by
+    summing each column; returns (bucket start, sums) in time order.
+    """
+    if not hours:
+        return []
+    width = BUCKET_HOURS[bucket]
+    offset = _BUCKET_OFFSET_HOURS[bucket]
+    epoch_hours = [int((hour - EPOCH).total_seconds()) // 3600 for hour in hours]
+
+    starts = (np.asarray(epoch_hours, dtype=np.int64) - offset) // width * width + offset
+    unique_starts, inverse = np.unique(starts, return_inverse=True)
+    sums = {
+        name: np.bincount(inverse, weights=np.asarray(values, dtype=np.float64))
+        for name, values in columns.items()
+    }
+    return [
+        (EPOCH + timedelta(hours=int(start)), {name: float(sums[name][i]) for name in columns})
+        for i, start in enumerate(unique_starts)
+    ]
@@ -1,17 +1,23 @@
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
+from jose import JWTError
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from fastapi import Depends, HTTPException, status
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
+from .config import settings
 from .database import get_db
+from .hashing import PasswordHashPool, PoolSaturatedError
 from .models import User
-from .schemas import TokenData
+from .revocation import revocation_list
+from .tokens import keyring
+from .ttl_cache import TTLCache
 
-SECRET_KEY = "your-secret-key-change-in-production"
-ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = 14
+REFRESH_TOKEN_TYPE = "refresh"
 
 # Configure passlib to handle bcrypt without version checking issues
 # Suppress the version check error by using a try-except during initialization
@@ -24,6 +30,27 @@ except (AttributeError, TypeError):
     # Fallback if there are version compatibility issues
     pwd_context = CryptContext(schemes=["bcrypt"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
+
+# bcrypt runs here so login storms don't block the event loop
+password_pool = PasswordHashPool(
+    max_workers=settings.password_hash_workers,
+    max_queue=settings.password_hash_max_queue,
+)
+
+# Resolved users keyed by token subject, so authenticated requests skip the user lookup
+user_cache = TTLCache(
+    max_size=settings.user_cache_max_size,
+    ttl_seconds=settings.user_cache_ttl_seconds,
+)
+_CACHED_USER_FIELDS = ("id", "username", "email", "hashed_password", "is_admin")
+
+# Usernames a login just found not to exist, so repeated guesses skip the
+# lookup. Usernames aren't secret here (registration reports taken ones).
+unknown_usernames = TTLCache(
+    max_size=settings.rate_limit_max_keys,
+    ttl_seconds=settings.unknown_username_ttl_seconds,
+)
 
 
 def _truncate_password(password: str) -> str:
@@ -87,6 +114,27 @@ def get_password_hash(password: str) -> str:
         raise
 
 
+async def _run_on_password_pool(fn, *args):
+    try:
+        return await password_pool.run(fn, *args)
+    except PoolSaturatedError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password on the bcrypt pool (503 if the pool is saturated)"""
+    return await _run_on_password_pool(get_password_hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the bcrypt pool (503 if the pool is saturated)"""
+    return await _run_on_password_pool(verify_password, plain_password, hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -95,53 +143,184 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return keyring.sign(to_encode)
+
+
+def create_refresh_token(username: str, user_id: int, session_id: str) -> str:
+    """Create a single-use refresh token for a session"""
+    return keyring.sign({
+        "sub": username,
+        "uid": user_id,
+        "sid": session_id,
+        "jti": uuid.uuid4().hex,
+        "typ": REFRESH_TOKEN_TYPE,
+        "exp": datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    })
 
 
-def get_user_by_username(db: Session, username: str) -> Optional[User]:
+def issue_tokens(user: User, session_id: Optional[str] = None) -> dict:
+    """Issue an access and refresh token pair, starting a session if needed"""
+    session_id = session_id or uuid.uuid4().hex
+    access_token = create_access_token(
+        data={"sub": user.username, "uid": user.id, "is_admin": user.is_admin, "sid": session_id},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": create_refresh_token(user.username, user.id, session_id),
+        "token_type": "bearer",
+    }
+
+
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
     """Get user by username"""
-    return db.query(User).filter(User.username == username).first()
+    return await db.scalar(select(User).where(User.username == username))
 
 
-def get_user_by_email(db: Session, email: str) -> Optional[User]:
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
     """Get user by email"""
-    return db.query(User).filter(User.email == email).first()
+    return await db.scalar(select(User).where(User.email == email))
 
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
-    """Authenticate a user"""
-    user = get_user_by_username(db, username)
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
+    """Authenticate a user, verifying the password on the bcrypt pool"""
+    if unknown_usernames.get(username):
+        return None
+    user = await get_user_by_username(db, username)
     if not user:
+        unknown_usernames.set(username, True)
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return None
     return user
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
-) -> User:
-    """Get current authenticated user from JWT token"""
-    credentials_exception = HTTPException(
+def invalidate_user(username: str) -> None:
+    """Drop a user from the authenticated-user cache"""
+    user_cache.delete(username)
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    """Evict users created, modified or deleted through the ORM (including renames)"""
+    invalidate_user(target.username)
+    unknown_usernames.delete(target.username)
+    for old_username in inspect(target).attrs.username.history.deleted or ():
+        invalidate_user(old_username)
+
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def decode_access_token(token: str) -> dict:
+    """Decode a JWT access token, raising 401 if it is invalid"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = keyring.verify(token)
         username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
+        if username is None or payload.get("typ") == REFRESH_TOKEN_TYPE:
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
-    user = get_user_by_username(db, username=token_data.username)
+        raise _credentials_exception()
+    return payload
+
+
+def decode_refresh_token(token: str) -> dict:
+    """Decode a refresh token, raising 401 if it is invalid"""
+    try:
+        payload = keyring.verify(token)
+    except JWTError:
+        raise _credentials_exception()
+    if payload.get("typ") != REFRESH_TOKEN_TYPE or not payload.get("sub") or not payload.get("jti"):
+        raise _credentials_exception()
+    return payload
+
+
+async def verify_access_token(db: AsyncSession, token: str) -> dict:
+    """Decode an access token and reject it if its session was revoked"""
+    payload = decode_access_token(token)
+    session_id = payload.get("sid")
+    if session_id and await revocation_list.is_revoked(db, session_id):
+        raise _credentials_exception()
+    return payload
+
+
+async def resolve_user(db: AsyncSession, username: str) -> User:
+    """
+    Look up the user a token refers to, going through the user cache.
+    Cache hits return a detached copy that is safe to read but not to modify.
+    """
+    cached = user_cache.get(username)
+    if cached is not None:
+        return User(**cached)
+    user = await get_user_by_username(db, username=username)
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    user_cache.set(username, {field: getattr(user, field) for field in _CACHED_USER_FIELDS})
     return user
 
 
+def user_from_claims(payload: dict) -> User:
+    """Build a transient user from a token's self-contained claims"""
+    return User(id=payload.get("uid"), username=payload["sub"], is_admin=bool(payload["is_admin"]))
+
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+) -> User:
+    """
+    Get current authenticated user from JWT token.
+    With `trust_token_claims` enabled the user is built from the token's
+    `sub`, `uid` and `is_admin` claims without touching the database.
+    """
+    payload = await verify_access_token(db, token)
+    if settings.trust_token_claims and "uid" in payload and "is_admin" in payload:
+        return user_from_claims(payload)
+    return await resolve_user(db, payload["sub"])
+
+
+async def get_current_user_record(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+) -> User:
+    """Get the current user's stored record, for endpoints that return it"""
+    payload = await verify_access_token(db, token)
+    return await resolve_user(db, payload["sub"])
+
+
+async def get_current_reader(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+) -> User:
+    """
+    Get the caller of a read-only endpoint.
+    Like get_current_user, but readers need no user id, so older tokens
+    without `uid` are trusted too.
+    """
+    payload = await verify_access_token(db, token)
+    if settings.trust_token_claims and "is_admin" in payload:
+        return user_from_claims(payload)
+    return await resolve_user(db, payload["sub"])
+
+
+async def get_stream_reader(
+    token: Optional[str] = Depends(oauth2_scheme_optional),
+    access_token: Optional[str] = Query(
+        None, description="Bearer token, for clients such as EventSource that can't send headers"
+    ),
+    db: AsyncSession = Depends(get_db),
+) -> User:
+    """Get the caller of a streaming endpoint from the header or `access_token`"""
+    token = token or access_token
+    if not token:
+        raise _credentials_exception()
+    return await get_current_reader(token=token, db=db)
+
+
 async def get_current_admin_user(
     current_user: User = Depends(get_current_user),
 ) -> User:
@@ -0,0 +1,127 @@
+"""
+Streaming bulk import of the sweets catalogue.
+
+Rows are read lazily from CSV or NDJSON input, validated with SweetCreate
+and upserted by name in chunked multi-row ``INSERT ... ON CONFLICT``
+statements, so memory use stays flat regardless of input size. Each
+chunk's quantity changes are written to the stock ledger as adjustments,
+and cached catalogue responses invalidated, in the chunk's transaction.
+"""
+import csv
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from .ledger import ADJUSTMENT, movement_for, record_movements_sync
+from .models import Sweet
+from .response_cache import response_cache
+from .schemas import SweetCreate, SweetImportError, SweetImportResult
+
+SUPPORTED_FORMATS = ("csv", "ndjson")
+IMPORT_CHUNK_SIZE = 500
+# Only the first errors are reported back; the failed count is always exact
+MAX_REPORTED_ERRORS = 100
+
+_EXTENSIONS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    """Guess the input format from a file name"""
+    if not filename:
+        return None
+    for extension, fmt in _EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return fmt
+    return None
+
+
+def _iter_raw_records(lines: Iterable[str], fmt: str) -> Iterator[Tuple[int, object]]:
+    """Yield (line number, raw record) pairs; JSON errors are yielded as exceptions"""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    
+    for line_num, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_num, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_num, e
+
+
+def _upsert_chunk(db: Session, rows: List[dict], user_id: Optional[int]) -> None:
+    """Insert or update a chunk of sweets by name in one statement"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    
+    # Quantities before the upsert, so the ledger records the change
+    previous = dict(db.execute(
+        select(Sweet.name, Sweet.quantity)
+        .where(Sweet.name.in_([row["name"] for row in rows]))
+        .with_for_update()
+    ).all())
+    stmt = insert(Sweet).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Sweet.name],
+        set_={
+            "category": stmt.excluded.category,
+            "price": stmt.excluded.price,
+            "quantity": stmt.excluded.quantity,
+            "reorder_threshold": stmt.excluded.reorder_threshold,
+        },
+    ).returning(Sweet.id, Sweet.name, Sweet.category, Sweet.price, Sweet.quantity, Sweet.reorder_threshold)
+    record_movements_sync(db, [
+        movement_for(row, row.quantity - previous.get(row.name, 0), ADJUSTMENT, user_id)
+        for row in db.execute(stmt)
+    ])
+    response_cache.invalidate_all_sync(db)
+    db.commit()
+
+
+def import_sweets(
+    db: Session,
+    lines: Iterable[str],
+    fmt: str,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    user_id: Optional[int] = None,
+) -> SweetImportResult:
+    """Validate and upsert sweets from CSV or NDJSON lines on behalf of `user_id`"""
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported import format: {fmt}")
+    
+    result = SweetImportResult(imported=0, failed=0, errors=[])
+    # Keyed by name so a repeated name within one chunk keeps the last row
+    chunk: Dict[str, dict] = {}
+    
+    def record_error(line: int, error: str) -> None:
+        result.failed += 1
+        if len(result.errors) < MAX_REPORTED_ERRORS:
+            result.errors.append(SweetImportError(line=line, error=error))
+    
+    for line_num, record in _iter_raw_records(lines, fmt):
+        if isinstance(record, Exception):
+            record_error(line_num, f"Invalid JSON: {record.msg}")
+            continue
+        try:
+            sweet = SweetCreate.model_validate(record)
+        except ValidationError as e:
+            record_error(line_num, "; ".join(
+                f"{'.'.join(map(str, err['loc'])) or 'row'}: {err['msg']}" for err in e.errors()
+            ))
+            continue
+        
+        chunk[sweet.name] = sweet.model_dump()
+        result.imported += 1
+        if len(chunk) >= chunk_size:
+            _upsert_chunk(db, list(chunk.values()), user_id)
+            chunk.clear()
+    
+    if chunk:
+        _upsert_chunk(db, list(chunk.values()), user_id)
+    return result
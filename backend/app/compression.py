@@ -0,0 +1,138 @@
+"""
+Response compression.
+
+CompressionMiddleware picks an encoding from the request's
+Accept-Encoding: brotli when the ``brotli`` package is installed and the
+client accepts it, otherwise gzip. It then compresses JSON and text
+bodies of at least ``compression_minimum_size`` bytes. Streaming
+responses, such as the live stock stream, pass through untouched.
+
+The chosen encoding is also published in ``negotiated_encoding`` for the
+duration of the request. Responses served from the response cache use it
+to fetch a compressed variant stored next to the cached entry, so a
+popular listing is compressed once per catalogue version rather than
+once per request. The middleware leaves responses that already carry a
+Content-Encoding alone.
+
+A compressed body is a different representation from the identity one,
+so any strong ETag on it gets the encoding appended (``"v"`` becomes
+``"v-gzip"``); a cache never serves one variant for a validator taken
+from the other.
+"""
+import gzip
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from .config import settings
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+# Preferred first; brotli compresses JSON noticeably smaller at similar cost
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+negotiated_encoding: ContextVar[Optional[str]] = ContextVar("negotiated_encoding", default=None)
+
+
+@lru_cache(maxsize=256)
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """The best supported encoding the client accepts, or None for identity"""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.brotli_quality)
+    return gzip.compress(body, compresslevel=settings.gzip_level, mtime=0)
+
+
+def encoded_headers(encoding: str) -> Dict[str, str]:
+    return {"Content-Encoding": encoding, "Vary": "Accept-Encoding"}
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """The ETag of a representation's variant in `encoding`"""
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def _compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    if content_type.startswith("text/event-stream"):
+        return False
+    return content_type.startswith("text/") or "json" in content_type
+
+
+class CompressionMiddleware:
+    """ASGI middleware that compresses complete JSON and text responses"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding = None
+        if scope["type"] == "http":
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+            elif message["type"] == "http.response.start":
+                start = message
+                if not _compressible(Headers(raw=message["headers"])):
+                    passthrough = True
+                    await send(message)
+            elif message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if message.get("more_body", False) or len(body) < self.minimum_size:
+                    # Streamed or too small to be worth it
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                body = compress(body, encoding)
+                headers = MutableHeaders(raw=start["headers"])
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                if "etag" in headers:
+                    headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                headers.add_vary_header("Accept-Encoding")
+                await send(start)
+                await send({"type": "http.response.body", "body": body})
+            else:
+                await send(message)
+
+        token = negotiated_encoding.set(encoding)
+        try:
+            await self.app(scope, receive, send_compressed)
+        finally:
+            negotiated_encoding.reset(token)
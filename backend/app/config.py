@@ -0,0 +1,144 @@
+"""
+Application settings, read from environment variables prefixed with
+``SWEET_SHOP_`` (e.g. ``SWEET_SHOP_USER_CACHE_TTL_SECONDS=30``) or a
+``.env`` file in the working directory.
+"""
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class RouteAdmission(BaseModel):
+    """Admission limits for the routes of one router, keyed by its tag"""
+
+    # Concurrent requests; lowered towards min_concurrency while p99 latency
+    # exceeds p99_target_ms and raised back as it recovers
+    max_concurrency: int
+    min_concurrency: int = 1
+    max_queue: int
+    # CoDel-style queueing: requests wait up to queue_interval_ms, or only
+    # queue_target_ms once the queue hasn't drained for a whole interval
+    queue_target_ms: float = 5.0
+    queue_interval_ms: float = 100.0
+    p99_target_ms: float
+    # Per user (or client address when anonymous)
+    requests_per_minute: int
+
+
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="SWEET_SHOP_", env_file=".env", extra="ignore")
+
+    # Synchronous URL (used by scripts and schema creation); the API derives its
+    # async driver from it unless async_database_url is set explicitly
+    database_url: str = "sqlite:///./sweet_shop.db"
+    async_database_url: Optional[str] = None
+    # Connection pool (ignored for in-memory SQLite)
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_recycle_seconds: int = 1800
+    # Test connections before use; None checks network databases but not SQLite,
+    # whose file connections don't go stale
+    db_pool_pre_ping: Optional[bool] = None
+    # SQLite pragmas applied to every new connection
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    # Negative values are KiB, as in PRAGMA cache_size
+    sqlite_cache_size: int = -64 * 1024
+
+    # Access tokens: HS256 with a shared secret unless a JWKS file of
+    # asymmetric keys is given; jwt_signing_kid pins the key to sign with
+    jwt_algorithm: str = "HS256"
+    jwt_secret_key: str = "your-secret-key-change-in-production"
+    jwks_path: Optional[str] = None
+    jwt_signing_kid: Optional[str] = None
+    jwks_reload_seconds: float = 30.0
+    token_cache_max_size: int = 4096
+    # Revoked refresh tokens and sessions: Bloom filter sizing and how often
+    # each worker picks up revocations made by the others
+    revocation_bloom_capacity: int = 100_000
+    revocation_bloom_error_rate: float = 0.001
+    revocation_sync_seconds: float = 5.0
+    # Each sync re-reads this far behind the newest revocation it has seen,
+    # for rows stamped earlier but committed later (slow commits, clock skew)
+    revocation_sync_overlap_seconds: float = 60.0
+
+    # Login throttling: attempts allowed per client address and per username
+    # within a sliding window, and how long a username found not to exist is
+    # remembered (a registration on another worker waits out this TTL there)
+    login_rate_limit_per_ip: int = 30
+    login_rate_limit_per_username: int = 5
+    login_rate_limit_window_seconds: float = 60.0
+    rate_limit_max_keys: int = 100_000
+    unknown_username_ttl_seconds: float = 10.0
+
+    # Authenticated-user cache used by get_current_user
+    user_cache_ttl_seconds: float = 60.0
+    user_cache_max_size: int = 1024
+    # Authorise from token claims (sub, uid, is_admin) without a DB lookup;
+    # role changes and deleted users then take effect when tokens expire
+    trust_token_claims: bool = False
+
+    # Catalogue response cache (per worker; invalidations are shared through
+    # the database, so the TTL only bounds how long unused entries stay)
+    response_cache_max_entries: int = 2048
+    response_cache_ttl_seconds: float = 300.0
+
+    # Route single purchases through the group-commit pipeline
+    purchase_batching: bool = False
+    purchase_batch_max_size: int = 256
+    purchase_batch_max_delay_seconds: float = 0.002
+
+    # Sweets whose stock is served from in-memory counters (JSON list, e.g. [1, 2]);
+    # deltas are journalled and flushed to the database every interval. Only
+    # one process may serve them: a second worker fails to start
+    hot_sweet_ids: List[int] = []
+    stock_counter_stripes: int = 16
+    stock_flush_interval_seconds: float = 0.5
+    stock_journal_path: str = "./stock_journal.log"
+    stock_journal_fsync: bool = False
+
+    # Idempotency-Key results: how long they are replayed, when an unfinished
+    # request's reservation may be taken over, and how many stay in memory
+    idempotency_ttl_seconds: float = 86400.0
+    idempotency_pending_timeout_seconds: float = 60.0
+    idempotency_cache_max_entries: int = 10000
+
+    # Live stock stream: distinct sweets buffered per client before it must
+    # resync, burst coalescing window and idle heartbeat interval
+    stream_max_pending: int = 1000
+    stream_coalesce_seconds: float = 0.05
+    stream_heartbeat_seconds: float = 15.0
+
+    # Admission control per router (JSON object keyed by router tag); routers
+    # not listed, such as the live stock stream, are always admitted
+    admission_control: bool = True
+    admission_routes: Dict[str, RouteAdmission] = {
+        "auth": RouteAdmission(
+            max_concurrency=16, max_queue=64, p99_target_ms=2000.0, requests_per_minute=120
+        ),
+        "sweets": RouteAdmission(
+            max_concurrency=64, max_queue=256, p99_target_ms=250.0, requests_per_minute=1200
+        ),
+        "inventory": RouteAdmission(
+            max_concurrency=32, max_queue=128, p99_target_ms=250.0, requests_per_minute=600
+        ),
+    }
+
+    # Response compression (brotli is offered only when the brotli package
+    # from requirements.txt is installed);
+    # smaller bodies are sent as they are
+    compression_minimum_size: int = 1024
+    gzip_level: int = 6
+    brotli_quality: int = 5
+
+    # Bearer token Prometheus must send to scrape /metrics; open when unset
+    metrics_token: Optional[str] = None
+
+    # bcrypt worker pool; requests beyond workers + queue get 503
+    password_hash_workers: int = 4
+    password_hash_max_queue: int = 32
+
+
+settings = Settings()
@@ -1,19 +1,101 @@
-from sqlalchemy import create_engine
+from typing import Any, Dict
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from .config import settings
+from .metrics import instrument_engine
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sweet_shop.db"
+# Async drivers used by the API for each synchronous URL scheme
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+
+def to_async_url(url: str) -> str:
+    """Swap a synchronous database URL onto its async driver"""
+    parsed = make_url(url)
+    if parsed.drivername in ASYNC_DRIVERS.values():
+        return url
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {parsed.get_backend_name()}")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """Pool and driver options for an engine, built from settings"""
+    parsed = make_url(url)
+    is_sqlite = parsed.get_backend_name() == "sqlite"
+    pre_ping = settings.db_pool_pre_ping
+    options: Dict[str, Any] = {"pool_pre_ping": not is_sqlite if pre_ping is None else pre_ping}
+    if is_sqlite:
+        if parsed.drivername == "sqlite":
+            options["connect_args"] = {"check_same_thread": False}
+        if parsed.database in (None, "", ":memory:"):
+            # In-memory databases use a single shared connection, not a queue pool
+            return options
+    options.update(
+        # Pick the queue pool explicitly; some async dialects default to NullPool
+        poolclass=AsyncAdaptedQueuePool if parsed.drivername in ASYNC_DRIVERS.values() else QueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_recycle=settings.db_pool_recycle_seconds,
+    )
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune each new SQLite connection for concurrent readers and writers"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
+    finally:
+        cursor.close()
+
+
+def apply_sqlite_pragmas(sync_engine: Engine) -> None:
+    """Register the SQLite pragma hook on an engine (no-op for other databases)"""
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", _set_sqlite_pragmas)
+
+
+SQLALCHEMY_DATABASE_URL = settings.database_url
+ASYNC_SQLALCHEMY_DATABASE_URL = settings.async_database_url or to_async_url(SQLALCHEMY_DATABASE_URL)
+
+# Synchronous engine for schema creation and the scripts/ CLIs
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
+apply_sqlite_pragmas(engine)
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine used by the API so queries don't block the event loop
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL, **engine_options(ASYNC_SQLALCHEMY_DATABASE_URL)
+)
+apply_sqlite_pragmas(async_engine.sync_engine)
+instrument_engine(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 
-def get_db():
-    """Dependency to get database session"""
+async def get_db():
+    """Dependency to get an async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_sync_db():
+    """Dependency to get a synchronous session, for blocking work run in the threadpool"""
     db = SessionLocal()
     try:
         yield db
@@ -21,7 +103,38 @@ def get_db():
         db.close()
 
 
+# Columns added to tables that existing databases already have, with the
+# indexes over them. create_all() only creates missing tables, so init_db()
+# adds these in place
+ADDED_COLUMNS = {
+    "sweets": {"reorder_threshold": "INTEGER NOT NULL DEFAULT 0"},
+}
+ADDED_INDEXES = {
+    "sweets": ("ix_sweets_stock_margin",),
+}
+
+
+def add_missing_columns(bind: Engine) -> None:
+    """Add ADDED_COLUMNS absent from existing tables, then their ADDED_INDEXES"""
+    existing_tables = set(inspect(bind).get_table_names())
+    for table_name, columns in ADDED_COLUMNS.items():
+        if table_name not in existing_tables:
+            continue
+        present = {column["name"] for column in inspect(bind).get_columns(table_name)}
+        missing = {name: ddl for name, ddl in columns.items() if name not in present}
+        if not missing:
+            continue
+        table = Base.metadata.tables[table_name]
+        with bind.begin() as conn:
+            for name, ddl in missing.items():
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {ddl}"))
+            # The columns are new, so the indexes over them can't exist yet
+            for index in table.indexes:
+                if index.name in ADDED_INDEXES.get(table_name, ()):
+                    index.create(conn)
+
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
-
+    add_missing_columns(engine)
@@ -0,0 +1,89 @@
+"""
+In-process pub/sub hub for live stock changes.
+
+The inventory routes publish a compact event per changed sweet; each
+connected stream holds a small pending map keyed by sweet, so a burst of
+changes to one sweet collapses into its latest value. When a slow client
+lets more distinct sweets pile up than its limit, the oldest pending
+events are dropped and the client is told to resync instead of the hub
+buffering without bound.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Set
+
+
+class Subscription:
+    """One consumer's coalescing, bounded queue of events"""
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self._pending: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self.coalesced = 0
+        self.dropped = 0
+        self.needs_resync = False
+
+    def push(self, key: Hashable, event: Dict[str, Any]) -> None:
+        """Queue an event, replacing any pending event with the same key"""
+        if key in self._pending:
+            del self._pending[key]
+            self.coalesced += 1
+        elif len(self._pending) >= self.max_pending:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+            self.needs_resync = True
+        self._pending[key] = event
+        self._wakeup.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait until events are pending; returns False on timeout"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """Take every pending event, oldest first"""
+        events = list(self._pending.values())
+        self._pending.clear()
+        self._wakeup.clear()
+        return events
+
+
+class StockEventHub:
+    """Fans published events out to every subscription"""
+
+    def __init__(self):
+        self._subscriptions: Set[Subscription] = set()
+        self.published = 0
+
+    def subscribe(self, max_pending: int) -> Subscription:
+        subscription = Subscription(max_pending)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    def publish(self, key: Hashable, event: Dict[str, Any]) -> None:
+        """Deliver an event to every subscriber (call from the event loop thread)"""
+        self.published += 1
+        for subscription in self._subscriptions:
+            subscription.push(key, event)
+
+    def publish_stock(self, rows: Iterable[Any]) -> None:
+        """Publish the new quantity of each updated sweet row"""
+        for row in rows:
+            self.publish(("stock", row.id), {"type": "stock", "id": row.id, "quantity": row.quantity})
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "subscribers": len(self._subscriptions),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in self._subscriptions),
+        }
+
+
+stock_events = StockEventHub()
@@ -0,0 +1,76 @@
+"""
+Bounded worker pool for bcrypt hashing and verification.
+
+bcrypt deliberately costs hundreds of milliseconds, so running it inline
+in an ``async def`` handler stalls the event loop. Work is handed to a
+fixed-size thread pool (bcrypt releases the GIL); once the number of
+running plus queued jobs reaches the limit, new jobs are rejected
+immediately so callers can shed load instead of piling up.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the pool's queue is full"""
+
+
+class PasswordHashPool:
+    """Thread pool with a queue-depth limit and saturation counters"""
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self.peak_pending = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    def _timed(self, fn: Callable, *args) -> Any:
+        with self._lock:
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._running -= 1
+                self.busy_seconds += elapsed
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run `fn(*args)` on the pool, raising PoolSaturatedError if it is full"""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PoolSaturatedError("password hashing pool is saturated")
+            self._pending += 1
+            self.submitted += 1
+            self.peak_pending = max(self.peak_pending, self._pending)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self) -> Dict[str, float]:
+        """Snapshot of pool saturation metrics"""
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "peak_pending": self.peak_pending,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "busy_seconds": self.busy_seconds,
+            }
@@ -0,0 +1,226 @@
+"""
+Idempotency-Key support for the inventory routes.
+
+A client that sends ``Idempotency-Key`` with a purchase or restock can
+retry it safely: the first request reserves the key in the
+``idempotency_keys`` table, runs the handler and stores the encoded
+response; duplicates replay that response without running the handler
+again. Recent results are also kept in an in-memory LRU so replays skip
+the database.
+
+Handlers store the response themselves with ``record()``, in the same
+transaction as their stock change, so a key is either still pending with
+no stock taken or complete with its response. That is what makes taking
+over a key left pending by a crashed request safe.
+
+Only successful responses are stored. A failed request changes no stock,
+so its reservation is released and a retry simply runs again. A retry
+that arrives while the first request is still running on another worker
+gets 409; on the same worker it waits and then replays.
+"""
+import asyncio
+import hashlib
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from fastapi import HTTPException, Response, status
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .config import settings
+from .models import IdempotencyKey
+from .ttl_cache import TTLCache
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Expired rows are deleted on every this-many reservations
+PRUNE_EVERY = 100
+
+
+@dataclass
+class Reservation:
+    """A key claimed by the request being handled"""
+    key: str
+    adapter: TypeAdapter
+    # The encoded response, once recorded
+    body: Optional[bytes] = None
+
+
+_current: ContextVar[Optional[Reservation]] = ContextVar("idempotency_reservation", default=None)
+
+
+class IdempotencyStore:
+    """Keyed store of completed responses with per-key serialisation"""
+
+    def __init__(self, ttl_seconds: float, pending_timeout_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.pending_timeout_seconds = pending_timeout_seconds
+        self._results = TTLCache(max_size=max_entries, ttl_seconds=ttl_seconds)
+        # scoped key -> [lock, number of requests holding or waiting on it]
+        self._locks: Dict[str, List[Any]] = {}
+        self._reservations = 0
+        self.executions = 0
+        self.replays = 0
+
+    async def run(
+        self,
+        db: AsyncSession,
+        key: Optional[str],
+        user_id: int,
+        route: str,
+        request: BaseModel,
+        adapter: TypeAdapter,
+        handler: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        Run `handler` at most once per key and return its encoded response.
+        Without a key the handler's result is returned unchanged.
+        """
+        if key is None:
+            return await handler()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters"
+            )
+
+        scoped_key = f"{user_id}:{route}:{key}"
+        fingerprint = hashlib.sha256(request.model_dump_json().encode()).hexdigest()
+        entry = self._locks.setdefault(scoped_key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                stored = self._results.get(scoped_key) or await self._load(db, scoped_key)
+                if stored is not None:
+                    return self._replay(stored, fingerprint)
+                await self._reserve(db, scoped_key, fingerprint)
+                reservation = Reservation(scoped_key, adapter)
+                token = _current.set(reservation)
+                try:
+                    result = await handler()
+                except BaseException:
+                    await db.rollback()
+                    # A response committed before the failure stays, so a retry replays it
+                    await db.execute(
+                        delete(IdempotencyKey)
+                        .where(IdempotencyKey.key == scoped_key, IdempotencyKey.status_code.is_(None))
+                    )
+                    await db.commit()
+                    raise
+                finally:
+                    _current.reset(token)
+                if reservation.body is None:
+                    # The handler had nothing of its own to commit the response with
+                    await self.record(db, result, reservation)
+                    await db.commit()
+                self._results.set(scoped_key, (fingerprint, status.HTTP_200_OK, reservation.body))
+                self.executions += 1
+                return Response(content=reservation.body, media_type="application/json")
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[scoped_key]
+
+    def current(self) -> Optional[Reservation]:
+        """The reservation of the request being handled, if it sent a key"""
+        return _current.get()
+
+    async def record(self, db: AsyncSession, result: Any, reservation: Optional[Reservation] = None) -> None:
+        """
+        Store `result` as the response for a reservation (by default the
+        current request's) in `db`'s transaction; the caller commits it with
+        the stock change. Does nothing for a request without a key.
+        """
+        reservation = reservation or _current.get()
+        if reservation is None:
+            return
+        body = reservation.adapter.dump_json(reservation.adapter.validate_python(result, from_attributes=True))
+        await db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key == reservation.key)
+            .values(status_code=status.HTTP_200_OK, body=body.decode())
+        )
+        reservation.body = body
+
+    def _replay(self, stored: tuple, fingerprint: str) -> Response:
+        stored_fingerprint, status_code, body = stored
+        if stored_fingerprint != fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"{IDEMPOTENCY_HEADER} was already used for a different request"
+            )
+        self.replays += 1
+        return Response(
+            content=body,
+            status_code=status_code,
+            media_type="application/json",
+            headers={REPLAYED_HEADER: "true"},
+        )
+
+    async def _load(self, db: AsyncSession, scoped_key: str) -> Optional[tuple]:
+        """Fetch a completed, unexpired result from the database"""
+        row = (await db.execute(
+            select(IdempotencyKey.fingerprint, IdempotencyKey.status_code, IdempotencyKey.body)
+            .where(
+                IdempotencyKey.key == scoped_key,
+                IdempotencyKey.status_code.is_not(None),
+                IdempotencyKey.created_at >= self._cutoff(self.ttl_seconds),
+            )
+        )).first()
+        if row is None:
+            return None
+        stored = (row.fingerprint, row.status_code, row.body.encode())
+        self._results.set(scoped_key, stored)
+        return stored
+
+    async def _reserve(self, db: AsyncSession, scoped_key: str, fingerprint: str) -> None:
+        """Claim the key for this request, taking over expired or abandoned rows"""
+        await db.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.key == scoped_key,
+                (IdempotencyKey.created_at < self._cutoff(self.ttl_seconds))
+                | (
+                    IdempotencyKey.status_code.is_(None)
+                    & (IdempotencyKey.created_at < self._cutoff(self.pending_timeout_seconds))
+                ),
+            )
+        )
+        self._reservations += 1
+        if self._reservations % PRUNE_EVERY == 0:
+            await db.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.created_at < self._cutoff(self.ttl_seconds))
+            )
+        try:
+            await db.execute(
+                insert(IdempotencyKey).values(
+                    key=scoped_key, fingerprint=fingerprint, created_at=datetime.utcnow()
+                )
+            )
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is already in progress"
+            )
+
+    @staticmethod
+    def _cutoff(seconds: float) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=seconds)
+
+    def clear(self) -> None:
+        self._results.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"executions": self.executions, "replays": self.replays, "in_flight": len(self._locks)}
+
+
+idempotency_store = IdempotencyStore(
+    ttl_seconds=settings.idempotency_ttl_seconds,
+    pending_timeout_seconds=settings.idempotency_pending_timeout_seconds,
+    max_entries=settings.idempotency_cache_max_entries,
+)
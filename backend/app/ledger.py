@@ -0,0 +1,117 @@
+"""
+Inventory movement ledger.
+
+Every stock change appends a row to ``stock_movements`` in the same
+transaction as the change itself, and folds into ``stock_rollups``: one
+row per hour, sweet and movement kind holding the net quantity, revenue
+and movement count. Reports read the rollups (per sweet, or grouped by
+category or hour) and never scan the ledger.
+
+A change costs two extra statements in its transaction: one multi-row
+insert into the ledger and one multi-row upsert of the rollups.
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import Executable, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from .models import StockMovement, StockRollup
+
+PURCHASE = "purchase"
+RESTOCK = "restock"
+# Admin edits to a sweet's quantity, including its initial stock
+ADJUSTMENT = "adjustment"
+
+
+@dataclass
+class Movement:
+    sweet_id: int
+    delta: int
+    kind: str
+    unit_price: float
+    category: str
+    user_id: Optional[int] = None
+    created_at: datetime = field(default_factory=datetime.utcnow)
+
+
+def movement_for(row: Any, delta: int, kind: str, user_id: Optional[int] = None) -> Movement:
+    """Describe a change to a sweet row (or anything with its columns)"""
+    return Movement(row.id, delta, kind, row.price, row.category, user_id)
+
+
+def _hour(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _rollup_insert(db):
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(StockRollup)
+
+
+def _ledger_statements(db, movements: Sequence[Movement]) -> List[Tuple[Executable, Optional[list]]]:
+    """The ledger insert and rollup upsert for some movements, with their parameters"""
+    movements = [m for m in movements if m.delta]
+    if not movements:
+        return []
+
+    statements: List[Tuple[Executable, Optional[list]]] = [(
+        insert(StockMovement),
+        [
+            {
+                "sweet_id": m.sweet_id,
+                "delta": m.delta,
+                "kind": m.kind,
+                "unit_price": m.unit_price,
+                "user_id": m.user_id,
+                "created_at": m.created_at,
+            }
+            for m in movements
+        ],
+    )]
+
+    # Pre-aggregate so each rollup row is touched once per transaction
+    totals: Dict[Tuple[datetime, int, str], Dict[str, Any]] = defaultdict(
+        lambda: {"quantity": 0, "revenue": 0.0, "movements": 0}
+    )
+    for m in movements:
+        total = totals[(_hour(m.created_at), m.sweet_id, m.kind)]
+        total["category"] = m.category
+        total["quantity"] += m.delta
+        total["movements"] += 1
+        if m.kind == PURCHASE:
+            total["revenue"] += -m.delta * m.unit_price
+
+    stmt = _rollup_insert(db).values(
+        [
+            {"hour": hour, "sweet_id": sweet_id, "kind": kind, **total}
+            for (hour, sweet_id, kind), total in totals.items()
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StockRollup.hour, StockRollup.sweet_id, StockRollup.kind],
+        set_={
+            "category": stmt.excluded.category,
+            "quantity": StockRollup.quantity + stmt.excluded.quantity,
+            "revenue": StockRollup.revenue + stmt.excluded.revenue,
+            "movements": StockRollup.movements + stmt.excluded.movements,
+        },
+    )
+    statements.append((stmt, None))
+    return statements
+
+
+async def record_movements(db: AsyncSession, movements: Sequence[Movement]) -> None:
+    """Append movements to the ledger and update the rollups (the caller commits)"""
+    for stmt, params in _ledger_statements(db, movements):
+        await db.execute(stmt, params)
+
+
+def record_movements_sync(db: Session, movements: Sequence[Movement]) -> None:
+    """record_movements() for synchronous sessions, such as the catalogue importer"""
+    for stmt, params in _ledger_statements(db, movements):
+        db.execute(stmt, params)
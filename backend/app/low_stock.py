@@ -0,0 +1,79 @@
+"""
+Incremental low-stock detection.
+
+Every stock mutation already returns the changed sweet's row, including
+its reorder threshold, so the watcher only has to compare two integers
+and check set membership per change to notice a threshold crossing. It
+never rescans the catalogue. Crossings are published on the live stock
+stream as ``low_stock`` events. The set of low sweet ids is loaded from
+the database once, through the stock-margin index, on startup.
+
+The set is per process and only decides when to publish; the admin
+low-stock list is read from the database, which every worker shares.
+"""
+import asyncio
+from typing import Any, Dict, Iterable, Set
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .events import StockEventHub, stock_events
+from .models import Sweet
+
+
+def is_low(row: Any) -> bool:
+    return row.quantity <= row.reorder_threshold
+
+
+class LowStockWatcher:
+    """Publishes sweets crossing their reorder threshold"""
+
+    def __init__(self, hub: StockEventHub):
+        self.hub = hub
+        self._low: Set[int] = set()
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self.crossings = 0
+
+    async def ensure_loaded(self, db: AsyncSession) -> None:
+        """Seed the set from the database the first time it is needed"""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            rows = await db.scalars(select(Sweet.id).where(Sweet.quantity - Sweet.reorder_threshold <= 0))
+            # Changes observed while loading are already in the database
+            self._low = set(rows)
+            self._loaded = True
+
+    def observe(self, rows: Iterable[Any]) -> None:
+        """Check changed sweet rows for threshold crossings (O(1) per row)"""
+        for row in rows:
+            was_low = row.id in self._low
+            now_low = is_low(row)
+            if now_low:
+                self._low.add(row.id)
+            else:
+                self._low.discard(row.id)
+            if now_low != was_low:
+                self.crossings += 1
+                self.hub.publish(("low_stock", row.id), {
+                    "type": "low_stock",
+                    "id": row.id,
+                    "quantity": row.quantity,
+                    "reorder_threshold": row.reorder_threshold,
+                    "low": now_low,
+                })
+
+    def forget(self, sweet_id: int) -> None:
+        """Stop tracking a deleted sweet"""
+        self._low.discard(sweet_id)
+
+    def reset(self) -> None:
+        self._low.clear()
+        self._loaded = False
+
+    def stats(self) -> Dict[str, int]:
+        return {"low_stock": len(self._low), "crossings": self.crossings}
+
+
+low_stock_watcher = LowStockWatcher(stock_events)
@@ -1,9 +1,29 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .database import init_db
-from .routes import auth, sweets, inventory
+from .admission import AdmissionControlMiddleware, admission_controller
+from .compression import CompressionMiddleware
+from .config import settings
+from .metrics import MetricsMiddleware
+from .database import AsyncSessionLocal, init_db
+from .low_stock import low_stock_watcher
+from .purchase_queue import purchase_batcher
+from .stock_counters import stock_counters
+from .idempotency import REPLAYED_HEADER
+from .pagination import NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER
+from .routes import auth, sweets, inventory, stream, analytics, admin, metrics
 
-app = FastAPI(title="Sweet Shop Management API", version="1.0.0")
+# Endpoints returning models or dicts are encoded with orjson
+app = FastAPI(
+    title="Sweet Shop Management API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
+
+# Added before CORS so rejected requests still get CORS headers
+if settings.admission_control:
+    app.add_middleware(AdmissionControlMiddleware, controller=admission_controller)
+app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_minimum_size)
 
 # CORS middleware to allow frontend to connect
 app.add_middleware(
@@ -12,18 +32,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER, REPLAYED_HEADER],
 )
+# Outermost, so request timings include every other middleware
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(auth.router)
+# Before sweets so /api/sweets/stream isn't captured by /api/sweets/{sweet_id}
+app.include_router(stream.router)
 app.include_router(sweets.router)
 app.include_router(inventory.router)
+app.include_router(analytics.router)
+app.include_router(admin.router)
+app.include_router(metrics.router)
 
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
     init_db()
+    async with AsyncSessionLocal() as db:
+        await low_stock_watcher.ensure_loaded(db)
+    if settings.hot_sweet_ids:
+        await stock_counters.start(settings.hot_sweet_ids, settings.stock_flush_interval_seconds)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Commit any queued purchases and counter deltas before exiting"""
+    await purchase_batcher.stop()
+    await stock_counters.stop()
 
 
 @app.get("/")
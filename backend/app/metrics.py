@@ -0,0 +1,299 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Request latency is recorded by MetricsMiddleware per method, route
+template and status; database statement counts and durations come from
+engine events (instrument_engine). Recording costs a dict lookup, a
+bisect over the bucket bounds and a few additions under an uncontended
+per-metric lock; the lock is needed because the synchronous engine's
+hooks fire on threadpool threads (e.g. the catalogue import). Other
+components keep their own counters, which are only read when /metrics
+is scraped.
+"""
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+NAMESPACE = "sweet_shop"
+# Upper bounds in seconds; requests and queries share them
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Leading SQL keywords used as the operation label; anything else is "other"
+_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+# (label values, value) pairs for one metric
+Samples = Iterable[Tuple[Dict[str, str], float]]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(dict(zip(self.labels, key)))} {_format_value(value)}"
+            for key, value in values
+        ]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(Counter):
+    """Value that goes up and down, optionally split by labels"""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, *label_values: str) -> None:
+        self.inc(-amount, *label_values)
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)  # per bucket, not cumulative; last is +Inf
+        self.total = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """Bucketed distribution of observations, optionally split by labels"""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], _HistogramSeries] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = _HistogramSeries(len(self.buckets))
+            series.counts[bucket] += 1
+            series.total += value
+            series.count += 1
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return series.count if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [
+                (key, list(series.counts), series.total, series.count)
+                for key, series in sorted(self._series.items())
+            ]
+        lines = []
+        for key, counts, total, count in snapshot:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+class MetricsRegistry:
+    """Metrics owned by this module plus collectors read at scrape time"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, Samples]]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Samples]]]) -> None:
+        """`collector` returns (name, help, samples) for untyped metrics"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} untyped")
+                lines.extend(
+                    f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples
+                )
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        for metric in self._metrics:
+            metric.reset()
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.register(Histogram(
+    f"{NAMESPACE}_http_request_duration_seconds",
+    "Time to complete HTTP requests",
+    labels=("method", "route", "status"),
+))
+http_requests_in_flight = registry.register(Gauge(
+    f"{NAMESPACE}_http_requests_in_flight",
+    "HTTP requests currently being handled",
+))
+db_query_duration = registry.register(Histogram(
+    f"{NAMESPACE}_db_query_duration_seconds",
+    "Time to execute database statements",
+    labels=("operation",),
+))
+db_query_errors = registry.register(Counter(
+    f"{NAMESPACE}_db_query_errors_total",
+    "Database statements that raised an error",
+    labels=("operation",),
+))
+stock_operations = registry.register(Counter(
+    f"{NAMESPACE}_stock_operations_total",
+    "Committed purchases and restocks (a batch purchase counts once)",
+    labels=("kind",),
+))
+stock_units = registry.register(Counter(
+    f"{NAMESPACE}_stock_units_total",
+    "Units purchased or restocked",
+    labels=("kind",),
+))
+
+
+def record_stock(kind: str, units: int) -> None:
+    """Count one committed purchase or restock of `units` units"""
+    stock_operations.inc(1, kind)
+    stock_units.inc(units, kind)
+
+
+# -- database ---------------------------------------------------------------
+
+def _operation(statement: str) -> str:
+    keyword = statement.lstrip()[:6].upper()
+    return keyword if keyword in _OPERATIONS else "other"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is not None:
+        db_query_duration.observe(time.perf_counter() - started, _operation(statement))
+
+
+def _handle_error(exception_context):
+    statement = exception_context.statement
+    db_query_errors.inc(1, _operation(statement) if statement else "other")
+
+
+def instrument_engine(sync_engine: Engine) -> None:
+    """Record statement timings and errors for an engine (idempotent)"""
+    if event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+# -- requests ---------------------------------------------------------------
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request against its route template"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._templates: Optional[Dict[object, str]] = None
+
+    def _route(self, scope: Scope) -> str:
+        # The router records the matched endpoint in the scope; label by its
+        # path template so ids don't multiply the series
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._templates is None:
+            self._templates = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self._templates.get(endpoint, "unmatched")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            http_request_duration.observe(
+                time.perf_counter() - started, scope["method"], self._route(scope), str(status_code)
+            )
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, Index
 from .database import Base
 
 
@@ -20,4 +21,81 @@ class Sweet(Base):
     category = Column(String, nullable=False)
     price = Column(Float, nullable=False)
     quantity = Column(Integer, default=0, nullable=False)
+    # At or below this quantity the sweet needs reordering (0 = only when sold out)
+    reorder_threshold = Column(Integer, default=0, nullable=False)
 
+    # Serves "quantity <= reorder_threshold" lookups as a range scan
+    __table_args__ = (Index("ix_sweets_stock_margin", quantity - reorder_threshold),)
+
+
+class StockCounterCheckpoint(Base):
+    __tablename__ = "stock_counter_checkpoints"
+
+    id = Column(Integer, primary_key=True)
+    # Last stock journal entry whose delta has been written to sweets
+    last_seq = Column(Integer, nullable=False, default=0)
+
+
+class CacheGeneration(Base):
+    """Version of one cached catalogue scope, bumped in each write's transaction"""
+    __tablename__ = "cache_generations"
+
+    # "catalog", "sweets" or "sweet:<id>"
+    scope = Column(String, primary_key=True)
+    # Random per row, so a recreated database never repeats an old version
+    epoch = Column(String, nullable=False)
+    value = Column(Integer, nullable=False, default=1)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # "<user id>:<route>:<client key>", so keys never collide across users or routes
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    # NULL while the first request with this key is still running
+    status_code = Column(Integer, nullable=True)
+    body = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class StockMovement(Base):
+    """Append-only record of every stock change"""
+    __tablename__ = "stock_movements"
+
+    id = Column(Integer, primary_key=True)
+    # No foreign keys: the ledger outlives deleted sweets and users
+    sweet_id = Column(Integer, nullable=False, index=True)
+    delta = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)
+    unit_price = Column(Float, nullable=False)
+    user_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    # Covers the order-size histogram so it never reads the table itself
+    __table_args__ = (Index("ix_stock_movements_kind_created_delta", "kind", "created_at", "delta"),)
+
+
+class StockRollup(Base):
+    """Hourly totals per sweet and movement kind, maintained with each movement"""
+    __tablename__ = "stock_rollups"
+
+    hour = Column(DateTime, primary_key=True)
+    sweet_id = Column(Integer, primary_key=True)
+    kind = Column(String, primary_key=True)
+    category = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+    movements = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_stock_rollups_category_hour", "category", "hour"),)
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    # A refresh token's jti or a session's sid
+    token_id = Column(String, primary_key=True)
+    # When the last token it covers expires; the row is useless after that
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
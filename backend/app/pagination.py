@@ -0,0 +1,58 @@
+"""
+Keyset pagination and field projection helpers for listing endpoints.
+
+Cursors are opaque to clients: a url-safe base64 encoding of the last id
+seen, so each page is an indexed ``WHERE id > :after ORDER BY id LIMIT n``.
+"""
+import base64
+import json
+from typing import List, Optional
+from fastapi import HTTPException, status
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+
+def encode_cursor(last_id: int) -> str:
+    """Build an opaque cursor pointing after the given id"""
+    raw = json.dumps({"after": last_id}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Return the id a cursor points after, raising 400 if it is malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        after = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))["after"]
+        if not isinstance(after, int):
+            raise ValueError("cursor id must be an integer")
+        return after
+    except (ValueError, KeyError, TypeError, UnicodeEncodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def parse_fields(fields: Optional[str], allowed: List[str]) -> Optional[List[str]]:
+    """
+    Parse a comma-separated `fields=` projection.
+    Returns None when no projection was requested; `id` is always included
+    so clients can keep paging.
+    """
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+    # Keep the model's field order and drop duplicates
+    return [field for field in allowed if field == "id" or field in requested]
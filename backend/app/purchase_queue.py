@@ -0,0 +1,172 @@
+"""
+Write-behind purchase pipeline with group commit.
+
+Purchases are queued to a single asyncio worker that collects them for a
+few milliseconds (or until a batch is full), reserves stock for the whole
+batch in memory from one read, applies one guarded decrement per sweet and
+commits once. Each caller's future resolves only after that commit, so an
+acknowledged purchase is as durable as with a per-request commit while the
+fsync cost is shared by the whole batch.
+"""
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from .config import settings
+from .database import AsyncSessionLocal
+from .idempotency import Reservation, idempotency_store
+from .ledger import PURCHASE, movement_for, record_movements
+from .response_cache import response_cache
+from .stock import (
+    InsufficientStockError,
+    SweetNotFoundError,
+    decrement_stock,
+    get_stock_levels,
+)
+
+
+@dataclass
+class _PendingPurchase:
+    sweet_id: int
+    quantity: int
+    user_id: Optional[int]
+    future: asyncio.Future
+    # The submitting request's Idempotency-Key, whose response commits with the batch
+    reservation: Optional[Reservation] = None
+
+
+class PurchaseBatcher:
+    """Collects purchases and group-commits them"""
+
+    def __init__(self, session_factory, max_batch: int, max_delay_seconds: float):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay_seconds = max_delay_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.purchases = 0
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, sweet_id: int, quantity: int, user_id: Optional[int] = None) -> SimpleNamespace:
+        """
+        Queue a purchase and wait for its group commit.
+        Returns the sweet as of this purchase, or raises SweetNotFoundError /
+        InsufficientStockError.
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(
+            _PendingPurchase(sweet_id, quantity, user_id, future, idempotency_store.current())
+        )
+        return await future
+
+    async def stop(self) -> None:
+        """Commit whatever is queued, then stop the worker"""
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay_seconds
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._commit(batch)
+            except Exception as e:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _commit(self, batch: List[_PendingPurchase]) -> None:
+        async with self.session_factory() as db:
+            # Reserve stock in arrival order against one snapshot of the batch's sweets
+            available = await get_stock_levels(db, {p.sweet_id for p in batch})
+            accepted: Dict[int, List[_PendingPurchase]] = defaultdict(list)
+            failures = []
+            for pending in batch:
+                level = available.get(pending.sweet_id)
+                if level is None:
+                    failures.append((pending, SweetNotFoundError()))
+                elif level < pending.quantity:
+                    failures.append((pending, InsufficientStockError()))
+                else:
+                    available[pending.sweet_id] = level - pending.quantity
+                    accepted[pending.sweet_id].append(pending)
+
+            results = []
+            for sweet_id, purchases in accepted.items():
+                total = sum(p.quantity for p in purchases)
+                row = await decrement_stock(db, sweet_id, total)
+                if row is not None:
+                    # Report each caller the quantity left right after their own purchase
+                    remaining = row.quantity + total
+                    for pending in purchases:
+                        remaining -= pending.quantity
+                        results.append((pending, SimpleNamespace(**{**row._mapping, "quantity": remaining})))
+                    continue
+                # Stock changed outside the batcher since the snapshot; settle one by one
+                for pending in purchases:
+                    row = await decrement_stock(db, sweet_id, pending.quantity)
+                    if row is None:
+                        failures.append((pending, InsufficientStockError()))
+                    else:
+                        results.append((pending, SimpleNamespace(**row._mapping)))
+
+            # Ledger rows and cache invalidation go into the same group commit
+            await record_movements(
+                db, [movement_for(row, -p.quantity, PURCHASE, p.user_id) for p, row in results]
+            )
+            if results:
+                await response_cache.invalidate_sweets(db, {p.sweet_id for p, _ in results})
+            for pending, result in results:
+                if pending.reservation is not None:
+                    await idempotency_store.record(db, result, pending.reservation)
+            await db.commit()
+
+        self.batches += 1
+        self.purchases += len(batch)
+        # Acknowledge only after the group commit
+        for pending, result in results:
+            if not pending.future.done():
+                pending.future.set_result(result)
+        for pending, error in failures:
+            if not pending.future.done():
+                pending.future.set_exception(error)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "purchases": self.purchases,
+            "queued": self._queue.qsize() if self._queue else 0,
+        }
+
+
+purchase_batcher = PurchaseBatcher(
+    AsyncSessionLocal,
+    max_batch=settings.purchase_batch_max_size,
+    max_delay_seconds=settings.purchase_batch_max_delay_seconds,
+)
@@ -0,0 +1,131 @@
+"""
+Sliding-window rate limiting.
+
+Each limiter allows ``limit`` hits per key within any ``window_seconds``.
+It keeps two fixed-window counters per key (the current and the previous
+window) and weights the previous one by how much of it still overlaps the
+sliding window. That gives a smooth limit with O(1) memory per key, with
+no timestamp log.
+
+Counters are stored in a pluggable RateLimitBackend. The in-memory
+backend limits each worker separately. A shared backend (e.g. Redis
+INCR/EXPIRE) enforces one limit across workers, although two workers
+checking the same key at once may both let a hit through.
+"""
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+from .config import settings
+from .ttl_cache import TTLCache
+
+
+class RateLimitBackend(ABC):
+    """Storage interface for rate limit counters"""
+
+    @abstractmethod
+    def get(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    def incr(self, key: str, ttl_seconds: float) -> int:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Process-local counters; the least recently used keys go first when full"""
+
+    def __init__(self, max_keys: int):
+        self._counters = TTLCache(max_size=max_keys, ttl_seconds=60.0)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> int:
+        return self._counters.get(key) or 0
+
+    def incr(self, key: str, ttl_seconds: float) -> int:
+        with self._lock:
+            count = (self._counters.get(key) or 0) + 1
+            self._counters.set(key, count, ttl_seconds=ttl_seconds)
+            return count
+
+    def delete(self, key: str) -> None:
+        self._counters.delete(key)
+
+    def clear(self) -> None:
+        self._counters.clear()
+
+
+class SlidingWindowLimiter:
+    """Allows `limit` hits per key in any `window_seconds`"""
+
+    def __init__(self, name: str, limit: int, window_seconds: float, backend: RateLimitBackend):
+        self.name = name
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.backend = backend
+        self.rejected = 0
+
+    def _window_key(self, key: str, window: int) -> str:
+        return f"{self.name}:{key}:{window}"
+
+    def hit(self, key: str, now: Optional[float] = None) -> float:
+        """
+        Count a hit for `key` if it is within the limit and return 0.
+        Otherwise count nothing and return the seconds until a hit would
+        be allowed.
+        """
+        now = time.time() if now is None else now
+        window = int(now // self.window_seconds)
+        elapsed = now - window * self.window_seconds
+        current = self.backend.get(self._window_key(key, window))
+        previous = self.backend.get(self._window_key(key, window - 1))
+        overlap = 1.0 - elapsed / self.window_seconds
+        if previous * overlap + current < self.limit:
+            # Counters must outlive the next window, where they are "previous"
+            self.backend.incr(self._window_key(key, window), ttl_seconds=2 * self.window_seconds)
+            return 0.0
+        self.rejected += 1
+        return self._retry_after(current, previous, elapsed)
+
+    def _retry_after(self, current: int, previous: int, elapsed: float) -> float:
+        """Time until the weighted count drops below the limit (ignoring new hits)"""
+        if current < self.limit:
+            # Wait for enough of the previous window to slide out
+            wait = self.window_seconds * (1.0 - (self.limit - current) / previous) - elapsed
+        else:
+            # This window is full: wait for it to become the previous one
+            # and slide out far enough
+            wait = self.window_seconds - elapsed + self.window_seconds * (1.0 - self.limit / current)
+        return max(1.0, math.ceil(wait))
+
+    def reset(self, key: str, now: Optional[float] = None) -> None:
+        """Forget the hits counted for `key`"""
+        now = time.time() if now is None else now
+        window = int(now // self.window_seconds)
+        self.backend.delete(self._window_key(key, window))
+        self.backend.delete(self._window_key(key, window - 1))
+
+
+_backend = InMemoryRateLimitBackend(max_keys=settings.rate_limit_max_keys)
+
+# Every login attempt from one address, successful or not
+login_ip_limiter = SlidingWindowLimiter(
+    "login-ip", settings.login_rate_limit_per_ip, settings.login_rate_limit_window_seconds, _backend
+)
+# Login attempts against one username; a successful login clears them
+login_username_limiter = SlidingWindowLimiter(
+    "login-user", settings.login_rate_limit_per_username, settings.login_rate_limit_window_seconds, _backend
+)
+
+
+def clear_rate_limits() -> None:
+    _backend.clear()
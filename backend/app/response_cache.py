@@ -0,0 +1,210 @@
+"""
+Read-through cache for serialised catalogue responses.
+
+Entries are keyed by route and query parameters and hold the encoded JSON
+body plus any response headers. Invalidation is generation based: every
+key embeds the current generation of the scopes it depends on (the whole
+catalogue listing, all sweet details, one sweet's detail), and a write
+bumps only the generations it affects. Stale entries are never read again
+and age out of the LRU.
+
+Generations live in the database (``cache_generations``) and are bumped
+in the same transaction as the write that invalidates them, so every
+worker sees a write as soon as it commits, whichever worker handled it.
+A read costs one primary-key lookup of its generations instead of the
+query it would have run. The catalogue generation doubles as the version
+behind the sweets endpoints' ETags. Every stock write updates the
+``catalog`` row, which adds one more row lock to each write transaction;
+the purchase batcher and the hot-sweet counters amortise it.
+
+The entry storage is pluggable through CacheBackend. Compressed variants
+of an entry are stored under the entry's key plus the encoding, so they
+go stale with it.
+"""
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from .compression import compress, encoded_headers, negotiated_encoding
+from .config import settings
+from .models import CacheGeneration
+from .ttl_cache import TTLCache
+
+# (JSON body, extra response headers)
+CachedResponse = Tuple[bytes, Dict[str, str]]
+
+CATALOG_SCOPE = "catalog"
+ALL_SWEETS_SCOPE = "sweets"
+
+
+# Generations of scopes no write has touched yet
+INITIAL_GENERATION = "0"
+
+# Scope -> "<epoch>-<value>", as read for one request
+Generations = Dict[str, str]
+
+
+def _sweet_scope(sweet_id: int) -> str:
+    return f"sweet:{sweet_id}"
+
+
+class CacheBackend(ABC):
+    """Storage interface for the response cache"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """Process-local backend: an LRU of entries"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self._entries = TTLCache(max_size=max_entries, ttl_seconds=ttl_seconds)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._entries.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries.set(key, value)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class ResponseCache:
+    """Route-level response cache with scoped invalidation and counters"""
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def generations(self, db: AsyncSession, sweet_id: Optional[int] = None) -> Generations:
+        """
+        The shared generations a read depends on: the catalogue's, plus those
+        of the sweet details when `sweet_id` is given. Read them before any
+        data, so a key or ETag is never newer than the body stored under it.
+        """
+        scopes = [CATALOG_SCOPE]
+        if sweet_id is not None:
+            scopes += [ALL_SWEETS_SCOPE, _sweet_scope(sweet_id)]
+        rows = await db.execute(
+            select(CacheGeneration.scope, CacheGeneration.epoch, CacheGeneration.value)
+            .where(CacheGeneration.scope.in_(scopes))
+        )
+        found = {scope: f"{epoch}-{value}" for scope, epoch, value in rows}
+        return {scope: found.get(scope, INITIAL_GENERATION) for scope in scopes}
+
+    def catalog_etag(self, generations: Generations) -> Optional[str]:
+        """
+        Strong ETag for any catalogue representation at these generations,
+        or None before the first catalogue write
+        """
+        version = generations[CATALOG_SCOPE]
+        if version == INITIAL_GENERATION:
+            return None
+        return f'"{version}"'
+
+    def catalog_key(self, generations: Generations, route: str, params: Dict[str, Any]) -> str:
+        """Key for a listing, search or report response"""
+        query = urlencode(sorted((k, v) for k, v in params.items() if v is not None))
+        return f"{CATALOG_SCOPE}:{generations[CATALOG_SCOPE]}:{route}?{query}"
+
+    def sweet_key(self, generations: Generations, sweet_id: int) -> str:
+        """Key for a single sweet's detail response"""
+        return (
+            f"sweet:{sweet_id}:{generations[ALL_SWEETS_SCOPE]}"
+            f".{generations[_sweet_scope(sweet_id)]}"
+        )
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key: str, body: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+        self.backend.set(key, (body, dict(headers or {})))
+
+    def encoded(self, key: str, body: bytes) -> Tuple[bytes, Dict[str, str]]:
+        """
+        A cached body in the current request's negotiated encoding, with the
+        headers to add. Each entry is compressed at most once per encoding.
+        """
+        encoding = negotiated_encoding.get()
+        if encoding is None or len(body) < settings.compression_minimum_size:
+            return body, {}
+        variant_key = f"{key}#{encoding}"
+        compressed = self.backend.get(variant_key)
+        if compressed is None:
+            compressed = compress(body, encoding)
+            self.backend.set(variant_key, compressed)
+        return compressed, encoded_headers(encoding)
+
+    def _bump(self, db, scopes: Iterable[str]):
+        """Upsert that bumps some scopes' generations, in a fixed lock order"""
+        if db.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        scopes = sorted(set(scopes))
+        self.invalidations += len(scopes)
+        stmt = insert(CacheGeneration).values(
+            [{"scope": scope, "epoch": uuid.uuid4().hex[:12], "value": 1} for scope in scopes]
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[CacheGeneration.scope],
+            set_={"value": CacheGeneration.value + 1},
+        )
+
+    @staticmethod
+    def _sweet_scopes(sweet_ids: Iterable[int]) -> List[str]:
+        return [CATALOG_SCOPE] + [_sweet_scope(sweet_id) for sweet_id in sweet_ids]
+
+    async def invalidate_sweets(self, db: AsyncSession, sweet_ids: Iterable[int]) -> None:
+        """Drop listings plus the detail entries of the given sweets (the caller commits)"""
+        await db.execute(self._bump(db, self._sweet_scopes(sweet_ids)))
+
+    def invalidate_all_sync(self, db: Session) -> None:
+        """Drop every cached catalogue response, e.g. in a bulk import (the caller commits)"""
+        db.execute(self._bump(db, [CATALOG_SCOPE, ALL_SWEETS_SCOPE]))
+
+    def clear(self) -> None:
+        """Drop every entry and reset the counters"""
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Hit ratio and invalidation counters"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+response_cache = ResponseCache(
+    InMemoryCacheBackend(
+        max_entries=settings.response_cache_max_entries,
+        ttl_seconds=settings.response_cache_ttl_seconds,
+    )
+)
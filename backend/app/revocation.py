@@ -0,0 +1,145 @@
+"""
+Revocation list for refresh tokens and sessions.
+
+Revoked ids (a refresh token's ``jti`` once it has been rotated, or a
+whole session's ``sid`` on logout or token reuse) are stored in
+``revoked_tokens`` until the tokens they cover expire. Each worker mirrors
+the table into a Bloom filter, so checking a token that was never revoked
+(almost every request) costs a few hash probes and no query. Only filter
+hits are confirmed against the table.
+
+Workers pick up each other's revocations by polling for new rows every
+``revocation_sync_seconds``. A logout on one worker therefore takes up to
+that long to reach the others. ``revoked_at`` is stamped before the
+row commits, so a poll can pass a row that is still in flight; each poll
+therefore re-reads ``revocation_sync_overlap_seconds`` behind the newest
+row it has seen.
+"""
+import asyncio
+import hashlib
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .config import settings
+from .models import RevokedToken
+from .ttl_cache import TTLCache
+
+# Expired rows are deleted on every this-many revocations
+PRUNE_EVERY = 100
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Double hashing: k probes from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    """Bloom-filtered view of the revoked_tokens table"""
+
+    def __init__(self, capacity: int, error_rate: float, sync_seconds: float, sync_overlap_seconds: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_seconds = sync_seconds
+        self.sync_overlap = timedelta(seconds=sync_overlap_seconds)
+        self._sync_lock = asyncio.Lock()
+        self._revocations = 0
+        self.lookups = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self._bloom = BloomFilter(self.capacity, self.error_rate)
+        self._confirmed: Set[str] = set()
+        # Filter hits the table didn't confirm, until the next sync could change that
+        self._cleared = TTLCache(max_size=1024, ttl_seconds=self.sync_seconds)
+        self._high_water: Optional[datetime] = None
+        self._synced_at: Optional[float] = None
+
+    async def _sync(self, db: AsyncSession) -> None:
+        """Load rows revoked since the last sync (all live rows the first time)"""
+        if self._synced_at is not None and time.monotonic() - self._synced_at < self.sync_seconds:
+            return
+        async with self._sync_lock:
+            if self._synced_at is not None and time.monotonic() - self._synced_at < self.sync_seconds:
+                return
+            if self._bloom.count > self.capacity:
+                # Expired ids never leave the filter; start over from live rows
+                self.reset()
+            stmt = select(RevokedToken.token_id, RevokedToken.revoked_at).where(
+                RevokedToken.expires_at > datetime.utcnow()
+            )
+            if self._high_water is not None:
+                stmt = stmt.where(RevokedToken.revoked_at >= self._high_water - self.sync_overlap)
+            for token_id, revoked_at in await db.execute(stmt):
+                if token_id not in self._bloom:
+                    # Rows in the overlap come back every sync; count each id once
+                    self._bloom.add(token_id)
+                if self._high_water is None or revoked_at > self._high_water:
+                    self._high_water = revoked_at
+            self._synced_at = time.monotonic()
+
+    async def is_revoked(self, db: AsyncSession, token_id: str) -> bool:
+        await self._sync(db)
+        if token_id not in self._bloom:
+            return False
+        if token_id in self._confirmed:
+            return True
+        if self._cleared.get(token_id):
+            return False
+        self.lookups += 1
+        found = await db.scalar(select(RevokedToken.token_id).where(RevokedToken.token_id == token_id))
+        if found is None:
+            self._cleared.set(token_id, True)
+            return False
+        self._confirmed.add(token_id)
+        return True
+
+    async def revoke(self, db: AsyncSession, token_id: str, expires_at: datetime) -> None:
+        """
+        Record a revocation (the caller commits). Raises IntegrityError if
+        the id was already revoked.
+        """
+        self._revocations += 1
+        if self._revocations % PRUNE_EVERY == 0:
+            await db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= datetime.utcnow()))
+        await db.execute(
+            insert(RevokedToken).values(
+                token_id=token_id, expires_at=expires_at, revoked_at=datetime.utcnow()
+            )
+        )
+        self._bloom.add(token_id)
+        self._confirmed.add(token_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {"filtered": self._bloom.count, "confirmed": len(self._confirmed), "lookups": self.lookups}
+
+
+revocation_list = RevocationList(
+    capacity=settings.revocation_bloom_capacity,
+    error_rate=settings.revocation_bloom_error_rate,
+    sync_seconds=settings.revocation_sync_seconds,
+    sync_overlap_seconds=settings.revocation_sync_overlap_seconds,
+)
@@ -0,0 +1,27 @@
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_db
+from ..models import Sweet, User
+from ..schemas import SweetResponse
+from ..auth import get_current_admin_user
+from ..stock import SWEET_COLUMNS
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+
+@router.get("/low-stock", response_model=List[SweetResponse])
+async def get_low_stock(
+    threshold: Optional[int] = Query(None, ge=0, description="Overrides each sweet's reorder threshold"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Sweets at or below their reorder threshold, most urgent first (Admin only)"""
+    if threshold is None:
+        # A range scan of the stock-margin index, already in the order we want
+        margin = Sweet.quantity - Sweet.reorder_threshold
+    else:
+        margin = Sweet.quantity - threshold
+    rows = await db.execute(select(*SWEET_COLUMNS).where(margin <= 0).order_by(margin, Sweet.id))
+    return [dict(row._mapping) for row in rows]
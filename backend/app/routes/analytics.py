@@ -0,0 +1,219 @@
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from fastapi import APIRouter, Depends, Query, Response
+from pydantic import TypeAdapter
+from sqlalchemy import Select, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..analytics import BUCKET_HOURS, bucket_totals, percentiles_from_histogram
+from ..database import get_db
+from ..ledger import PURCHASE
+from ..models import StockMovement, StockRollup, Sweet, User
+from ..auth import get_current_admin_user
+from ..response_cache import response_cache
+from ..schemas import (
+    CategoryRevenue,
+    OrderSizeReport,
+    SalesBucket,
+    StockValueReport,
+    TopSeller,
+)
+
+router = APIRouter(prefix="/api/admin/analytics", tags=["analytics"])
+
+ORDER_SIZE_PERCENTILES = (50, 90, 99)
+
+_category_revenue_adapter = TypeAdapter(List[CategoryRevenue])
+_top_sellers_adapter = TypeAdapter(List[TopSeller])
+_stock_value_adapter = TypeAdapter(StockValueReport)
+_sales_adapter = TypeAdapter(List[SalesBucket])
+_order_sizes_adapter = TypeAdapter(OrderSizeReport)
+
+
+async def _cached(
+    db: AsyncSession,
+    report: str,
+    params: Dict[str, Any],
+    adapter: TypeAdapter,
+    compute: Callable[[], Awaitable[Any]],
+) -> Response:
+    """
+    Serve a report from the response cache. Reports are keyed by catalogue
+    version, so any stock or catalogue write recomputes them.
+    """
+    generations = await response_cache.generations(db)
+    cache_key = response_cache.catalog_key(generations, f"analytics/{report}", params)
+    cached = response_cache.get(cache_key)
+    if cached is None:
+        body = adapter.dump_json(adapter.validate_python(await compute(), from_attributes=True))
+        response_cache.set(cache_key, body)
+        cached = (body, {})
+    body, headers = response_cache.encoded(cache_key, cached[0])
+    return Response(content=body, media_type="application/json", headers={**cached[1], **headers})
+
+
+def _purchase_rollups(stmt: Select, since: Optional[datetime], until: Optional[datetime]) -> Select:
+    """Restrict a rollup query to purchases in [since, until)"""
+    stmt = stmt.where(StockRollup.kind == PURCHASE)
+    if since is not None:
+        stmt = stmt.where(StockRollup.hour >= since.replace(minute=0, second=0, microsecond=0))
+    if until is not None:
+        stmt = stmt.where(StockRollup.hour < until)
+    return stmt
+
+
+@router.get("/revenue-by-category", response_model=List[CategoryRevenue])
+async def revenue_by_category(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Units sold and revenue per category (Admin only)"""
+    async def compute():
+        revenue = func.sum(StockRollup.revenue).label("revenue")
+        stmt = _purchase_rollups(
+            select(StockRollup.category, (-func.sum(StockRollup.quantity)).label("units"), revenue)
+            .group_by(StockRollup.category)
+            .order_by(revenue.desc()),
+            since, until,
+        )
+        return (await db.execute(stmt)).all()
+
+    return await _cached(
+        db, "revenue-by-category", {"since": since, "until": until},
+        _category_revenue_adapter, compute,
+    )
+
+
+@router.get("/top-sellers", response_model=List[TopSeller])
+async def top_sellers(
+    limit: int = Query(10, ge=1, le=100),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Best-selling sweets by units sold (Admin only)"""
+    async def compute():
+        units = (-func.sum(StockRollup.quantity)).label("units")
+        totals = _purchase_rollups(
+            select(StockRollup.sweet_id, units, func.sum(StockRollup.revenue).label("revenue"))
+            .group_by(StockRollup.sweet_id)
+            .order_by(units.desc(), StockRollup.sweet_id)
+            .limit(limit),
+            since, until,
+        ).subquery()
+        stmt = (
+            select(totals, Sweet.name, Sweet.category)
+            .outerjoin(Sweet, Sweet.id == totals.c.sweet_id)
+            .order_by(totals.c.units.desc(), totals.c.sweet_id)
+        )
+        return (await db.execute(stmt)).all()
+
+    return await _cached(
+        db, "top-sellers", {"limit": limit, "since": since, "until": until},
+        _top_sellers_adapter, compute,
+    )
+
+
+@router.get("/stock-value", response_model=StockValueReport)
+async def stock_value(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Value of stock on hand at list price, per category (Admin only)"""
+    async def compute():
+        value = func.sum(Sweet.price * Sweet.quantity).label("value")
+        rows = (await db.execute(
+            select(
+                Sweet.category,
+                func.count(Sweet.id).label("sweets"),
+                func.sum(Sweet.quantity).label("units"),
+                value,
+            )
+            .group_by(Sweet.category)
+            .order_by(value.desc())
+        )).all()
+        return {
+            "total_value": sum(row.value for row in rows),
+            "total_units": sum(row.units for row in rows),
+            "categories": rows,
+        }
+
+    return await _cached(db, "stock-value", {}, _stock_value_adapter, compute)
+
+
+@router.get("/sales", response_model=List[SalesBucket])
+async def sales_over_time(
+    bucket: str = Query("day", pattern=f"^({'|'.join(BUCKET_HOURS)})$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Units sold and revenue per hour, day or week (Admin only)"""
+    async def compute():
+        # SQL collapses sweets into hourly totals; bucketing those is columnar
+        rows = (await db.execute(
+            _purchase_rollups(
+                select(
+                    StockRollup.hour,
+                    (-func.sum(StockRollup.quantity)).label("units"),
+                    func.sum(StockRollup.revenue).label("revenue"),
+                )
+                .group_by(StockRollup.hour)
+                .order_by(StockRollup.hour),
+                since, until,
+            )
+        )).all()
+        buckets = bucket_totals(
+            [row.hour for row in rows],
+            {"units": [row.units for row in rows], "revenue": [row.revenue for row in rows]},
+            bucket,
+        )
+        return [
+            {"start": start, "units": int(totals["units"]), "revenue": totals["revenue"]}
+            for start, totals in buckets
+        ]
+
+    return await _cached(
+        db, "sales", {"bucket": bucket, "since": since, "until": until},
+        _sales_adapter, compute,
+    )
+
+
+@router.get("/order-sizes", response_model=OrderSizeReport)
+async def order_sizes(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Distribution of units per purchase line (Admin only)"""
+    async def compute():
+        size = (-StockMovement.delta).label("size")
+        stmt = (
+            select(size, func.count().label("purchases"))
+            .where(StockMovement.kind == PURCHASE)
+            .group_by(size)
+            .order_by(size)
+        )
+        if since is not None:
+            stmt = stmt.where(StockMovement.created_at >= since)
+        if until is not None:
+            stmt = stmt.where(StockMovement.created_at < until)
+        # Sizes repeat heavily, so the histogram is tiny even over millions of rows
+        histogram = (await db.execute(stmt)).all()
+        sizes = [row.size for row in histogram]
+        counts = [row.purchases for row in histogram]
+        purchases = sum(counts)
+        values = percentiles_from_histogram(sizes, counts, ORDER_SIZE_PERCENTILES)
+        return {
+            "purchases": purchases,
+            "mean": sum(s * c for s, c in zip(sizes, counts)) / purchases if purchases else 0.0,
+            "percentiles": {f"p{q}": v for q, v in zip(ORDER_SIZE_PERCENTILES, values)},
+        }
+
+    return await _cached(
+        db, "order-sizes", {"since": since, "until": until}, _order_sizes_adapter, compute
+    )
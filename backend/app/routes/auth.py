@@ -1,28 +1,36 @@
-from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import get_db
 from ..models import User
-from ..schemas import UserCreate, UserResponse, Token
+from ..schemas import RefreshRequest, UserCreate, UserResponse, Token
 from ..auth import (
-    get_password_hash,
+    get_password_hash_async,
     get_user_by_username,
     get_user_by_email,
     authenticate_user,
-    create_access_token,
-    get_current_user,
-    ACCESS_TOKEN_EXPIRE_MINUTES,
+    decode_refresh_token,
+    issue_tokens,
+    oauth2_scheme,
+    resolve_user,
+    verify_access_token,
+    get_current_user_record,
+    REFRESH_TOKEN_EXPIRE_DAYS,
 )
+from ..rate_limit import login_ip_limiter, login_username_limiter
+from ..revocation import revocation_list
+from ..tokens import keyring
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """Register a new user"""
     # Check if username already exists
-    db_user = get_user_by_username(db, username=user.username)
+    db_user = await get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -30,7 +38,7 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         )
     
     # Check if email already exists
-    db_user = get_user_by_email(db, email=user.email)
+    db_user = await get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -38,7 +46,7 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     db_user = User(
         username=user.username,
         email=user.email,
@@ -46,34 +54,110 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         is_admin=False
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
+def _throttle_login(request: Request, username: str) -> None:
+    """Count a login attempt, raising 429 before any password work if over the limit"""
+    client_ip = request.client.host if request.client else "unknown"
+    retry_after = login_ip_limiter.hit(client_ip) or login_username_limiter.hit(username)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, please retry later",
+            headers={"Retry-After": str(int(retry_after))},
+        )
+
+
 @router.post("/login", response_model=Token)
 async def login(
-    form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+    request: Request,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_db),
 ):
     """Login and receive JWT token"""
-    user = authenticate_user(db, form_data.username, form_data.password)
+    _throttle_login(request, form_data.username)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username, "is_admin": user.is_admin}, expires_delta=access_token_expires
+    login_username_limiter.reset(form_data.username)
+    return issue_tokens(user)
+
+
+def _refresh_rejected(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+
+
+@router.post("/refresh", response_model=Token)
+async def refresh(request: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Exchange a refresh token for a new token pair. Each refresh token works
+    once; presenting a used one again revokes the whole session.
+    """
+    payload = decode_refresh_token(request.refresh_token)
+    session_id, token_id = payload["sid"], payload["jti"]
+    expires_at = datetime.utcfromtimestamp(payload["exp"])
+    if await revocation_list.is_revoked(db, session_id):
+        raise _refresh_rejected("Session has been revoked")
+    if await revocation_list.is_revoked(db, token_id):
+        # Someone kept a copy of a rotated token: end the session for everyone.
+        # Later tokens of the session outlive this one, so cover them all
+        try:
+            await revocation_list.revoke(
+                db, session_id, datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+            )
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+        raise _refresh_rejected("Refresh token has already been used")
+    user = await resolve_user(db, payload["sub"])
+    try:
+        await revocation_list.revoke(db, token_id, expires_at)
+    except IntegrityError:
+        # Lost a race with a concurrent refresh of the same token
+        await db.rollback()
+        raise _refresh_rejected("Refresh token has already been used")
+    tokens = issue_tokens(user, session_id=session_id)
+    await db.commit()
+    return tokens
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    """End the session: its access and refresh tokens stop working"""
+    payload = await verify_access_token(db, token)
+    session_id = payload.get("sid")
+    if session_id:
+        try:
+            await revocation_list.revoke(
+                db, session_id, datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+            )
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_info(
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user_record)
 ):
     """Get current authenticated user information"""
     return current_user
 
+
+@router.get("/jwks.json")
+async def get_jwks():
+    """Public keys that verify access tokens (empty when tokens use a shared secret)"""
+    return keyring.public_jwks()
+
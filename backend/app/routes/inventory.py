@@ -1,19 +1,145 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from typing import Dict, List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import get_db
-from ..models import User, Sweet
-from ..schemas import PurchaseRequest, RestockRequest, SweetResponse
+from ..models import User
+from ..schemas import (
+    PurchaseRequest,
+    BatchPurchaseRequest,
+    RestockRequest,
+    SweetResponse,
+)
 from ..auth import get_current_user, get_current_admin_user
+from ..events import stock_events
+from ..response_cache import response_cache
+from ..config import settings
+from ..idempotency import IDEMPOTENCY_HEADER, idempotency_store
+from ..low_stock import low_stock_watcher
+from ..metrics import record_stock
+from ..ledger import PURCHASE, RESTOCK, movement_for, record_movements
+from ..purchase_queue import purchase_batcher
+from ..stock_counters import stock_counters
+from ..stock import (
+    InsufficientStockError,
+    SweetNotFoundError,
+    decrement_stock,
+    increment_stock,
+    get_stock_levels,
+    purchase_stock,
+)
 
 router = APIRouter(prefix="/api/sweets", tags=["inventory"])
 
+_sweet_adapter = TypeAdapter(SweetResponse)
+_sweet_list_adapter = TypeAdapter(List[SweetResponse])
+
+
+@router.post("/purchase/batch", response_model=List[SweetResponse])
+async def purchase_sweets_batch(
+    batch: BatchPurchaseRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+):
+    """Purchase several sweets in one all-or-nothing transaction"""
+    if not batch.items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Batch must contain at least one item"
+        )
+    
+    # Merge repeated lines for the same sweet, keeping first-seen order
+    requested: Dict[int, int] = {}
+    for item in batch.items:
+        if item.quantity <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Purchase quantity must be greater than 0"
+            )
+        requested[item.sweet_id] = requested.get(item.sweet_id, 0) + item.quantity
+    
+    return await idempotency_store.run(
+        db, idempotency_key, current_user.id, "purchase/batch", batch, _sweet_list_adapter,
+        lambda: _purchase_batch(db, requested, current_user.id),
+    )
+
+
+async def _purchase_batch(db: AsyncSession, requested: Dict[int, int], user_id: int):
+    """Take stock for a validated, merged batch"""
+    # Hot sweets are served by the in-memory counters, the rest by the database
+    hot = {sweet_id: qty for sweet_id, qty in requested.items() if stock_counters.is_hot(sweet_id)}
+    cold = {sweet_id: qty for sweet_id, qty in requested.items() if sweet_id not in hot}
+    
+    # Validate every line against the catalogue with a single query
+    stock = await get_stock_levels(db, cold)
+    missing = [sweet_id for sweet_id in cold if sweet_id not in stock]
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Sweet not found: {', '.join(map(str, missing))}"
+        )
+    short = [sweet_id for sweet_id, quantity in cold.items() if stock[sweet_id] < quantity]
+    if short:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient quantity available: {', '.join(map(str, short))}"
+        )
+    
+    # Apply all decrements in one transaction; the guarded UPDATE still
+    # protects against a concurrent purchase between the check and the write
+    rows = {}
+    for sweet_id, quantity in cold.items():
+        row = await decrement_stock(db, sweet_id, quantity)
+        if row is None:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient quantity available: {sweet_id}"
+            )
+        rows[sweet_id] = row
+    await record_movements(
+        db, [movement_for(row, -cold[sweet_id], PURCHASE, user_id) for sweet_id, row in rows.items()]
+    )
+    if rows:
+        await response_cache.invalidate_sweets(db, rows)
+    
+    # Hot lines last, so a shortfall there only has to roll back the transaction.
+    # They are only reserved until the commit succeeds, then journalled
+    if hot:
+        try:
+            rows.update((row.id, row) for row in stock_counters.reserve(hot))
+        except InsufficientStockError:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient quantity available: {', '.join(map(str, hot))}"
+            )
+    
+    # The stored response for an Idempotency-Key commits with the stock change
+    rows = [rows[sweet_id] for sweet_id in requested]
+    try:
+        await idempotency_store.record(db, rows)
+        await db.commit()
+    except Exception:
+        if hot:
+            stock_counters.release(hot)
+        raise
+    if hot:
+        stock_counters.confirm(hot, user_id)
+    record_stock(PURCHASE, sum(requested.values()))
+    stock_events.publish_stock(rows)
+    low_stock_watcher.observe(rows)
+    return rows
+
 
 @router.post("/{sweet_id}/purchase", response_model=SweetResponse)
 async def purchase_sweet(
     sweet_id: int,
     purchase: PurchaseRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
 ):
     """Purchase a sweet, decreasing its quantity"""
     if purchase.quantity <= 0:
@@ -22,31 +148,58 @@ async def purchase_sweet(
             detail="Purchase quantity must be greater than 0"
         )
     
-    db_sweet = db.query(Sweet).filter(Sweet.id == sweet_id).first()
-    if not db_sweet:
+    return await idempotency_store.run(
+        db, idempotency_key, current_user.id, f"purchase/{sweet_id}", purchase, _sweet_adapter,
+        lambda: _purchase(db, sweet_id, purchase.quantity, current_user.id),
+    )
+
+
+async def _purchase(db: AsyncSession, sweet_id: int, quantity: int, user_id: int):
+    """Take stock for one purchase through the configured stock engine"""
+    try:
+        if stock_counters.is_hot(sweet_id) and idempotency_store.current() is None:
+            row = stock_counters.purchase(sweet_id, quantity, user_id)
+        elif stock_counters.is_hot(sweet_id):
+            # Journal only once the stored response has committed, so a retry
+            # after a failure can't take the stock twice
+            lines = {sweet_id: quantity}
+            row = stock_counters.reserve(lines)[0]
+            try:
+                await idempotency_store.record(db, row)
+                await db.commit()
+            except Exception:
+                stock_counters.release(lines)
+                raise
+            stock_counters.confirm(lines, user_id)
+        elif settings.purchase_batching:
+            row = await purchase_batcher.submit(sweet_id, quantity, user_id)
+        else:
+            # Check and decrement in one guarded UPDATE so concurrent purchases can't oversell
+            row = await purchase_stock(db, sweet_id, quantity, user_id)
+    except SweetNotFoundError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Sweet not found"
         )
-    
-    if db_sweet.quantity < purchase.quantity:
+    except InsufficientStockError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Insufficient quantity available"
         )
     
-    db_sweet.quantity -= purchase.quantity
-    db.commit()
-    db.refresh(db_sweet)
-    return db_sweet
+    record_stock(PURCHASE, quantity)
+    stock_events.publish_stock([row])
+    low_stock_watcher.observe([row])
+    return row
 
 
 @router.post("/{sweet_id}/restock", response_model=SweetResponse)
 async def restock_sweet(
     sweet_id: int,
     restock: RestockRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
 ):
     """Restock a sweet, increasing its quantity (Admin only)"""
     if restock.quantity <= 0:
@@ -55,15 +208,37 @@ async def restock_sweet(
             detail="Restock quantity must be greater than 0"
         )
     
-    db_sweet = db.query(Sweet).filter(Sweet.id == sweet_id).first()
-    if not db_sweet:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Sweet not found"
-        )
-    
-    db_sweet.quantity += restock.quantity
-    db.commit()
-    db.refresh(db_sweet)
-    return db_sweet
+    return await idempotency_store.run(
+        db, idempotency_key, current_user.id, f"restock/{sweet_id}", restock, _sweet_adapter,
+        lambda: _restock(db, sweet_id, restock.quantity, current_user.id),
+    )
 
+
+async def _restock(db: AsyncSession, sweet_id: int, quantity: int, user_id: int):
+    """Add stock to one sweet"""
+    hot = stock_counters.is_hot(sweet_id)
+    if hot and idempotency_store.current() is None:
+        row = stock_counters.restock(sweet_id, quantity, user_id)
+    else:
+        # With an Idempotency-Key the restock commits with its stored response,
+        # so a hot sweet is restocked in the database like an admin edit
+        if hot:
+            await stock_counters.flush()
+        row = await increment_stock(db, sweet_id, quantity)
+        if row is None:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Sweet not found"
+            )
+        await record_movements(db, [movement_for(row, quantity, RESTOCK, user_id)])
+        await response_cache.invalidate_sweets(db, [sweet_id])
+        await idempotency_store.record(db, row)
+        await db.commit()
+        if hot:
+            stock_counters.sync_from_row(row)
+    
+    record_stock(RESTOCK, quantity)
+    stock_events.publish_stock([row])
+    low_stock_watcher.observe([row])
+    return row
@@ -0,0 +1,70 @@
+import secrets
+from typing import Dict, Iterable, Optional, Tuple
+from fastapi import APIRouter, Header, HTTPException, Response, status
+from ..admission import admission_controller
+from ..auth import password_pool, user_cache
+from ..config import settings
+from ..database import async_engine
+from ..events import stock_events
+from ..idempotency import idempotency_store
+from ..low_stock import low_stock_watcher
+from ..metrics import NAMESPACE, Samples, registry
+from ..purchase_queue import purchase_batcher
+from ..rate_limit import login_ip_limiter, login_username_limiter
+from ..response_cache import response_cache
+from ..revocation import revocation_list
+from ..stock_counters import stock_counters
+
+router = APIRouter(tags=["metrics"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _component(name: str, stats: Dict[str, float], help_text: str) -> Iterable[Tuple[str, str, Samples]]:
+    """One untyped metric per numeric field of a component's stats()"""
+    for field, value in stats.items():
+        if isinstance(value, (int, float)):
+            yield f"{NAMESPACE}_{name}_{field}", f"{help_text}: {field.replace('_', ' ')}", [({}, value)]
+
+
+def _collect_components() -> Iterable[Tuple[str, str, Samples]]:
+    # bcrypt time is busy_seconds; saturation shows in queued and rejected
+    yield from _component("password_hash", password_pool.stats(), "bcrypt pool")
+    yield from _component("response_cache", response_cache.stats(), "Catalogue response cache")
+    yield from _component("user_cache", user_cache.stats(), "Authenticated-user cache")
+    yield from _component("purchase_batcher", purchase_batcher.stats(), "Purchase group commit")
+    yield from _component("stock_counters", stock_counters.stats(), "Hot-sweet stock counters")
+    yield from _component("stock_stream", stock_events.stats(), "Live stock stream")
+    yield from _component("low_stock", low_stock_watcher.stats(), "Low-stock watcher")
+    yield from _component("idempotency", idempotency_store.stats(), "Idempotency keys")
+    yield from _component("revocation", revocation_list.stats(), "Token revocation list")
+    pool = async_engine.pool
+    if hasattr(pool, "checkedout"):
+        yield from _component(
+            "db_pool", {"checked_out": pool.checkedout(), "idle": pool.checkedin()}, "Database connection pool"
+        )
+    yield (
+        f"{NAMESPACE}_login_throttled",
+        "Login attempts rejected by the rate limiter",
+        [({"limit": "ip"}, login_ip_limiter.rejected), ({"limit": "username"}, login_username_limiter.rejected)],
+    )
+    groups = admission_controller.stats()
+    for field in ("limit", "in_flight", "queued", "admitted", "shed", "over_quota", "p99_seconds"):
+        yield (
+            f"{NAMESPACE}_admission_{field}",
+            f"Admission control per router: {field.replace('_', ' ')}",
+            [({"router": name}, stats[field]) for name, stats in groups.items()],
+        )
+
+
+registry.add_collector(_collect_components)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus scrape endpoint"""
+    if settings.metrics_token is not None and not secrets.compare_digest(
+        authorization or "", f"Bearer {settings.metrics_token}"
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,63 @@
+import asyncio
+import json
+from collections import defaultdict
+from typing import AsyncIterator
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..config import settings
+from ..database import get_db
+from ..events import StockEventHub, stock_events
+from ..models import User
+from ..auth import get_stream_reader
+
+router = APIRouter(prefix="/api/sweets", tags=["stream"])
+
+
+def _sse_message(event_type: str, data) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def sse_events(request: Request, hub: StockEventHub) -> AsyncIterator[str]:
+    """Yield server-sent events for one client until it disconnects"""
+    subscription = hub.subscribe(settings.stream_max_pending)
+    try:
+        yield "retry: 3000\n\n"
+        while not await request.is_disconnected():
+            if not await subscription.wait(settings.stream_heartbeat_seconds):
+                # Comment lines keep proxies from closing an idle stream
+                yield ": ping\n\n"
+                continue
+            # Let a burst settle so it goes out as one message per event type
+            await asyncio.sleep(settings.stream_coalesce_seconds)
+            if subscription.needs_resync:
+                subscription.needs_resync = False
+                yield _sse_message("resync", {})
+            batches = defaultdict(list)
+            for event in subscription.drain():
+                batches[event["type"]].append({k: v for k, v in event.items() if k != "type"})
+            for event_type, events in batches.items():
+                yield _sse_message(event_type, events)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+@router.get("/stream")
+async def stream_stock_changes(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_stream_reader),
+):
+    """
+    Stream live stock changes as server-sent events.
+    Each `stock` event carries a list of {id, quantity}, and `low_stock`
+    events report sweets crossing their reorder threshold; a `resync` event
+    means updates were dropped and the client should reload the listing.
+    """
+    # The stream can stay open for hours; don't hold a pooled connection for it
+    await db.close()
+    return StreamingResponse(
+        sse_events(request, stock_events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
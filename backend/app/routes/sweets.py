@@ -1,24 +1,90 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+import io
+from typing import Dict, List, Optional, Sequence
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File, Response, Header
+from sqlalchemy import Row, func, select
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from ..database import get_db
+from starlette.concurrency import run_in_threadpool
+from ..database import get_db, get_sync_db
 from ..models import User, Sweet
-from ..schemas import SweetCreate, SweetUpdate, SweetResponse, SearchParams
-from ..auth import get_current_user, get_current_admin_user
+from ..schemas import SweetCreate, SweetUpdate, SweetResponse, SearchParams, SweetImportResult
+from ..auth import get_current_reader, get_current_admin_user
+from ..pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    TOTAL_COUNT_HEADER,
+    encode_cursor,
+    decode_cursor,
+    parse_fields,
+)
+from ..search import apply_text_search
+from ..events import stock_events
+from ..low_stock import low_stock_watcher
+from ..ledger import ADJUSTMENT, movement_for, record_movements
+from ..response_cache import response_cache
+from ..stock import SWEET_COLUMNS
+from ..stock_counters import stock_counters
+from ..catalog_import import SUPPORTED_FORMATS, detect_format, import_sweets
+from ..compression import SUPPORTED_ENCODINGS, encoded_etag
 
 router = APIRouter(prefix="/api/sweets", tags=["sweets"])
 
+_sweet_adapter = TypeAdapter(SweetResponse)
+# List endpoints select these columns, in SweetResponse's field order, and
+# encode the rows directly instead of building ORM and Pydantic objects
+_RESPONSE_FIELDS = list(SweetResponse.model_fields)
+
+
+def _encode_rows(rows: Sequence[Row], fields: Sequence[str]) -> bytes:
+    """Encode column-select rows as a JSON list of objects"""
+    return orjson.dumps([dict(zip(fields, row)) for row in rows])
+
+
+def _json_response(
+    cache_key: str, body: bytes, headers: Optional[Dict[str, str]] = None, etag: Optional[str] = None
+) -> Response:
+    """Wrap a cached JSON body, compressed for the client if it accepts that"""
+    body, encoding_headers = response_cache.encoded(cache_key, body)
+    headers = {**(headers or {}), **encoding_headers}
+    if etag:
+        encoding = encoding_headers.get("Content-Encoding")
+        headers.update(_etag_headers(encoded_etag(etag, encoding) if encoding else etag))
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _etag_headers(etag: str) -> Dict[str, str]:
+    # Clients may store the body but must revalidate it before reuse
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def _not_modified(if_none_match: Optional[str], etag: Optional[str]) -> Optional[Response]:
+    """
+    Return a 304 response if the client already holds this catalogue version,
+    in any content-coding; the 304 repeats the validator of the variant it holds
+    """
+    if not if_none_match or etag is None:
+        return None
+    current = {etag, *(encoded_etag(etag, encoding) for encoding in SUPPORTED_ENCODINGS)}
+    for candidate in (tag.strip() for tag in if_none_match.split(",")):
+        if candidate == "*":
+            candidate = etag
+        if candidate in current:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_etag_headers(candidate))
+    return None
+
 
 @router.post("", response_model=SweetResponse, status_code=status.HTTP_201_CREATED)
 async def create_sweet(
     sweet: SweetCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user),
 ):
     """Create a new sweet (Admin only)"""
     # Check if sweet with same name already exists
-    db_sweet = db.query(Sweet).filter(Sweet.name == sweet.name).first()
+    db_sweet = await db.scalar(select(Sweet).where(Sweet.name == sweet.name))
     if db_sweet:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -27,19 +93,114 @@ async def create_sweet(
     
     db_sweet = Sweet(**sweet.model_dump())
     db.add(db_sweet)
-    db.commit()
-    db.refresh(db_sweet)
+    await db.flush()
+    await record_movements(db, [movement_for(db_sweet, db_sweet.quantity, ADJUSTMENT, current_user.id)])
+    await response_cache.invalidate_sweets(db, [db_sweet.id])
+    await db.commit()
+    await db.refresh(db_sweet)
+    low_stock_watcher.observe([db_sweet])
     return db_sweet
 
 
+@router.post("/import", response_model=SweetImportResult)
+async def import_sweets_file(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, description="csv or ndjson; guessed from the file name if omitted"),
+    db: AsyncSession = Depends(get_db),
+    sync_db: Session = Depends(get_sync_db),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Bulk create or update sweets by name from a CSV or NDJSON file (Admin only)"""
+    fmt = format or detect_format(file.filename)
+    if fmt not in SUPPORTED_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported import format, expected one of: {', '.join(SUPPORTED_FORMATS)}"
+        )
+    
+    # Hot sweets' counter deltas must be in the table before imported
+    # quantities replace it, as for an admin edit
+    await stock_counters.flush()
+    
+    # Read the spooled upload line by line rather than loading it into memory.
+    # Parsing and validation are CPU-bound and the importer is synchronous, so
+    # it runs in the threadpool on its own session, off the event loop
+    lines = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    
+    def run_import() -> SweetImportResult:
+        try:
+            return import_sweets(sync_db, lines, fmt, user_id=current_user.id)
+        except Exception:
+            sync_db.rollback()
+            raise
+    
+    try:
+        return await run_in_threadpool(run_import)
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Import file must be UTF-8 encoded"
+        )
+    finally:
+        # Chunks commit as they go, so even a failed import may have changed rows
+        hot_ids = stock_counters.hot_ids()
+        if hot_ids:
+            for row in await db.execute(select(*SWEET_COLUMNS).where(Sweet.id.in_(hot_ids))):
+                stock_counters.sync_from_row(row)
+        # Nothing else reloads the watcher once the app is running
+        low_stock_watcher.reset()
+        await low_stock_watcher.ensure_loaded(db)
+
+
 @router.get("", response_model=List[SweetResponse])
 async def list_sweets(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,name,price"),
+    include_total: bool = Query(False, description="Return the catalogue size in X-Total-Count"),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_reader),
 ):
-    """Get all available sweets"""
-    sweets = db.query(Sweet).all()
-    return sweets
+    """Get available sweets, one keyset-paginated page at a time"""
+    selected = parse_fields(fields, list(SweetResponse.model_fields))
+    after = decode_cursor(cursor)
+    
+    # Read the version before any data so the ETag is never newer than the body
+    generations = await response_cache.generations(db)
+    etag = response_cache.catalog_etag(generations)
+    not_modified = _not_modified(if_none_match, etag)
+    if not_modified is not None:
+        return not_modified
+    
+    cache_key = response_cache.catalog_key(generations, "list", {
+        "limit": limit,
+        "after": after,
+        "fields": ",".join(selected) if selected else None,
+        "include_total": include_total,
+    })
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return _json_response(cache_key, *cached, etag=etag)
+    
+    fields = selected or _RESPONSE_FIELDS
+    stmt = select(*[getattr(Sweet, field) for field in fields]).order_by(Sweet.id)
+    if after is not None:
+        stmt = stmt.where(Sweet.id > after)
+    # Fetch one extra row to learn whether another page exists
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+    
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].id)
+    if include_total:
+        headers[TOTAL_COUNT_HEADER] = str(await db.scalar(select(func.count(Sweet.id))))
+    
+    # Returned as a raw body, so a projection isn't checked against response_model
+    body = _encode_rows(rows, fields)
+    response_cache.set(cache_key, body, headers)
+    return _json_response(cache_key, body, headers, etag=etag)
 
 
 @router.get("/search", response_model=List[SweetResponse])
@@ -48,50 +209,84 @@ async def search_sweets(
     category: str = Query(None),
     min_price: float = Query(None),
     max_price: float = Query(None),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    fuzzy: bool = Query(False, description="Also match close misspellings of each word"),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_reader),
 ):
     """Search sweets by name, category, or price range"""
-    query = db.query(Sweet)
+    generations = await response_cache.generations(db)
+    etag = response_cache.catalog_etag(generations)
+    not_modified = _not_modified(if_none_match, etag)
+    if not_modified is not None:
+        return not_modified
+    
+    cache_key = response_cache.catalog_key(generations, "search", {
+        "name": name,
+        "category": category,
+        "min_price": min_price,
+        "max_price": max_price,
+        "fuzzy": fuzzy,
+    })
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return _json_response(cache_key, *cached, etag=etag)
+    
+    stmt = await apply_text_search(
+        db,
+        select(*[getattr(Sweet, field) for field in _RESPONSE_FIELDS]),
+        name=name, category=category, fuzzy=fuzzy,
+    )
     
-    if name:
-        query = query.filter(Sweet.name.ilike(f"%{name}%"))
-    if category:
-        query = query.filter(Sweet.category.ilike(f"%{category}%"))
     if min_price is not None:
-        query = query.filter(Sweet.price >= min_price)
+        stmt = stmt.where(Sweet.price >= min_price)
     if max_price is not None:
-        query = query.filter(Sweet.price <= max_price)
+        stmt = stmt.where(Sweet.price <= max_price)
     
-    sweets = query.all()
-    return sweets
+    body = _encode_rows((await db.execute(stmt)).all(), _RESPONSE_FIELDS)
+    response_cache.set(cache_key, body)
+    return _json_response(cache_key, body, etag=etag)
 
 
 @router.get("/{sweet_id}", response_model=SweetResponse)
 async def get_sweet(
     sweet_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_reader),
 ):
     """Get a specific sweet by ID"""
-    sweet = db.query(Sweet).filter(Sweet.id == sweet_id).first()
+    generations = await response_cache.generations(db, sweet_id)
+    etag = response_cache.catalog_etag(generations)
+    not_modified = _not_modified(if_none_match, etag)
+    if not_modified is not None:
+        return not_modified
+    
+    cache_key = response_cache.sweet_key(generations, sweet_id)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return _json_response(cache_key, *cached, etag=etag)
+    
+    sweet = await db.get(Sweet, sweet_id)
     if not sweet:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Sweet not found"
         )
-    return sweet
+    body = _sweet_adapter.dump_json(_sweet_adapter.validate_python(sweet, from_attributes=True))
+    response_cache.set(cache_key, body)
+    return _json_response(cache_key, body, etag=etag)
 
 
 @router.put("/{sweet_id}", response_model=SweetResponse)
 async def update_sweet(
     sweet_id: int,
     sweet_update: SweetUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user),
 ):
     """Update a sweet (Admin only)"""
-    db_sweet = db.query(Sweet).filter(Sweet.id == sweet_id).first()
+    db_sweet = await db.get(Sweet, sweet_id)
     if not db_sweet:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -102,35 +297,55 @@ async def update_sweet(
     
     # Check if updating name would create duplicate
     if "name" in update_data and update_data["name"] != db_sweet.name:
-        existing = db.query(Sweet).filter(Sweet.name == update_data["name"]).first()
+        existing = await db.scalar(select(Sweet).where(Sweet.name == update_data["name"]))
         if existing:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Sweet with this name already exists"
             )
     
+    hot = stock_counters.is_hot(sweet_id)
+    if hot:
+        # Write out counter deltas first so the edit applies on top of them
+        await stock_counters.flush()
+        await db.refresh(db_sweet)
+    
+    previous_quantity = db_sweet.quantity
     for field, value in update_data.items():
         setattr(db_sweet, field, value)
+    if db_sweet.quantity != previous_quantity:
+        await record_movements(
+            db, [movement_for(db_sweet, db_sweet.quantity - previous_quantity, ADJUSTMENT, current_user.id)]
+        )
+    await response_cache.invalidate_sweets(db, [sweet_id])
     
-    db.commit()
-    db.refresh(db_sweet)
+    await db.commit()
+    await db.refresh(db_sweet)
+    if hot:
+        stock_counters.sync_from_row(db_sweet)
+    if "quantity" in update_data:
+        stock_events.publish_stock([db_sweet])
+    low_stock_watcher.observe([db_sweet])
     return db_sweet
 
 
 @router.delete("/{sweet_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_sweet(
     sweet_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user),
 ):
     """Delete a sweet (Admin only)"""
-    db_sweet = db.query(Sweet).filter(Sweet.id == sweet_id).first()
+    db_sweet = await db.get(Sweet, sweet_id)
     if not db_sweet:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Sweet not found"
         )
-    db.delete(db_sweet)
-    db.commit()
+    await db.delete(db_sweet)
+    await response_cache.invalidate_sweets(db, [sweet_id])
+    await db.commit()
+    stock_counters.forget(sweet_id)
+    low_stock_watcher.forget(sweet_id)
     return None
 
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from datetime import datetime
+from typing import Dict, List, Optional
 
 
 class UserBase(BaseModel):
@@ -27,6 +28,11 @@ class UserResponse(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
@@ -38,6 +44,7 @@ class SweetBase(BaseModel):
     category: str
     price: float
     quantity: int
+    reorder_threshold: int = 0
 
 
 class SweetCreate(SweetBase):
@@ -49,6 +56,7 @@ class SweetUpdate(BaseModel):
     category: Optional[str] = None
     price: Optional[float] = None
     quantity: Optional[int] = None
+    reorder_threshold: Optional[int] = None
 
 
 class SweetResponse(SweetBase):
@@ -58,10 +66,30 @@ class SweetResponse(SweetBase):
         from_attributes = True
 
 
+class SweetImportError(BaseModel):
+    line: int
+    error: str
+
+
+class SweetImportResult(BaseModel):
+    imported: int
+    failed: int
+    errors: List[SweetImportError]
+
+
 class PurchaseRequest(BaseModel):
     quantity: int = 1
 
 
+class PurchaseLine(BaseModel):
+    sweet_id: int
+    quantity: int = 1
+
+
+class BatchPurchaseRequest(BaseModel):
+    items: List[PurchaseLine]
+
+
 class RestockRequest(BaseModel):
     quantity: int
 
@@ -72,3 +100,42 @@ class SearchParams(BaseModel):
     min_price: Optional[float] = None
     max_price: Optional[float] = None
 
+
+
+class CategoryRevenue(BaseModel):
+    category: str
+    units: int
+    revenue: float
+
+
+class TopSeller(BaseModel):
+    sweet_id: int
+    name: Optional[str] = None  # None once the sweet has been deleted
+    category: Optional[str] = None
+    units: int
+    revenue: float
+
+
+class CategoryStockValue(BaseModel):
+    category: str
+    sweets: int
+    units: int
+    value: float
+
+
+class StockValueReport(BaseModel):
+    total_value: float
+    total_units: int
+    categories: List[CategoryStockValue]
+
+
+class SalesBucket(BaseModel):
+    start: datetime
+    units: int
+    revenue: float
+
+
+class OrderSizeReport(BaseModel):
+    purchases: int
+    mean: float
+    percentiles: Dict[str, float]
@@ -0,0 +1,147 @@
+"""
+Full-text search over sweets backed by an SQLite FTS5 index.
+
+``sweets_fts`` is an external-content FTS5 table over ``sweets(name,
+category)`` kept in sync by triggers, so every writer (routes, scripts,
+bulk import) updates it in the same transaction. Queries use prefix
+matching, bm25 ranking (name weighted above category) and optional typo
+tolerance via the index vocabulary. Other databases fall back to ILIKE.
+"""
+import difflib
+import re
+from typing import List, Optional
+from sqlalchemy import Select, bindparam, column, event, literal_column, table, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import Base
+from .models import Sweet
+
+FTS_TABLE = "sweets_fts"
+VOCAB_TABLE = "sweets_fts_vocab"
+
+# Candidate corrections per misspelled token and how similar they must be
+FUZZY_MAX_CANDIDATES = 3
+FUZZY_CUTOFF = 0.75
+
+_CREATE_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        name, category,
+        content='sweets', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"CREATE VIRTUAL TABLE {VOCAB_TABLE} USING fts5vocab({FTS_TABLE}, 'row')",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES('rank', 'bm25(2.0, 1.0)')",
+    f"""CREATE TRIGGER sweets_fts_ai AFTER INSERT ON sweets BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, category) VALUES (new.id, new.name, new.category);
+    END""",
+    f"""CREATE TRIGGER sweets_fts_ad AFTER DELETE ON sweets BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, category)
+        VALUES ('delete', old.id, old.name, old.category);
+    END""",
+    f"""CREATE TRIGGER sweets_fts_au AFTER UPDATE OF name, category ON sweets BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, category)
+        VALUES ('delete', old.id, old.name, old.category);
+        INSERT INTO {FTS_TABLE}(rowid, name, category) VALUES (new.id, new.name, new.category);
+    END""",
+    # Index any rows written before the search index existed
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')",
+]
+
+_DROP_STATEMENTS = [
+    f"DROP TABLE IF EXISTS {VOCAB_TABLE}",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+_fts = table(FTS_TABLE, column("rowid"), column("rank"))
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_index(target, connection, **kw):
+    """Create the FTS5 index and its sync triggers the first time tables are created"""
+    if connection.dialect.name != "sqlite":
+        return
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).first()
+    if exists:
+        return
+    for statement in _CREATE_STATEMENTS:
+        connection.exec_driver_sql(statement)
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def _drop_search_index(target, connection, **kw):
+    """Drop the FTS5 index along with the sweets table"""
+    if connection.dialect.name != "sqlite":
+        return
+    for statement in _DROP_STATEMENTS:
+        connection.exec_driver_sql(statement)
+
+
+def tokenize(value: str) -> List[str]:
+    """Split user input into lowercase search tokens"""
+    return _TOKEN_RE.findall(value.lower())
+
+
+async def _close_terms(db: AsyncSession, token: str) -> List[str]:
+    """Find indexed terms within a small edit distance of a token"""
+    # Only scan vocabulary sharing the first letter; fts5vocab serves term ranges in order
+    terms = await db.scalars(
+        text(f"SELECT term FROM {VOCAB_TABLE} WHERE term >= :low AND term < :high"),
+        {"low": token[0], "high": chr(ord(token[0]) + 1)},
+    )
+    return difflib.get_close_matches(
+        token, list(terms), n=FUZZY_MAX_CANDIDATES, cutoff=FUZZY_CUTOFF
+    )
+
+
+async def _column_expression(db: AsyncSession, column_name: str, value: str, fuzzy: bool) -> Optional[str]:
+    """Build an FTS5 expression matching every token of `value` in one column"""
+    tokens = tokenize(value)
+    if not tokens:
+        return None
+    parts = []
+    for token in tokens:
+        alternatives = [f'"{token}"*']
+        if fuzzy:
+            close_terms = await _close_terms(db, token)
+            alternatives.extend(f'"{term}"' for term in close_terms if term != token)
+        parts.append(alternatives[0] if len(alternatives) == 1 else f"({' OR '.join(alternatives)})")
+    return f"{column_name} : ({' AND '.join(parts)})"
+
+
+async def apply_text_search(
+    db: AsyncSession,
+    stmt: Select,
+    name: Optional[str] = None,
+    category: Optional[str] = None,
+    fuzzy: bool = False,
+) -> Select:
+    """
+    Filter a Sweet select by name and/or category text.
+    Returns the statement ordered by relevance when the FTS5 index is used.
+    """
+    if not name and not category:
+        return stmt
+
+    if db.get_bind().dialect.name != "sqlite":
+        if name:
+            stmt = stmt.where(Sweet.name.ilike(f"%{name}%"))
+        if category:
+            stmt = stmt.where(Sweet.category.ilike(f"%{category}%"))
+        return stmt
+
+    expressions = []
+    for column_name, value in (("name", name), ("category", category)):
+        if not value:
+            continue
+        expression = await _column_expression(db, column_name, value, fuzzy)
+        if expression is None:
+            # Input without any searchable characters can't match anything
+            return stmt.where(text("0"))
+        expressions.append(expression)
+
+    match = literal_column(FTS_TABLE).op("MATCH")(
+        bindparam("fts_match", " AND ".join(expressions))
+    )
+    return stmt.join(_fts, _fts.c.rowid == Sweet.id).where(match).order_by(_fts.c.rank)
@@ -0,0 +1,96 @@
+"""
+Stock mutation helpers used by the inventory routes.
+
+Every change is a single guarded ``UPDATE ... RETURNING`` statement, so the
+quantity check and the write happen atomically inside the database and
+concurrent purchases can never oversell a sweet.
+"""
+from typing import Dict, Iterable, Optional
+from sqlalchemy import select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from .idempotency import idempotency_store
+from .ledger import PURCHASE, movement_for, record_movements
+from .models import Sweet
+from .response_cache import response_cache
+
+
+class StockError(Exception):
+    """Base class for purchase failures reported by the stock engines"""
+
+
+class SweetNotFoundError(StockError):
+    pass
+
+
+class InsufficientStockError(StockError):
+    pass
+
+
+# Columns returned by every stock mutation (matches SweetResponse)
+SWEET_COLUMNS = (
+    Sweet.id, Sweet.name, Sweet.category, Sweet.price, Sweet.quantity, Sweet.reorder_threshold
+)
+
+
+async def decrement_stock(db: AsyncSession, sweet_id: int, quantity: int) -> Optional[Row]:
+    """
+    Take `quantity` units of a sweet in one statement.
+    Returns the updated row, or None if the sweet is missing or short of stock.
+    """
+    stmt = (
+        update(Sweet)
+        .where(Sweet.id == sweet_id, Sweet.quantity >= quantity)
+        .values(quantity=Sweet.quantity - quantity)
+        .returning(*SWEET_COLUMNS)
+    )
+    return (await db.execute(stmt)).first()
+
+
+async def purchase_stock(
+    db: AsyncSession, sweet_id: int, quantity: int, user_id: Optional[int] = None
+) -> Row:
+    """
+    Take stock for one purchase, record it in the ledger, invalidate cached
+    reads of the sweet and commit, together with the request's idempotent
+    response if it has one.
+    Raises SweetNotFoundError or InsufficientStockError on failure.
+    """
+    row = await decrement_stock(db, sweet_id, quantity)
+    if row is None:
+        await db.rollback()
+        if not await sweet_exists(db, sweet_id):
+            raise SweetNotFoundError()
+        raise InsufficientStockError()
+    await record_movements(db, [movement_for(row, -quantity, PURCHASE, user_id)])
+    await response_cache.invalidate_sweets(db, [sweet_id])
+    await idempotency_store.record(db, row)
+    await db.commit()
+    return row
+
+
+async def increment_stock(db: AsyncSession, sweet_id: int, quantity: int) -> Optional[Row]:
+    """
+    Add `quantity` units to a sweet in one statement.
+    Returns the updated row, or None if the sweet does not exist.
+    """
+    stmt = (
+        update(Sweet)
+        .where(Sweet.id == sweet_id)
+        .values(quantity=Sweet.quantity + quantity)
+        .returning(*SWEET_COLUMNS)
+    )
+    return (await db.execute(stmt)).first()
+
+
+async def sweet_exists(db: AsyncSession, sweet_id: int) -> bool:
+    """Check whether a sweet exists (used to tell 404 from 400 on failure)"""
+    return await db.scalar(select(Sweet.id).where(Sweet.id == sweet_id)) is not None
+
+
+async def get_stock_levels(db: AsyncSession, sweet_ids: Iterable[int]) -> Dict[int, int]:
+    """Fetch current quantities for many sweets in one query"""
+    rows = await db.execute(
+        select(Sweet.id, Sweet.quantity).where(Sweet.id.in_(list(sweet_ids)))
+    )
+    return {sweet_id: quantity for sweet_id, quantity in rows}
@@ -0,0 +1,409 @@
+"""
+Sharded in-memory stock counters for hot sweets.
+
+For sweets listed in ``hot_sweet_ids`` the authoritative quantity lives in
+memory: purchases and restocks are checked and applied under one of a
+fixed number of striped locks, so they never wait on the ``sweets`` row.
+Each change is appended to a journal before it is acknowledged, and a
+background flusher periodically writes the accumulated deltas to
+``Sweet.quantity`` together with the journal sequence number they cover
+(``stock_counter_checkpoints``). On startup, journal entries newer than
+the checkpoint are replayed, so a crash loses no acknowledged change and
+never applies one twice. The movements behind each flush are written to
+the ledger in the same transaction as the deltas.
+
+A purchase that also writes to the database (a batch with cold lines)
+reserves its hot lines first and journals them only once the database
+commit has succeeded, so a failed commit just releases the reservation
+and nothing reaches the journal or the ledger.
+
+Reads of hot sweets through the catalogue endpoints lag the counters by
+at most one flush interval.
+
+Counters, journal sequence numbers and the checkpoint row are per
+process, so hot sweets need a single worker. start() takes an exclusive
+lock next to the journal and refuses to run when another process holds
+it. Flushes are also guarded: a delta that would take a row below zero
+(its stock was changed behind the counters' back) fails the flush rather
+than being written, and stays pending until an admin fixes the quantity.
+"""
+import asyncio
+import glob
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import select, update
+from .config import settings
+from .database import AsyncSessionLocal
+from .ledger import PURCHASE, RESTOCK, Movement, record_movements
+from .models import StockCounterCheckpoint, Sweet
+from .response_cache import response_cache
+from .stock import SWEET_COLUMNS, InsufficientStockError, SweetNotFoundError
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where nothing stops a second process
+    fcntl = None
+
+_CHECKPOINT_ID = 1
+
+logger = logging.getLogger(__name__)
+
+
+class StripedStockCounters:
+    """In-memory stock for hot sweets with a write-ahead journal"""
+
+    def __init__(self, session_factory, journal_path: str, stripes: int = 16, fsync: bool = False):
+        self.session_factory = session_factory
+        self.journal_path = journal_path
+        self.fsync = fsync
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._journal_lock = threading.Lock()
+        self._quantity: Dict[int, int] = {}
+        self._pending: Dict[int, int] = {}
+        # Stock held by reservations not yet confirmed or released
+        self._reserved: Dict[int, int] = {}
+        self._details: Dict[int, dict] = {}
+        self._movements: List[Movement] = []
+        self._journal = None
+        self._lock_file = None
+        self._seq = 0
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.flushes = 0
+
+    def _lock_for(self, sweet_id: int) -> threading.Lock:
+        return self._locks[sweet_id % len(self._locks)]
+
+    def is_hot(self, sweet_id: int) -> bool:
+        return sweet_id in self._quantity
+
+    def hot_ids(self) -> List[int]:
+        return list(self._quantity)
+
+    # -- lifecycle ---------------------------------------------------------
+
+    async def start(self, sweet_ids: Iterable[int], flush_interval: Optional[float] = None) -> None:
+        """Replay the journal, load the hot sweets and start the flusher"""
+        sweet_ids = list(sweet_ids)
+        self._lock_journal()
+        await self._recover()
+        async with self.session_factory() as db:
+            rows = await db.execute(select(*SWEET_COLUMNS).where(Sweet.id.in_(sweet_ids)))
+            for row in rows:
+                self._details[row.id] = dict(row._mapping)
+                self._quantity[row.id] = row.quantity
+                self._pending[row.id] = 0
+                self._reserved[row.id] = 0
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        if flush_interval:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically(flush_interval))
+
+    async def stop(self) -> None:
+        """Stop the flusher and write out every pending delta"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._journal is not None:
+            await self.flush()
+            self._journal.close()
+            self._journal = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self._quantity.clear()
+        self._pending.clear()
+        self._reserved.clear()
+        self._details.clear()
+        self._movements.clear()
+
+    async def _flush_periodically(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception:
+                # flush() put the deltas back; the next interval retries them
+                logger.exception("Stock counter flush failed")
+
+    # -- journal -----------------------------------------------------------
+
+    def _lock_journal(self) -> None:
+        """Make sure no other process runs counters on this journal"""
+        self._lock_file = open(f"{self.journal_path}.lock", "a")
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise RuntimeError(
+                f"Stock counters for {self.journal_path} are running in another process; "
+                "hot sweets need a single worker"
+            )
+
+    def _journal_files(self) -> List[str]:
+        """Rotated files awaiting a flush, oldest first, then the live journal"""
+        rotated = sorted(
+            (path for path in glob.glob(f"{self.journal_path}.*") if path.rsplit(".", 1)[1].isdigit()),
+            key=lambda path: int(path.rsplit(".", 1)[1]),
+        )
+        live = [self.journal_path] if os.path.exists(self.journal_path) else []
+        return rotated + live
+
+    def _append(self, movements: List[Movement]) -> None:
+        """Journal changes before they are acknowledged"""
+        with self._journal_lock:
+            lines = []
+            for m in movements:
+                self._seq += 1
+                lines.append(
+                    f"{self._seq} {m.sweet_id} {m.delta} {m.kind} {m.user_id or 0} "
+                    f"{m.created_at.isoformat()}\n"
+                )
+            self._journal.write("".join(lines))
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+
+    async def _recover(self) -> None:
+        """Apply journal entries newer than the database checkpoint"""
+        async with self.session_factory() as db:
+            checkpoint = await db.get(StockCounterCheckpoint, _CHECKPOINT_ID)
+            last_seq = checkpoint.last_seq if checkpoint else 0
+            entries = []
+            max_seq = last_seq
+            files = self._journal_files()
+            for path in files:
+                with open(path, encoding="utf-8") as journal:
+                    for line in journal:
+                        parts = line.split()
+                        if len(parts) != 6:
+                            continue  # torn final write from a crash
+                        seq, sweet_id, delta, user_id = int(parts[0]), int(parts[1]), int(parts[2]), int(parts[4])
+                        max_seq = max(max_seq, seq)
+                        if seq > last_seq:
+                            entries.append((sweet_id, delta, parts[3], user_id or None, datetime.fromisoformat(parts[5])))
+            if max_seq > last_seq:
+                # Price and category weren't journalled; take today's values
+                rows = await db.execute(
+                    select(*SWEET_COLUMNS).where(Sweet.id.in_({entry[0] for entry in entries}))
+                )
+                sweets = {row.id: row for row in rows}
+                movements = [
+                    Movement(sweet_id, delta, kind, sweets[sweet_id].price, sweets[sweet_id].category, user_id, created_at)
+                    for sweet_id, delta, kind, user_id, created_at in entries
+                    if sweet_id in sweets
+                ]
+                await self._write_deltas(db, movements, max_seq)
+                await db.commit()
+            self._seq = max_seq
+        for path in files:
+            os.remove(path)
+
+    async def _write_deltas(self, db, movements: List[Movement], seq: int) -> None:
+        deltas: Dict[int, int] = {}
+        for m in movements:
+            deltas[m.sweet_id] = deltas.get(m.sweet_id, 0) + m.delta
+        changed = [sweet_id for sweet_id, delta in deltas.items() if delta]
+        for sweet_id in changed:
+            delta = deltas[sweet_id]
+            result = await db.execute(
+                update(Sweet)
+                .where(Sweet.id == sweet_id, Sweet.quantity + delta >= 0)
+                .values(quantity=Sweet.quantity + delta)
+            )
+            if result.rowcount == 0 and await db.get(Sweet, sweet_id) is not None:
+                raise InsufficientStockError(
+                    f"Flushing {delta} to sweet {sweet_id} would take its stock below zero"
+                )
+        if changed:
+            # Cached catalogue reads of these sweets predate the new quantities
+            await response_cache.invalidate_sweets(db, changed)
+        checkpoint = await db.get(StockCounterCheckpoint, _CHECKPOINT_ID)
+        if checkpoint is None:
+            db.add(StockCounterCheckpoint(id=_CHECKPOINT_ID, last_seq=seq))
+        else:
+            checkpoint.last_seq = seq
+        await record_movements(db, movements)
+
+    # -- stock operations --------------------------------------------------
+
+    def _snapshot(self, sweet_id: int) -> SimpleNamespace:
+        return SimpleNamespace(**{**self._details[sweet_id], "quantity": self._quantity[sweet_id]})
+
+    @contextmanager
+    def _locked(self, sweet_ids: Iterable[int]) -> Iterator[None]:
+        """Hold the stripe locks of several sweets, taken in stripe order"""
+        locks = [self._locks[i] for i in sorted({sweet_id % len(self._locks) for sweet_id in sweet_ids})]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _check(self, lines: Dict[int, int]) -> None:
+        # Callers hold the stripe locks of every sweet in `lines`
+        for sweet_id, quantity in lines.items():
+            if sweet_id not in self._quantity:
+                raise SweetNotFoundError()
+            if self._quantity[sweet_id] < quantity:
+                raise InsufficientStockError()
+
+    def purchase_many(self, lines: Dict[int, int], user_id: Optional[int] = None) -> List[SimpleNamespace]:
+        """Take stock for several hot sweets atomically"""
+        with self._locked(lines):
+            self._check(lines)
+            self._apply([(sweet_id, -quantity) for sweet_id, quantity in lines.items()], PURCHASE, user_id)
+            return [self._snapshot(sweet_id) for sweet_id in lines]
+
+    def reserve(self, lines: Dict[int, int]) -> List[SimpleNamespace]:
+        """
+        Hold stock for several hot sweets atomically without journalling it,
+        for a purchase that still has to commit elsewhere. Follow with
+        confirm() once it has committed, or release() if it failed.
+        """
+        with self._locked(lines):
+            self._check(lines)
+            for sweet_id, quantity in lines.items():
+                self._quantity[sweet_id] -= quantity
+                self._reserved[sweet_id] += quantity
+            return [self._snapshot(sweet_id) for sweet_id in lines]
+
+    def confirm(self, lines: Dict[int, int], user_id: Optional[int] = None) -> None:
+        """Journal a reserved purchase as taken"""
+        with self._locked(lines):
+            # A sweet deleted in the meantime has no stock left to record against
+            lines = {sweet_id: quantity for sweet_id, quantity in lines.items() if sweet_id in self._quantity}
+            for sweet_id, quantity in lines.items():
+                self._quantity[sweet_id] += quantity
+                self._reserved[sweet_id] -= quantity
+            self._apply([(sweet_id, -quantity) for sweet_id, quantity in lines.items()], PURCHASE, user_id)
+
+    def release(self, lines: Dict[int, int]) -> None:
+        """Give back a reservation whose purchase didn't happen"""
+        with self._locked(lines):
+            for sweet_id, quantity in lines.items():
+                if sweet_id in self._quantity:
+                    self._quantity[sweet_id] += quantity
+                    self._reserved[sweet_id] -= quantity
+
+    def purchase(self, sweet_id: int, quantity: int, user_id: Optional[int] = None) -> SimpleNamespace:
+        """Take stock for one hot sweet"""
+        return self.purchase_many({sweet_id: quantity}, user_id)[0]
+
+    def restock(self, sweet_id: int, quantity: int, user_id: Optional[int] = None) -> SimpleNamespace:
+        """Add stock to one hot sweet"""
+        with self._lock_for(sweet_id):
+            if sweet_id not in self._quantity:
+                raise SweetNotFoundError()
+            self._apply([(sweet_id, quantity)], RESTOCK, user_id)
+            return self._snapshot(sweet_id)
+
+    def _apply(self, changes: List[Tuple[int, int]], kind: str, user_id: Optional[int]) -> None:
+        # Callers hold the stripe locks of every sweet in `changes`
+        movements = [
+            Movement(
+                sweet_id, delta, kind, self._details[sweet_id]["price"],
+                self._details[sweet_id]["category"], user_id,
+            )
+            for sweet_id, delta in changes
+        ]
+        self._append(movements)
+        for sweet_id, delta in changes:
+            self._quantity[sweet_id] += delta
+            self._pending[sweet_id] += delta
+        self._movements.extend(movements)
+
+    def sync_from_row(self, row) -> None:
+        """
+        Adopt admin edits to a hot sweet. Call after flush() and the admin
+        commit, so the new quantity is the base for later deltas.
+        """
+        with self._lock_for(row.id):
+            if row.id not in self._quantity:
+                return
+            self._details[row.id] = {column.key: getattr(row, column.key) for column in SWEET_COLUMNS}
+            self._quantity[row.id] = row.quantity + self._pending[row.id] - self._reserved[row.id]
+
+    def forget(self, sweet_id: int) -> None:
+        """Stop tracking a deleted sweet"""
+        with self._lock_for(sweet_id):
+            self._quantity.pop(sweet_id, None)
+            self._pending.pop(sweet_id, None)
+            self._reserved.pop(sweet_id, None)
+            self._details.pop(sweet_id, None)
+
+    # -- reconciliation ----------------------------------------------------
+
+    async def flush(self) -> List[int]:
+        """Write pending deltas and movements to the database; returns the changed ids"""
+        async with self._flush_lock:
+            if self._journal is None:
+                return []
+            # Swap out deltas and rotate the journal without yielding to other
+            # tasks; locks are taken stripes-then-journal, as in _apply()
+            for lock in self._locks:
+                lock.acquire()
+            try:
+                with self._journal_lock:
+                    if not self._movements:
+                        return []
+                    deltas = {sweet_id: delta for sweet_id, delta in self._pending.items() if delta}
+                    for sweet_id in deltas:
+                        self._pending[sweet_id] = 0
+                    movements, self._movements = self._movements, []
+                    seq = self._seq
+                    self._journal.close()
+                    os.replace(self.journal_path, f"{self.journal_path}.{seq}")
+                    self._journal = open(self.journal_path, "a", encoding="utf-8")
+            finally:
+                for lock in reversed(self._locks):
+                    lock.release()
+
+            try:
+                async with self.session_factory() as db:
+                    await self._write_deltas(db, movements, seq)
+                    await db.commit()
+            except Exception:
+                # Keep the deltas pending; the rotated journal still covers them
+                for sweet_id, delta in deltas.items():
+                    with self._lock_for(sweet_id):
+                        if sweet_id in self._pending:
+                            self._pending[sweet_id] += delta
+                self._movements[:0] = movements
+                raise
+            # Everything up to `seq` is now in the database, including rotations
+            # left behind by earlier failed flushes
+            for path in self._journal_files():
+                if path != self.journal_path and int(path.rsplit(".", 1)[1]) <= seq:
+                    os.remove(path)
+            self.flushes += 1
+            return list(deltas)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hot_sweets": len(self._quantity),
+            "pending_sweets": sum(1 for delta in self._pending.values() if delta),
+            "journal_seq": self._seq,
+            "flushes": self.flushes,
+        }
+
+
+stock_counters = StripedStockCounters(
+    AsyncSessionLocal,
+    journal_path=settings.stock_journal_path,
+    stripes=settings.stock_counter_stripes,
+    fsync=settings.stock_journal_fsync,
+)
@@ -1,11 +1,19 @@
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from fastapi.testclient import TestClient
-from ..database import Base, get_db
+from ..database import Base, get_db, get_sync_db
 from ..main import app
 from ..models import User
-from ..auth import get_password_hash
+from ..admission import admission_controller
+from ..auth import get_password_hash, unknown_usernames, user_cache
+from ..response_cache import response_cache
+from ..idempotency import idempotency_store
+from ..low_stock import low_stock_watcher
+from ..rate_limit import clear_rate_limits
+from ..revocation import revocation_list
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
@@ -14,6 +22,15 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The app talks to the same file through the async driver. TestClient may run
+# each request on its own event loop, so don't pool async connections.
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///./test.db", poolclass=NullPool
+)
+TestingAsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 
 @pytest.fixture(scope="function")
 def db_session():
@@ -27,16 +44,63 @@ def db_session():
         Base.metadata.drop_all(bind=engine)
 
 
+@pytest.fixture
+def async_session_factory(db_session):
+    """Async session factory bound to the test database"""
+    return TestingAsyncSessionLocal
+
+
+@pytest.fixture
+def app_statements():
+    """Record the SQL statements the app executes during a test"""
+    statements = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """The database is recreated per test, so don't let cached state leak between tests"""
+    user_cache.clear()
+    unknown_usernames.clear()
+    clear_rate_limits()
+    admission_controller.reset()
+    response_cache.clear()
+    idempotency_store.clear()
+    low_stock_watcher.reset()
+    revocation_list.reset()
+    yield
+    user_cache.clear()
+    unknown_usernames.clear()
+    clear_rate_limits()
+    admission_controller.reset()
+    response_cache.clear()
+    idempotency_store.clear()
+    low_stock_watcher.reset()
+    revocation_list.reset()
+
+
 @pytest.fixture(scope="function")
 def client(db_session):
     """Create a test client with database override"""
-    def override_get_db():
+    async def override_get_db():
+        async with TestingAsyncSessionLocal() as session:
+            yield session
+    
+    def override_get_sync_db():
+        session = TestingSessionLocal()
         try:
-            yield db_session
+            yield session
         finally:
-            pass
+            session.close()
     
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_sync_db] = override_get_sync_db
     yield TestClient(app)
     app.dependency_overrides.clear()
 
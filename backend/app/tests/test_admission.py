@@ -0,0 +1,114 @@
+import asyncio
+import time
+import pytest
+from fastapi import status
+from ..admission import ADJUST_EVERY, RouteGroupLimiter, admission_controller
+from ..config import RouteAdmission
+
+
+def _limiter(**overrides):
+    limits = dict(
+        max_concurrency=1, max_queue=4, queue_target_ms=5.0, queue_interval_ms=100.0,
+        p99_target_ms=50.0, requests_per_minute=100,
+    )
+    limits.update(overrides)
+    return RouteGroupLimiter("test", RouteAdmission(**limits))
+
+
+class TestRouteGroupLimiter:
+    """Test the concurrency limit, its queue and latency adaptation"""
+
+    async def test_queued_request_gets_released_slot(self):
+        """Test a waiter is handed the slot a finishing request frees"""
+        limiter = _limiter()
+        assert await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.stats()["queued"] == 1
+        limiter.release(0.001)
+        assert await waiter
+        assert limiter.in_flight == 1
+
+    async def test_queue_timeout_sheds(self):
+        """Test a request that can't get a slot in time is rejected"""
+        limiter = _limiter(queue_interval_ms=10.0)
+        assert await limiter.acquire()
+        started = time.perf_counter()
+        assert not await limiter.acquire()
+        assert time.perf_counter() - started < 0.5
+        assert limiter.shed == 1
+        assert limiter.stats()["queued"] == 0
+
+    async def test_full_queue_sheds_immediately(self):
+        """Test arrivals beyond the queue bound are rejected without waiting"""
+        limiter = _limiter(max_queue=0)
+        assert await limiter.acquire()
+        assert not await limiter.acquire()
+
+    async def test_standing_queue_shortens_wait(self):
+        """Test a queue that hasn't drained for an interval only waits the target"""
+        limiter = _limiter()
+        assert await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.queue_timeout() == pytest.approx(0.1)
+        limiter._last_empty -= 1.0
+        assert limiter.queue_timeout() == pytest.approx(0.005)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    def test_limit_follows_p99(self):
+        """Test slow responses lower the limit and fast ones restore it"""
+        limiter = _limiter(max_concurrency=20)
+        for _ in range(ADJUST_EVERY):
+            limiter.in_flight += 1
+            limiter.release(0.2)
+        assert limiter.limit == 18
+        limiter._latencies.clear()
+        for _ in range(ADJUST_EVERY):
+            limiter.in_flight += 1
+            limiter.release(0.001)
+        assert limiter.limit == 19
+
+
+class TestAdmissionMiddleware:
+    """Test admission control in front of the routers"""
+
+    def test_routes_are_grouped_by_router(self, client):
+        """Test routers sharing /api/sweets are told apart"""
+        client.get("/")
+
+        def group_for(path):
+            return admission_controller.group_for({"app": client.app, "path": path})
+
+        assert group_for("/api/sweets") == "sweets"
+        assert group_for("/api/sweets/3") == "sweets"
+        assert group_for("/api/sweets/3/purchase") == "inventory"
+        assert group_for("/api/sweets/purchase/batch") == "inventory"
+        assert group_for("/api/auth/login") == "auth"
+        assert group_for("/api/sweets/stream") is None
+        assert group_for("/") is None
+
+    def test_overloaded_router_returns_503(self, client, monkeypatch):
+        """Test a router with no capacity fails fast"""
+        monkeypatch.setattr(admission_controller.groups["sweets"], "limit", 0)
+        monkeypatch.setattr(admission_controller.groups["sweets"], "max_queue", 0)
+        response = client.get("/api/sweets")
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers["Retry-After"] == "1"
+        assert client.get("/").status_code == status.HTTP_200_OK
+
+    def test_principal_quota(self, client, test_user, monkeypatch):
+        """Test each user has their own request quota"""
+        login = client.post("/api/auth/login", data={"username": "testuser", "password": "testpassword"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        monkeypatch.setattr(admission_controller.quotas["sweets"], "limit", 2)
+        for name in ("toffee", "fudge"):
+            response = client.get(f"/api/sweets/search?name={name}", headers=headers)
+            assert response.status_code == status.HTTP_200_OK
+        response = client.get("/api/sweets/search?name=nougat", headers=headers)
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert int(response.headers["Retry-After"]) >= 1
+        # Anonymous requests count against the client address instead
+        assert client.get("/api/sweets").status_code == status.HTTP_401_UNAUTHORIZED
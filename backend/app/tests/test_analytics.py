@@ -0,0 +1,109 @@
+from datetime import datetime
+import pytest
+from fastapi import status
+from ..analytics import bucket_totals, percentiles_from_histogram
+
+
+@pytest.fixture
+def admin_headers(client, test_admin):
+    login = client.post("/api/auth/login", data={"username": "admin", "password": "adminpassword"})
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+@pytest.fixture
+def sales(client, admin_headers):
+    """Two chocolate sweets and one gummy sweet with a few purchases each"""
+    ids = {}
+    for name, category, price, quantity in [
+        ("Chocolate Bar", "Chocolate", 2.0, 20),
+        ("Truffle", "Chocolate", 5.0, 3),
+        ("Gummy Bears", "Gummy", 1.0, 50),
+    ]:
+        ids[name] = client.post(
+            "/api/sweets",
+            json={"name": name, "category": category, "price": price, "quantity": quantity},
+            headers=admin_headers
+        ).json()["id"]
+    for name, quantity in [("Chocolate Bar", 4), ("Chocolate Bar", 1), ("Truffle", 2), ("Gummy Bears", 10)]:
+        client.post(f"/api/sweets/{ids[name]}/purchase", json={"quantity": quantity}, headers=admin_headers)
+    return ids
+
+
+class TestAnalyticsEndpoints:
+    """Test the admin analytics reports"""
+    
+    def test_requires_admin(self, client, test_user):
+        """Test regular users can't read analytics"""
+        login = client.post("/api/auth/login", data={"username": "testuser", "password": "testpassword"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        response = client.get("/api/admin/analytics/stock-value", headers=headers)
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+    
+    def test_revenue_and_top_sellers(self, client, admin_headers, sales):
+        """Test revenue per category and best sellers come from the rollups"""
+        response = client.get("/api/admin/analytics/revenue-by-category", headers=admin_headers)
+        assert response.json() == [
+            {"category": "Chocolate", "units": 7, "revenue": 20.0},
+            {"category": "Gummy", "units": 10, "revenue": 10.0},
+        ]
+        
+        response = client.get("/api/admin/analytics/top-sellers?limit=2", headers=admin_headers)
+        assert [(row["name"], row["units"]) for row in response.json()] == [
+            ("Gummy Bears", 10), ("Chocolate Bar", 5)
+        ]
+    
+    def test_stock_value_and_low_stock(self, client, admin_headers, sales):
+        """Test stock value and low-stock reports over the catalogue"""
+        report = client.get("/api/admin/analytics/stock-value", headers=admin_headers).json()
+        assert report["total_units"] == 15 + 1 + 40
+        assert report["total_value"] == pytest.approx(30.0 + 5.0 + 40.0)
+        assert [c["category"] for c in report["categories"]] == ["Gummy", "Chocolate"]
+        
+        response = client.get("/api/admin/low-stock?threshold=1", headers=admin_headers)
+        assert [row["name"] for row in response.json()] == ["Truffle"]
+        # Without a threshold each sweet's own reorder threshold applies
+        response = client.get("/api/admin/low-stock", headers=admin_headers)
+        assert response.json() == []
+    
+    def test_sales_and_order_sizes(self, client, admin_headers, sales):
+        """Test time bucketing and purchase size percentiles"""
+        response = client.get("/api/admin/analytics/sales?bucket=week", headers=admin_headers)
+        [week] = response.json()
+        assert week["units"] == 17
+        assert week["revenue"] == pytest.approx(30.0)
+        assert datetime.fromisoformat(week["start"]).weekday() == 0
+        
+        report = client.get("/api/admin/analytics/order-sizes", headers=admin_headers).json()
+        assert report["purchases"] == 4
+        assert report["mean"] == pytest.approx(17 / 4)
+        assert report["percentiles"] == {"p50": 2.0, "p90": 10.0, "p99": 10.0}
+        
+        response = client.get("/api/admin/analytics/sales?bucket=month", headers=admin_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    
+    def test_reports_refresh_after_writes(self, client, admin_headers, sales):
+        """Test cached reports are recomputed after a purchase"""
+        url = "/api/admin/analytics/revenue-by-category"
+        assert client.get(url, headers=admin_headers).json()[1]["units"] == 10
+        client.post(f"/api/sweets/{sales['Gummy Bears']}/purchase", json={"quantity": 5}, headers=admin_headers)
+        assert client.get(url, headers=admin_headers).json()[1]["units"] == 15
+
+
+class TestColumnarHelpers:
+    """Test the percentile and bucketing helpers"""
+    
+    def test_percentiles_from_histogram(self):
+        """Test nearest-rank percentiles over a value histogram"""
+        assert percentiles_from_histogram([1, 2, 10], [5, 4, 1], [50, 90, 99, 100]) == [1.0, 2.0, 10.0, 10.0]
+        assert percentiles_from_histogram([], [], [50]) == [0.0]
+    
+    def test_bucket_totals(self):
+        """Test hourly totals roll up into days"""
+        hours = [datetime(2024, 3, 4, 9), datetime(2024, 3, 4, 17), datetime(2024, 3, 5, 8)]
+        buckets = bucket_totals(hours, {"units": [1, 2, 4]}, "day")
+        assert buckets == [
+            (datetime(2024, 3, 4), {"units": 3.0}),
+            (datetime(2024, 3, 5), {"units": 4.0}),
+        ]
+        [(start, totals)] = bucket_totals(hours, {"units": [1, 2, 4]}, "week")
+        assert start == datetime(2024, 3, 4)  # a Monday
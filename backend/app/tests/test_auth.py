@@ -1,6 +1,20 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
 import pytest
+from jose import JWTError, jwt
 from fastapi import status
 from sqlalchemy.orm import Session
+from ..auth import password_pool
+from ..config import settings
+from ..hashing import PasswordHashPool, PoolSaturatedError
+from ..rate_limit import InMemoryRateLimitBackend, SlidingWindowLimiter, login_ip_limiter
+from ..models import RevokedToken
+from ..revocation import BloomFilter, RevocationList, revocation_list
+from ..tokens import TokenKeyring, generate_signing_jwk
 
 
 class TestUserRegistration:
@@ -135,3 +149,370 @@ class TestUserLogin:
         response = client.get("/api/sweets")
         assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
+
+
+class TestUserCache:
+    """Test caching of authenticated users"""
+    
+    def test_cached_user_skips_lookup(self, client, test_user, app_statements):
+        """Test repeated requests with one token resolve the user from cache"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "testuser", "password": "testpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        app_statements.clear()
+        
+        for _ in range(3):
+            response = client.get("/api/auth/me", headers=headers)
+            assert response.status_code == status.HTTP_200_OK
+            assert response.json()["username"] == "testuser"
+        
+        assert len([sql for sql in app_statements if "FROM users" in sql]) == 1
+    
+    def test_demoted_admin_is_invalidated(self, client, test_admin, db_session):
+        """Test modifying a user evicts the cached copy"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        sweet = {"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 5}
+        
+        assert client.post("/api/sweets", json=sweet, headers=headers).status_code == status.HTTP_201_CREATED
+        
+        test_admin.is_admin = False
+        db_session.commit()
+        
+        sweet["name"] = "Gummy Bears"
+        assert client.post("/api/sweets", json=sweet, headers=headers).status_code == status.HTTP_403_FORBIDDEN
+    
+    def test_trusted_claims_for_read_only_endpoints(self, client, test_user, db_session, monkeypatch):
+        """Test read-only endpoints can authorise from token claims alone"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "testuser", "password": "testpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        
+        monkeypatch.setattr(settings, "trust_token_claims", True)
+        db_session.delete(test_user)
+        db_session.commit()
+        
+        # The listing trusts the claims, but /me still needs the user record
+        assert client.get("/api/sweets", headers=headers).status_code == status.HTTP_200_OK
+        assert client.get("/api/auth/me", headers=headers).status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestTokenKeyring:
+    """Test asymmetric token signing, key rotation and verification caching"""
+    
+    def _write_jwks(self, path, keys):
+        path.write_text(json.dumps({"keys": keys}))
+    
+    def _keyring(self, path):
+        return TokenKeyring("HS256", "unused", jwks_path=str(path), reload_seconds=0)
+    
+    def test_es256_tokens_carry_kid(self, tmp_path):
+        """Test tokens are signed with the newest key and verified by kid"""
+        path = tmp_path / "jwks.json"
+        self._write_jwks(path, [generate_signing_jwk("old"), generate_signing_jwk("new")])
+        keyring = self._keyring(path)
+        
+        token = keyring.sign({"sub": "testuser", "exp": time.time() + 60})
+        assert jwt.get_unverified_header(token) == {"alg": "ES256", "kid": "new", "typ": "JWT"}
+        assert keyring.verify(token)["sub"] == "testuser"
+        
+        public = keyring.public_jwks()["keys"]
+        assert [key["kid"] for key in public] == ["old", "new"]
+        assert all("d" not in key for key in public)
+    
+    def test_rotation_and_retirement(self, tmp_path):
+        """Test verifiers pick up new keys and reject tokens of retired ones"""
+        path = tmp_path / "jwks.json"
+        first = generate_signing_jwk("first")
+        self._write_jwks(path, [first])
+        signer = self._keyring(path)
+        verifier = self._keyring(path)
+        old_token = signer.sign({"sub": "testuser", "exp": time.time() + 60})
+        assert verifier.verify(old_token)["sub"] == "testuser"
+        
+        second = generate_signing_jwk("second")
+        self._write_jwks(path, [first, second])
+        os.utime(path, (time.time() + 1, time.time() + 1))
+        new_token = signer.sign({"sub": "testuser", "exp": time.time() + 60})
+        assert jwt.get_unverified_header(new_token)["kid"] == "second"
+        assert verifier.verify(new_token)["sub"] == "testuser"
+        
+        self._write_jwks(path, [second])
+        os.utime(path, (time.time() + 2, time.time() + 2))
+        with pytest.raises(JWTError):
+            verifier.verify(old_token)
+    
+    def test_broken_reload_keeps_current_keys(self, tmp_path):
+        """Test a malformed or unsupported JWKS file on reload leaves verification working"""
+        path = tmp_path / "jwks.json"
+        key = generate_signing_jwk("current")
+        self._write_jwks(path, [key])
+        keyring = self._keyring(path)
+        token = keyring.sign({"sub": "testuser", "exp": time.time() + 60})
+        
+        path.write_text('{"keys": [')
+        os.utime(path, (time.time() + 1, time.time() + 1))
+        assert keyring.verify(token)["sub"] == "testuser"
+        
+        self._write_jwks(path, [{**key, "kid": "other", "alg": "HS256"}])
+        os.utime(path, (time.time() + 2, time.time() + 2))
+        assert keyring.public_jwks()["keys"][0]["kid"] == "current"
+        with pytest.raises(JWTError):
+            keyring.verify(jwt.encode({"sub": "x"}, "secret", headers={"kid": "other"}))
+        
+        self._write_jwks(path, [key, generate_signing_jwk("fixed")])
+        os.utime(path, (time.time() + 3, time.time() + 3))
+        assert jwt.get_unverified_header(keyring.sign({"sub": "testuser"}))["kid"] == "fixed"
+    
+    def test_verified_tokens_are_cached(self, tmp_path, monkeypatch):
+        """Test a repeated token skips signature verification"""
+        path = tmp_path / "jwks.json"
+        self._write_jwks(path, [generate_signing_jwk("only")])
+        keyring = TokenKeyring("HS256", "unused", jwks_path=str(path), reload_seconds=60)
+        token = keyring.sign({"sub": "testuser", "exp": time.time() + 60})
+        keyring.verify(token)
+        
+        def fail(*args, **kwargs):
+            raise AssertionError("signature checked again")
+        
+        monkeypatch.setattr(jwt, "decode", fail)
+        assert keyring.verify(token)["sub"] == "testuser"
+    
+    def test_admin_authorised_from_claims(self, client, test_admin, app_statements, monkeypatch):
+        """Test trusted claims authorise admin writes without a user lookup"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        token = login_response.json()["access_token"]
+        assert jwt.get_unverified_claims(token)["uid"] == test_admin.id
+        monkeypatch.setattr(settings, "trust_token_claims", True)
+        app_statements.clear()
+        
+        response = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 5},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        assert not [sql for sql in app_statements if "FROM users" in sql]
+
+
+class TestRefreshTokens:
+    """Test refresh token rotation and session revocation"""
+    
+    def _login(self, client):
+        response = client.post(
+            "/api/auth/login",
+            data={"username": "testuser", "password": "testpassword"}
+        )
+        return response.json()
+    
+    def test_login_returns_refresh_token(self, client, test_user):
+        """Test login issues a refresh token in the same session as the access token"""
+        tokens = self._login(client)
+        access = jwt.get_unverified_claims(tokens["access_token"])
+        refresh = jwt.get_unverified_claims(tokens["refresh_token"])
+        assert refresh["typ"] == "refresh"
+        assert refresh["sid"] == access["sid"]
+    
+    def test_refresh_rotates_tokens(self, client, test_user):
+        """Test a refresh token buys a new working pair"""
+        tokens = self._login(client)
+        response = client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+        assert response.status_code == status.HTTP_200_OK
+        rotated = response.json()
+        assert rotated["refresh_token"] != tokens["refresh_token"]
+        
+        headers = {"Authorization": f"Bearer {rotated['access_token']}"}
+        assert client.get("/api/auth/me", headers=headers).status_code == status.HTTP_200_OK
+        response = client.post("/api/auth/refresh", json={"refresh_token": rotated["refresh_token"]})
+        assert response.status_code == status.HTTP_200_OK
+    
+    def test_reused_refresh_token_revokes_session(self, client, test_user):
+        """Test replaying a rotated refresh token ends the whole session"""
+        tokens = self._login(client)
+        rotated = client.post(
+            "/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]}
+        ).json()
+        
+        response = client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        
+        response = client.post("/api/auth/refresh", json={"refresh_token": rotated["refresh_token"]})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        headers = {"Authorization": f"Bearer {rotated['access_token']}"}
+        assert client.get("/api/auth/me", headers=headers).status_code == status.HTTP_401_UNAUTHORIZED
+    
+    def test_reuse_revocation_outlives_replayed_token(self, client, test_user, db_session):
+        """Test the session stays revoked after the replayed token would have expired"""
+        tokens = self._login(client)
+        rotated = client.post(
+            "/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]}
+        ).json()
+        client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+        
+        # Prune as if the replayed token had expired, then resync from the table
+        replayed_exp = datetime.utcfromtimestamp(jwt.get_unverified_claims(tokens["refresh_token"])["exp"])
+        db_session.query(RevokedToken).filter(RevokedToken.expires_at <= replayed_exp).delete()
+        db_session.commit()
+        revocation_list.reset()
+        
+        response = client.post("/api/auth/refresh", json={"refresh_token": rotated["refresh_token"]})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    
+    def test_logout_revokes_session(self, client, test_user):
+        """Test logout invalidates both tokens of the session"""
+        tokens = self._login(client)
+        headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+        assert client.post("/api/auth/logout", headers=headers).status_code == status.HTTP_204_NO_CONTENT
+        
+        assert client.get("/api/sweets", headers=headers).status_code == status.HTTP_401_UNAUTHORIZED
+        response = client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        
+        other = self._login(client)
+        headers = {"Authorization": f"Bearer {other['access_token']}"}
+        assert client.get("/api/sweets", headers=headers).status_code == status.HTTP_200_OK
+    
+    def test_refresh_token_is_not_an_access_token(self, client, test_user):
+        """Test refresh tokens are rejected as bearer credentials"""
+        tokens = self._login(client)
+        headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+        assert client.get("/api/auth/me", headers=headers).status_code == status.HTTP_401_UNAUTHORIZED
+        response = client.post("/api/auth/refresh", json={"refresh_token": tokens["access_token"]})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    
+    async def test_sync_picks_up_late_commits(self, db_session, async_session_factory):
+        """Test a row stamped before the last sync but committed after it is still found"""
+        revocations = RevocationList(
+            capacity=1000, error_rate=0.01, sync_seconds=0, sync_overlap_seconds=60
+        )
+        now = datetime.utcnow()
+        expires_at = now + timedelta(days=1)
+        db_session.add(RevokedToken(token_id="early", expires_at=expires_at, revoked_at=now))
+        db_session.commit()
+        async with async_session_factory() as db:
+            assert await revocations.is_revoked(db, "early")
+        
+        db_session.add(RevokedToken(
+            token_id="late", expires_at=expires_at, revoked_at=now - timedelta(seconds=10)
+        ))
+        db_session.commit()
+        async with async_session_factory() as db:
+            assert await revocations.is_revoked(db, "late")
+            assert not await revocations.is_revoked(db, "never")
+        assert revocations.stats()["filtered"] == 2
+    
+    def test_bloom_filter(self):
+        """Test the filter never misses an added id and rarely admits others"""
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"revoked-{i}")
+        assert all(f"revoked-{i}" in bloom for i in range(1000))
+        false_positives = sum(f"live-{i}" in bloom for i in range(10000))
+        assert false_positives < 300
+
+
+class TestLoginRateLimit:
+    """Test login throttling per username and per client address"""
+    
+    def _login(self, client, username="testuser", password="wrongpassword"):
+        return client.post("/api/auth/login", data={"username": username, "password": password})
+    
+    def test_username_limit(self, client, test_user, monkeypatch):
+        """Test repeated failures lock the username out before any bcrypt work"""
+        for _ in range(settings.login_rate_limit_per_username):
+            assert self._login(client).status_code == status.HTTP_401_UNAUTHORIZED
+        
+        def fail(*args, **kwargs):
+            raise AssertionError("password verified while throttled")
+        
+        monkeypatch.setattr(password_pool, "run", fail)
+        response = self._login(client, password="testpassword")
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert int(response.headers["Retry-After"]) >= 1
+    
+    def test_success_clears_username_failures(self, client, test_user):
+        """Test a successful login forgives earlier typos"""
+        for _ in range(settings.login_rate_limit_per_username - 1):
+            self._login(client)
+        assert self._login(client, password="testpassword").status_code == status.HTTP_200_OK
+        for _ in range(settings.login_rate_limit_per_username):
+            assert self._login(client).status_code == status.HTTP_401_UNAUTHORIZED
+    
+    def test_ip_limit(self, client, monkeypatch):
+        """Test one address can't spray many usernames"""
+        monkeypatch.setattr(login_ip_limiter, "limit", 3)
+        for i in range(3):
+            assert self._login(client, username=f"user{i}").status_code == status.HTTP_401_UNAUTHORIZED
+        response = self._login(client, username="user3")
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    
+    def test_unknown_username_skips_lookup(self, client, app_statements):
+        """Test a username just found missing isn't looked up again"""
+        self._login(client, username="ghost")
+        app_statements.clear()
+        assert self._login(client, username="ghost").status_code == status.HTTP_401_UNAUTHORIZED
+        assert not [sql for sql in app_statements if "FROM users" in sql]
+    
+    def test_registration_clears_unknown_username(self, client):
+        """Test a newly registered username can log in straight away"""
+        self._login(client, username="newcomer")
+        client.post(
+            "/api/auth/register",
+            json={"username": "newcomer", "email": "new@example.com", "password": "newpassword"}
+        )
+        assert self._login(client, username="newcomer", password="newpassword").status_code == status.HTTP_200_OK
+    
+    def test_sliding_window(self):
+        """Test the previous window's hits slide out gradually"""
+        limiter = SlidingWindowLimiter("test", 2, 10.0, InMemoryRateLimitBackend(max_keys=10))
+        assert limiter.hit("key", now=0.0) == 0
+        assert limiter.hit("key", now=1.0) == 0
+        retry_after = limiter.hit("key", now=2.0)
+        assert retry_after == 8
+        assert limiter.hit("key", now=9.9) > 0
+        assert limiter.hit("key", now=2.0 + retry_after + 0.1) == 0
+        assert limiter.hit("other", now=2.0) == 0
+
+
+class TestPasswordHashPool:
+    """Test the bounded bcrypt worker pool"""
+    
+    async def test_rejects_when_saturated(self):
+        """Test jobs beyond workers + queue are rejected instead of queued"""
+        pool = PasswordHashPool(max_workers=1, max_queue=0)
+        release = threading.Event()
+        
+        blocked = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolSaturatedError):
+            await pool.run(lambda: None)
+        release.set()
+        await blocked
+        
+        stats = pool.stats()
+        assert stats["submitted"] == 1
+        assert stats["rejected"] == 1
+        assert stats["peak_pending"] == 1
+        assert stats["running"] == 0
+    
+    def test_login_returns_503_when_saturated(self, client, test_user, monkeypatch):
+        """Test login sheds load with 503 and Retry-After"""
+        monkeypatch.setattr(password_pool, "max_workers", 0)
+        monkeypatch.setattr(password_pool, "max_queue", 0)
+        
+        response = client.post(
+            "/api/auth/login",
+            data={"username": "testuser", "password": "testpassword"}
+        )
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,92 @@
+import pytest
+from fastapi import status
+from .. import response_cache as response_cache_module
+from ..catalog_import import import_sweets
+from ..compression import choose_encoding
+
+
+@pytest.fixture
+def catalogue(db_session):
+    """Enough sweets for the listing to pass the compression threshold"""
+    import_sweets(db_session, [
+        "name,category,price,quantity\n",
+        *(f"Chocolate Bar {i},Chocolate,{1.5 + i},{i}\n" for i in range(40)),
+    ], "csv")
+
+
+@pytest.fixture
+def headers(client, test_user):
+    login = client.post("/api/auth/login", data={"username": "testuser", "password": "testpassword"})
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+class TestCompression:
+    """Test response compression and reuse of compressed cache entries"""
+
+    def test_choose_encoding(self):
+        """Test Accept-Encoding negotiation honours q-values"""
+        assert choose_encoding("gzip, deflate") == "gzip"
+        assert choose_encoding("gzip;q=0") is None
+        assert choose_encoding("*") is not None
+        assert choose_encoding("identity") is None
+        assert choose_encoding("") is None
+
+    def test_listing_is_compressed(self, client, catalogue, headers):
+        """Test a large listing is gzipped for clients that accept it"""
+        plain = client.get("/api/sweets", headers={**headers, "Accept-Encoding": "identity"})
+        assert "content-encoding" not in plain.headers
+
+        response = client.get("/api/sweets", headers={**headers, "Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert int(response.headers["content-length"]) < len(plain.content) / 2
+        assert response.json() == plain.json()
+
+    def test_cached_listing_is_compressed_once(self, client, catalogue, headers, monkeypatch):
+        """Test repeated reads reuse the stored compressed body"""
+        calls = []
+        real_compress = response_cache_module.compress
+
+        def counting_compress(body, encoding):
+            calls.append(encoding)
+            return real_compress(body, encoding)
+
+        monkeypatch.setattr(response_cache_module, "compress", counting_compress)
+        gzip_headers = {**headers, "Accept-Encoding": "gzip"}
+        bodies = [client.get("/api/sweets", headers=gzip_headers).json() for _ in range(3)]
+        assert calls == ["gzip"]
+        assert bodies[0] == bodies[2]
+
+    def test_compressed_variant_has_its_own_etag(self, client, catalogue, headers):
+        """Test gzip and identity bodies get different ETags, and each revalidates"""
+        plain = client.get("/api/sweets", headers={**headers, "Accept-Encoding": "identity"})
+        gzipped = client.get("/api/sweets", headers={**headers, "Accept-Encoding": "gzip"})
+        assert gzipped.headers["etag"] == plain.headers["etag"][:-1] + '-gzip"'
+
+        for response, accept in [(plain, "identity"), (gzipped, "gzip")]:
+            revalidated = client.get("/api/sweets", headers={
+                **headers, "Accept-Encoding": accept, "If-None-Match": response.headers["etag"],
+            })
+            assert revalidated.status_code == status.HTTP_304_NOT_MODIFIED
+            assert revalidated.headers["etag"] == response.headers["etag"]
+
+    def test_brotli_is_preferred(self, client, catalogue, headers):
+        """Test clients accepting brotli get it, with a brotli-specific ETag"""
+        brotli = pytest.importorskip("brotli")
+        plain = client.get("/api/sweets", headers={**headers, "Accept-Encoding": "identity"})
+        response = client.get("/api/sweets", headers={**headers, "Accept-Encoding": "gzip, br"})
+        assert response.headers["content-encoding"] == "br"
+        assert response.headers["etag"] == plain.headers["etag"][:-1] + '-br"'
+        assert brotli.decompress(response.content) == plain.content
+
+    def test_uncached_responses_are_compressed(self, client):
+        """Test the middleware compresses large responses outside the cache"""
+        response = client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.json()["info"]["title"] == "Sweet Shop Management API"
+
+    def test_small_responses_are_not_compressed(self, client, headers):
+        """Test bodies under the threshold are sent as they are"""
+        response = client.get("/api/auth/me", headers={**headers, "Accept-Encoding": "gzip"})
+        assert response.status_code == status.HTTP_200_OK
+        assert "content-encoding" not in response.headers
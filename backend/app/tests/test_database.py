@@ -0,0 +1,71 @@
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from ..config import settings
+from ..database import add_missing_columns, apply_sqlite_pragmas, engine_options, to_async_url
+
+
+class TestEngineConfiguration:
+    """Test engine construction from settings"""
+    
+    def test_async_url_mapping(self):
+        """Test sync URLs are mapped onto their async drivers"""
+        assert to_async_url("sqlite:///./sweet_shop.db") == "sqlite+aiosqlite:///./sweet_shop.db"
+        assert to_async_url("postgresql://u:p@db/shop") == "postgresql+asyncpg://u:p@db/shop"
+        assert to_async_url("sqlite+aiosqlite:///./x.db") == "sqlite+aiosqlite:///./x.db"
+    
+    def test_pool_options(self):
+        """Test file databases get a sized pool and in-memory ones don't"""
+        options = engine_options("sqlite:///./sweet_shop.db")
+        assert options["pool_size"] == 5
+        assert options["connect_args"] == {"check_same_thread": False}
+        assert "pool_size" not in engine_options("sqlite://")
+        assert "connect_args" not in engine_options("sqlite+aiosqlite:///./x.db")
+    
+    def test_pre_ping_only_for_network_databases(self, monkeypatch):
+        """Test connections are pinged for server databases but not SQLite files"""
+        assert engine_options("sqlite:///./sweet_shop.db")["pool_pre_ping"] is False
+        assert engine_options("postgresql+asyncpg://shop@db/shop")["pool_pre_ping"] is True
+        monkeypatch.setattr(settings, "db_pool_pre_ping", True)
+        assert engine_options("sqlite:///./sweet_shop.db")["pool_pre_ping"] is True
+    
+    def test_sqlite_pragmas(self, tmp_path):
+        """Test new connections use WAL, NORMAL sync and a busy timeout"""
+        url = f"sqlite:///{tmp_path / 'pragmas.db'}"
+        engine = create_engine(url, **engine_options(url))
+        apply_sqlite_pragmas(engine)
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        engine.dispose()
+    
+    async def test_sqlite_pragmas_async(self, tmp_path):
+        """Test the pragma hook also applies to the aiosqlite engine"""
+        url = f"sqlite+aiosqlite:///{tmp_path / 'pragmas.db'}"
+        engine = create_async_engine(url, **engine_options(url))
+        apply_sqlite_pragmas(engine.sync_engine)
+        async with engine.connect() as conn:
+            assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+        await engine.dispose()
+    
+    def test_existing_database_gains_new_columns(self, tmp_path):
+        """Test a database created before reorder thresholds is upgraded in place"""
+        url = f"sqlite:///{tmp_path / 'old.db'}"
+        engine = create_engine(url)
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE sweets (id INTEGER PRIMARY KEY, name VARCHAR UNIQUE NOT NULL, "
+                "category VARCHAR NOT NULL, price FLOAT NOT NULL, quantity INTEGER NOT NULL)"
+            ))
+            conn.execute(text("INSERT INTO sweets VALUES (1, 'Fudge', 'Fudge', 3.0, 4)"))
+        
+        add_missing_columns(engine)
+        add_missing_columns(engine)  # idempotent
+        columns = {column["name"] for column in inspect(engine).get_columns("sweets")}
+        assert "reorder_threshold" in columns
+        with engine.connect() as conn:
+            # The inspector skips expression indexes on SQLite
+            indexes = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars()
+            assert "ix_sweets_stock_margin" in set(indexes)
+            assert conn.execute(text("SELECT reorder_threshold FROM sweets")).scalar() == 0
+        engine.dispose()
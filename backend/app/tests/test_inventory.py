@@ -1,5 +1,14 @@
+import asyncio
 import pytest
 from fastapi import status
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..config import settings
+from ..models import StockMovement, StockRollup, Sweet
+from ..events import stock_events
+from ..idempotency import idempotency_store
+from ..purchase_queue import PurchaseBatcher, purchase_batcher
+from ..stock import InsufficientStockError, SweetNotFoundError
+from ..stock_counters import StripedStockCounters, stock_counters
 
 
 class TestPurchaseSweet:
@@ -158,6 +167,47 @@ class TestPurchaseSweet:
             headers={"Authorization": f"Bearer {user_token}"}
         )
         assert response.status_code == status.HTTP_404_NOT_FOUND
+    
+    def test_purchase_exact_stock_then_sold_out(self, client, test_user, test_admin):
+        """Test buying the last units succeeds and a further purchase is rejected"""
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        admin_token = admin_login.json()["access_token"]
+        
+        create_response = client.post(
+            "/api/sweets",
+            json={
+                "name": "Chocolate Bar",
+                "category": "Chocolate",
+                "price": 5.99,
+                "quantity": 3
+            },
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        sweet_id = create_response.json()["id"]
+        
+        user_login = client.post(
+            "/api/auth/login",
+            data={"username": "testuser", "password": "testpassword"}
+        )
+        headers = {"Authorization": f"Bearer {user_login.json()['access_token']}"}
+        
+        response = client.post(
+            f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["quantity"] == 0
+        
+        response = client.post(
+            f"/api/sweets/{sweet_id}/purchase", json={"quantity": 1}, headers=headers
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        
+        # The stored quantity reflects the guarded update
+        get_response = client.get(f"/api/sweets/{sweet_id}", headers=headers)
+        assert get_response.json()["quantity"] == 0
 
 
 class TestRestockSweet:
@@ -271,3 +321,634 @@ class TestRestockSweet:
         )
         assert response.status_code == status.HTTP_404_NOT_FOUND
 
+
+
+class TestBatchPurchase:
+    """Test purchasing several sweets in one request"""
+    
+    def _setup(self, client):
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        admin_headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        ids = []
+        for name, quantity in [("Chocolate Bar", 10), ("Gummy Bears", 2)]:
+            create_response = client.post(
+                "/api/sweets",
+                json={"name": name, "category": "Candy", "price": 1.5, "quantity": quantity},
+                headers=admin_headers
+            )
+            ids.append(create_response.json()["id"])
+        
+        user_login = client.post(
+            "/api/auth/login",
+            data={"username": "testuser", "password": "testpassword"}
+        )
+        user_headers = {"Authorization": f"Bearer {user_login.json()['access_token']}"}
+        return ids, user_headers
+    
+    def test_batch_purchase_success(self, client, test_user, test_admin):
+        """Test all lines are applied and repeated lines are merged"""
+        (choc_id, gummy_id), headers = self._setup(client)
+        
+        response = client.post(
+            "/api/sweets/purchase/batch",
+            json={"items": [
+                {"sweet_id": choc_id, "quantity": 3},
+                {"sweet_id": gummy_id, "quantity": 2},
+                {"sweet_id": choc_id, "quantity": 1},
+            ]},
+            headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert [(s["id"], s["quantity"]) for s in data] == [(choc_id, 6), (gummy_id, 0)]
+    
+    def test_batch_purchase_is_all_or_nothing(self, client, test_user, test_admin):
+        """Test one short line rejects the whole batch"""
+        (choc_id, gummy_id), headers = self._setup(client)
+        
+        response = client.post(
+            "/api/sweets/purchase/batch",
+            json={"items": [
+                {"sweet_id": choc_id, "quantity": 3},
+                {"sweet_id": gummy_id, "quantity": 5},
+            ]},
+            headers=headers
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        
+        get_response = client.get(f"/api/sweets/{choc_id}", headers=headers)
+        assert get_response.json()["quantity"] == 10
+    
+    def test_batch_purchase_nonexistent_sweet(self, client, test_user, test_admin):
+        """Test unknown sweets are reported with 404"""
+        (choc_id, _), headers = self._setup(client)
+        
+        response = client.post(
+            "/api/sweets/purchase/batch",
+            json={"items": [
+                {"sweet_id": choc_id, "quantity": 1},
+                {"sweet_id": 999, "quantity": 1},
+            ]},
+            headers=headers
+        )
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert "999" in response.json()["detail"]
+    
+    def test_batch_purchase_empty(self, client, test_user):
+        """Test an empty batch is rejected"""
+        user_login = client.post(
+            "/api/auth/login",
+            data={"username": "testuser", "password": "testpassword"}
+        )
+        token = user_login.json()["access_token"]
+        
+        response = client.post(
+            "/api/sweets/purchase/batch",
+            json={"items": []},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestStockLedger:
+    """Test the movement ledger and its hourly rollups"""
+    
+    def test_changes_are_recorded(self, client, test_user, test_admin, db_session):
+        """Test purchases, restocks and edits append movements and update rollups"""
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        sweet_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 2.0, "quantity": 10},
+            headers=headers
+        ).json()["id"]
+        
+        client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=headers)
+        client.post(
+            "/api/sweets/purchase/batch",
+            json={"items": [{"sweet_id": sweet_id, "quantity": 2}]},
+            headers=headers
+        )
+        client.post(f"/api/sweets/{sweet_id}/restock", json={"quantity": 4}, headers=headers)
+        client.put(f"/api/sweets/{sweet_id}", json={"quantity": 20}, headers=headers)
+        # Failed purchases leave no trace
+        client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 100}, headers=headers)
+        
+        movements = db_session.query(StockMovement).order_by(StockMovement.id).all()
+        assert [(m.kind, m.delta) for m in movements] == [
+            ("adjustment", 10), ("purchase", -3), ("purchase", -2), ("restock", 4), ("adjustment", 11)
+        ]
+        assert {m.user_id for m in movements} == {test_admin.id}
+        
+        rollups = {r.kind: r for r in db_session.query(StockRollup).all()}
+        assert rollups["purchase"].quantity == -5
+        assert rollups["purchase"].movements == 2
+        assert rollups["purchase"].revenue == pytest.approx(10.0)
+        assert rollups["purchase"].category == "Chocolate"
+        assert rollups["restock"].quantity == 4
+        assert rollups["adjustment"].quantity == 21
+
+
+class TestLowStockWatcher:
+    """Test reorder thresholds and low-stock detection"""
+    
+    def test_threshold_crossings(self, client, test_user, test_admin):
+        """Test purchases and restocks move a sweet in and out of the low-stock list"""
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        sweet_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99,
+                  "quantity": 7, "reorder_threshold": 5},
+            headers=headers
+        ).json()["id"]
+        client.post(
+            "/api/sweets",
+            json={"name": "Gummy Bears", "category": "Gummy", "price": 2.99, "quantity": 1},
+            headers=headers
+        )
+        assert client.get("/api/admin/low-stock", headers=headers).json() == []
+        
+        subscription = stock_events.subscribe(max_pending=10)
+        try:
+            client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 2}, headers=headers)
+            low = client.get("/api/admin/low-stock", headers=headers).json()
+            assert [(s["id"], s["quantity"], s["reorder_threshold"]) for s in low] == [(sweet_id, 5, 5)]
+            
+            client.post(f"/api/sweets/{sweet_id}/restock", json={"quantity": 10}, headers=headers)
+            assert client.get("/api/admin/low-stock", headers=headers).json() == []
+            
+            crossings = [e for e in subscription.drain() if e["type"] == "low_stock"]
+            assert [(e["id"], e["low"]) for e in crossings] == [(sweet_id, False)]  # coalesced per sweet
+        finally:
+            stock_events.unsubscribe(subscription)
+        
+        # Raising the threshold is a crossing too
+        client.put(f"/api/sweets/{sweet_id}", json={"reorder_threshold": 20}, headers=headers)
+        assert [s["id"] for s in client.get("/api/admin/low-stock", headers=headers).json()] == [sweet_id]
+    
+    def test_low_stock_is_read_from_database(self, client, test_admin, db_session):
+        """Test the list includes sweets changed by other workers, most urgent first"""
+        db_session.add(Sweet(name="Truffle", category="Chocolate", price=9.5, quantity=2, reorder_threshold=3))
+        db_session.add(Sweet(name="Fudge", category="Fudge", price=3.0, quantity=8, reorder_threshold=3))
+        db_session.add(Sweet(name="Toffee", category="Toffee", price=1.0, quantity=0, reorder_threshold=4))
+        db_session.commit()
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        low = client.get("/api/admin/low-stock", headers=headers).json()
+        assert [s["name"] for s in low] == ["Toffee", "Truffle"]
+
+    
+    def test_import_reloads_watcher(self, client, test_admin):
+        """Test crossings are still detected after an import replaced the catalogue"""
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        client.post(
+            "/api/sweets/import",
+            files={"file": ("catalogue.csv", "name,category,price,quantity\nFudge,Fudge,3.0,0\n", "text/csv")},
+            headers=headers
+        )
+        sweet_id = client.get("/api/admin/low-stock", headers=headers).json()[0]["id"]
+        
+        subscription = stock_events.subscribe(max_pending=10)
+        try:
+            client.put(f"/api/sweets/{sweet_id}", json={"price": 3.5}, headers=headers)
+            assert not [e for e in subscription.drain() if e["type"] == "low_stock"]
+        finally:
+            stock_events.unsubscribe(subscription)
+
+class TestIdempotencyKeys:
+    """Test Idempotency-Key handling on the inventory routes"""
+    
+    def _setup(self, client):
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        sweet_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 10},
+            headers=headers
+        ).json()["id"]
+        return headers, sweet_id
+    
+    def test_retry_replays_without_purchasing_again(self, client, test_user, test_admin):
+        """Test a retried purchase returns the stored response and keeps stock intact"""
+        headers, sweet_id = self._setup(client)
+        retry_headers = {**headers, "Idempotency-Key": "order-1"}
+        
+        first = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=retry_headers)
+        second = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=retry_headers)
+        assert first.status_code == status.HTTP_200_OK
+        assert second.status_code == status.HTTP_200_OK
+        assert second.content == first.content
+        assert second.headers["idempotent-replayed"] == "true"
+        assert client.get(f"/api/sweets/{sweet_id}", headers=headers).json()["quantity"] == 7
+        
+        # Replays survive losing the in-memory copy
+        idempotency_store.clear()
+        third = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=retry_headers)
+        assert third.content == first.content
+        
+        # A new key is a new purchase
+        response = client.post(
+            f"/api/sweets/{sweet_id}/purchase",
+            json={"quantity": 3},
+            headers={**headers, "Idempotency-Key": "order-2"}
+        )
+        assert response.json()["quantity"] == 4
+    
+    def test_key_reused_for_different_request(self, client, test_user, test_admin):
+        """Test reusing a key with a different body is rejected"""
+        headers, sweet_id = self._setup(client)
+        retry_headers = {**headers, "Idempotency-Key": "restock-1"}
+        
+        client.post(f"/api/sweets/{sweet_id}/restock", json={"quantity": 5}, headers=retry_headers)
+        response = client.post(f"/api/sweets/{sweet_id}/restock", json={"quantity": 6}, headers=retry_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert client.get(f"/api/sweets/{sweet_id}", headers=headers).json()["quantity"] == 15
+    
+    def test_failed_request_is_not_stored(self, client, test_user, test_admin):
+        """Test a failed purchase can be retried with the same key"""
+        headers, sweet_id = self._setup(client)
+        retry_headers = {**headers, "Idempotency-Key": "batch-1"}
+        batch = {"items": [{"sweet_id": sweet_id, "quantity": 12}]}
+        
+        response = client.post("/api/sweets/purchase/batch", json=batch, headers=retry_headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        
+        client.post(f"/api/sweets/{sweet_id}/restock", json={"quantity": 5}, headers=headers)
+        response = client.post("/api/sweets/purchase/batch", json=batch, headers=retry_headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()[0]["quantity"] == 3
+    
+    def test_response_commits_with_the_purchase(self, client, test_user, test_admin, monkeypatch):
+        """Test a request failing after its commit leaves a response to replay, not a pending key"""
+        headers, sweet_id = self._setup(client)
+        retry_headers = {**headers, "Idempotency-Key": "order-1"}
+        
+        def publish_fails(rows):
+            raise RuntimeError("event bus down")
+        
+        with monkeypatch.context() as patch:
+            patch.setattr(stock_events, "publish_stock", publish_fails)
+            with pytest.raises(RuntimeError):
+                client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=retry_headers)
+        
+        response = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=retry_headers)
+        assert response.headers["idempotent-replayed"] == "true"
+        assert response.json()["quantity"] == 7
+        assert client.get(f"/api/sweets/{sweet_id}", headers=headers).json()["quantity"] == 7
+
+
+class TestPurchaseBatcher:
+    """Test the group-commit purchase pipeline"""
+    
+    async def test_concurrent_purchases_share_one_commit(self, db_session, async_session_factory):
+        """Test a burst is committed as one batch without overselling"""
+        sweet = Sweet(name="Chocolate Bar", category="Chocolate", price=5.99, quantity=5)
+        db_session.add(sweet)
+        db_session.commit()
+        
+        batcher = PurchaseBatcher(async_session_factory, max_batch=64, max_delay_seconds=0.05)
+        results = await asyncio.gather(
+            *[batcher.submit(sweet.id, 1) for _ in range(7)],
+            batcher.submit(999, 1),
+            return_exceptions=True,
+        )
+        await batcher.stop()
+        
+        succeeded = [r for r in results if not isinstance(r, Exception)]
+        assert sorted(r.quantity for r in succeeded) == [0, 1, 2, 3, 4]
+        assert sum(isinstance(r, InsufficientStockError) for r in results) == 2
+        assert isinstance(results[-1], SweetNotFoundError)
+        assert batcher.stats()["batches"] == 1
+        
+        db_session.refresh(sweet)
+        assert sweet.quantity == 0
+    
+    def test_purchase_route_uses_batcher(self, client, test_user, test_admin, monkeypatch):
+        """Test the purchase route goes through the batcher when enabled"""
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        sweet_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 3},
+            headers=headers
+        ).json()["id"]
+        
+        submitted = []
+        
+        async def fake_submit(sweet_id, quantity, user_id=None):
+            submitted.append((sweet_id, quantity))
+            raise InsufficientStockError()
+        
+        monkeypatch.setattr(settings, "purchase_batching", True)
+        monkeypatch.setattr(purchase_batcher, "submit", fake_submit)
+        
+        response = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 2}, headers=headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert submitted == [(sweet_id, 2)]
+
+
+class TestStripedStockCounters:
+    """Test in-memory stock counters for hot sweets"""
+    
+    def _add_sweet(self, db_session, quantity):
+        sweet = Sweet(name="Chocolate Bar", category="Chocolate", price=5.99, quantity=quantity)
+        db_session.add(sweet)
+        db_session.commit()
+        return sweet
+    
+    async def test_flush_writes_deltas(self, db_session, async_session_factory, tmp_path):
+        """Test purchases and restocks reach the sweets table on flush"""
+        sweet = self._add_sweet(db_session, 5)
+        counters = StripedStockCounters(async_session_factory, str(tmp_path / "journal.log"))
+        await counters.start([sweet.id])
+        
+        assert counters.purchase(sweet.id, 3).quantity == 2
+        assert counters.restock(sweet.id, 10).quantity == 12
+        with pytest.raises(InsufficientStockError):
+            counters.purchase(sweet.id, 13)
+        with pytest.raises(SweetNotFoundError):
+            counters.purchase_many({sweet.id: 1, 999: 1})
+        
+        assert await counters.flush() == [sweet.id]
+        db_session.refresh(sweet)
+        assert sweet.quantity == 12
+        movements = db_session.query(StockMovement).filter_by(sweet_id=sweet.id).all()
+        assert sorted((m.kind, m.delta) for m in movements) == [("purchase", -3), ("restock", 10)]
+        await counters.stop()
+    
+    async def test_flusher_survives_failed_flush(self, db_session, async_session_factory, tmp_path):
+        """Test the background flusher retries after a failed flush instead of stopping"""
+        sweet = self._add_sweet(db_session, 5)
+        counters = StripedStockCounters(async_session_factory, str(tmp_path / "journal.log"))
+        failures = []
+        write_deltas = counters._write_deltas
+        
+        async def fail_once(db, movements, seq):
+            if not failures:
+                failures.append(seq)
+                raise RuntimeError("database unavailable")
+            await write_deltas(db, movements, seq)
+        
+        counters._write_deltas = fail_once
+        await counters.start([sweet.id], flush_interval=0.01)
+        counters.purchase(sweet.id, 2)
+        for _ in range(100):
+            if counters.flushes:
+                break
+            await asyncio.sleep(0.01)
+        await counters.stop()
+        
+        assert failures and counters.flushes >= 1
+        db_session.refresh(sweet)
+        assert sweet.quantity == 3
+    
+    async def test_unflushed_journal_is_replayed_once(self, db_session, async_session_factory, tmp_path):
+        """Test a restart applies journalled changes exactly once"""
+        sweet = self._add_sweet(db_session, 5)
+        journal = str(tmp_path / "journal.log")
+        crashed = StripedStockCounters(async_session_factory, journal)
+        await crashed.start([sweet.id])
+        crashed.purchase(sweet.id, 2)
+        await crashed.flush()
+        crashed.purchase(sweet.id, 1)
+        # Simulate a crash before the next flush; the process's lock goes with it
+        crashed._journal.close()
+        crashed._lock_file.close()
+        
+        restarted = StripedStockCounters(async_session_factory, journal)
+        await restarted.start([sweet.id])
+        assert restarted.purchase(sweet.id, 1).quantity == 1
+        await restarted.stop()
+        
+        again = StripedStockCounters(async_session_factory, journal)
+        await again.start([sweet.id])
+        await again.stop()
+        db_session.refresh(sweet)
+        assert sweet.quantity == 1
+        deltas = [m.delta for m in db_session.query(StockMovement).order_by(StockMovement.id)]
+        assert deltas == [-2, -1, -1]
+    
+    async def test_second_process_is_refused(self, db_session, async_session_factory, tmp_path):
+        """Test only one set of counters can run on a journal at a time"""
+        sweet = self._add_sweet(db_session, 5)
+        journal = str(tmp_path / "journal.log")
+        first = StripedStockCounters(async_session_factory, journal)
+        await first.start([sweet.id])
+        
+        second = StripedStockCounters(async_session_factory, journal)
+        with pytest.raises(RuntimeError):
+            await second.start([sweet.id])
+        
+        await first.stop()
+        await second.start([sweet.id])
+        await second.stop()
+    
+    async def test_flush_never_takes_stock_below_zero(self, db_session, async_session_factory, tmp_path):
+        """Test a flush fails, keeping its deltas, when the row lost stock behind the counters"""
+        sweet = self._add_sweet(db_session, 5)
+        counters = StripedStockCounters(async_session_factory, str(tmp_path / "journal.log"))
+        await counters.start([sweet.id])
+        counters.purchase(sweet.id, 4)
+        sweet.quantity = 1
+        db_session.commit()
+        
+        with pytest.raises(InsufficientStockError):
+            await counters.flush()
+        db_session.refresh(sweet)
+        assert sweet.quantity == 1
+        assert counters.stats()["pending_sweets"] == 1
+        
+        sweet.quantity = 5
+        db_session.commit()
+        await counters.stop()
+        db_session.refresh(sweet)
+        assert sweet.quantity == 1
+    
+    def test_import_replaces_hot_quantity(
+        self, client, test_admin, db_session, async_session_factory, tmp_path, monkeypatch
+    ):
+        """Test a catalogue import flushes hot counters first and adopts the imported quantity"""
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        hot_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 10},
+            headers=headers
+        ).json()["id"]
+        
+        monkeypatch.setattr(stock_counters, "session_factory", async_session_factory)
+        monkeypatch.setattr(stock_counters, "journal_path", str(tmp_path / "journal.log"))
+        asyncio.run(stock_counters.start([hot_id]))
+        try:
+            client.post(f"/api/sweets/{hot_id}/purchase", json={"quantity": 3}, headers=headers)
+            client.post(
+                "/api/sweets/import",
+                files={"file": ("catalogue.csv", "name,category,price,quantity\nChocolate Bar,Chocolate,5.99,20\n", "text/csv")},
+                headers=headers
+            )
+            assert stock_counters.purchase(hot_id, 1).quantity == 19
+        finally:
+            asyncio.run(stock_counters.stop())
+        
+        deltas = [m.delta for m in db_session.query(StockMovement).filter_by(sweet_id=hot_id).order_by(StockMovement.id)]
+        assert deltas == [10, -3, 13, -1]
+        assert db_session.get(Sweet, hot_id).quantity == 19
+    
+    def test_failed_batch_commit_gives_hot_stock_back(
+        self, client, test_user, test_admin, db_session, async_session_factory, tmp_path, monkeypatch
+    ):
+        """Test hot lines reserved before a failed commit are released without being recorded"""
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        hot_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 3},
+            headers=headers
+        ).json()["id"]
+        cold_id = client.post(
+            "/api/sweets",
+            json={"name": "Gummy Bears", "category": "Gummy", "price": 2.99, "quantity": 5},
+            headers=headers
+        ).json()["id"]
+        
+        async def failing_commit(self):
+            raise RuntimeError("database unavailable")
+        
+        monkeypatch.setattr(stock_counters, "session_factory", async_session_factory)
+        monkeypatch.setattr(stock_counters, "journal_path", str(tmp_path / "journal.log"))
+        asyncio.run(stock_counters.start([hot_id]))
+        try:
+            with monkeypatch.context() as patch:
+                patch.setattr(AsyncSession, "commit", failing_commit)
+                with pytest.raises(RuntimeError):
+                    client.post(
+                        "/api/sweets/purchase/batch",
+                        json={"items": [{"sweet_id": hot_id, "quantity": 2}, {"sweet_id": cold_id, "quantity": 1}]},
+                        headers=headers
+                    )
+            assert stock_counters.purchase(hot_id, 3).quantity == 0
+        finally:
+            asyncio.run(stock_counters.stop())
+        
+        purchases = db_session.query(StockRollup).filter_by(sweet_id=hot_id, kind="purchase").one()
+        assert purchases.quantity == -3
+        assert purchases.revenue == pytest.approx(3 * 5.99)
+        assert purchases.movements == 1
+        deltas = [m.delta for m in db_session.query(StockMovement).filter_by(sweet_id=hot_id, kind="purchase")]
+        assert deltas == [-3]
+    
+    def test_keyed_hot_requests_commit_their_response_first(
+        self, client, test_user, test_admin, db_session, async_session_factory, tmp_path, monkeypatch
+    ):
+        """Test hot purchases and restocks with a key only take effect once their response commits"""
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        hot_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 3},
+            headers=headers
+        ).json()["id"]
+        
+        async def failing_commit(self):
+            raise RuntimeError("database unavailable")
+        
+        monkeypatch.setattr(stock_counters, "session_factory", async_session_factory)
+        monkeypatch.setattr(stock_counters, "journal_path", str(tmp_path / "journal.log"))
+        asyncio.run(stock_counters.start([hot_id]))
+        try:
+            purchase_headers = {**headers, "Idempotency-Key": "order-1"}
+            with monkeypatch.context() as patch:
+                patch.setattr(AsyncSession, "commit", failing_commit)
+                with pytest.raises(RuntimeError):
+                    client.post(f"/api/sweets/{hot_id}/purchase", json={"quantity": 2}, headers=purchase_headers)
+            assert stock_counters.stats()["pending_sweets"] == 0
+            
+            for _ in range(2):
+                response = client.post(f"/api/sweets/{hot_id}/purchase", json={"quantity": 2}, headers=purchase_headers)
+                assert response.json()["quantity"] == 1
+            
+            restock_headers = {**headers, "Idempotency-Key": "restock-1"}
+            for _ in range(2):
+                response = client.post(f"/api/sweets/{hot_id}/restock", json={"quantity": 4}, headers=restock_headers)
+                assert response.json()["quantity"] == 5
+            assert stock_counters.purchase(hot_id, 5).quantity == 0
+        finally:
+            asyncio.run(stock_counters.stop())
+        
+        deltas = [m.delta for m in db_session.query(StockMovement).filter_by(sweet_id=hot_id).order_by(StockMovement.id)]
+        assert deltas == [3, -2, 4, -5]
+    
+    def test_routes_use_counters_for_hot_sweets(
+        self, client, test_user, test_admin, async_session_factory, tmp_path, monkeypatch
+    ):
+        """Test purchase, restock and batch routes go through the counters"""
+        admin_login = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {admin_login.json()['access_token']}"}
+        hot_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 3},
+            headers=headers
+        ).json()["id"]
+        cold_id = client.post(
+            "/api/sweets",
+            json={"name": "Gummy Bears", "category": "Gummy", "price": 2.99, "quantity": 1},
+            headers=headers
+        ).json()["id"]
+        
+        monkeypatch.setattr(stock_counters, "session_factory", async_session_factory)
+        monkeypatch.setattr(stock_counters, "journal_path", str(tmp_path / "journal.log"))
+        asyncio.run(stock_counters.start([hot_id]))
+        try:
+            response = client.post(f"/api/sweets/{hot_id}/purchase", json={"quantity": 2}, headers=headers)
+            assert response.json()["quantity"] == 1
+            response = client.post(f"/api/sweets/{hot_id}/restock", json={"quantity": 4}, headers=headers)
+            assert response.json()["quantity"] == 5
+            
+            # A failing database line gives the hot line back
+            response = client.post(
+                "/api/sweets/purchase/batch",
+                json={"items": [{"sweet_id": hot_id, "quantity": 1}, {"sweet_id": cold_id, "quantity": 2}]},
+                headers=headers
+            )
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+            assert stock_counters.purchase(hot_id, 5).quantity == 0
+            
+            response = client.put(f"/api/sweets/{hot_id}", json={"price": 6.49}, headers=headers)
+            assert response.json()["quantity"] == 0
+        finally:
+            asyncio.run(stock_counters.stop())
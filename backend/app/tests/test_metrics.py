@@ -0,0 +1,92 @@
+import threading
+import pytest
+from fastapi import status
+from ..config import settings
+from ..metrics import Counter, Histogram, db_query_duration, http_request_duration, instrument_engine, stock_units
+from .conftest import async_engine
+
+
+@pytest.fixture
+def admin_headers(client, test_admin):
+    login = client.post("/api/auth/login", data={"username": "admin", "password": "adminpassword"})
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+class TestMetrics:
+    """Test the Prometheus metrics endpoint and its instrumentation"""
+
+    def test_histogram_rendering(self):
+        """Test buckets are cumulative and end with +Inf"""
+        histogram = Histogram("latency_seconds", "Latency", labels=("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, "/x")
+        assert histogram.render() == [
+            'latency_seconds_bucket{route="/x",le="0.1"} 2',
+            'latency_seconds_bucket{route="/x",le="1"} 3',
+            'latency_seconds_bucket{route="/x",le="+Inf"} 4',
+            'latency_seconds_sum{route="/x"} 3.65',
+            'latency_seconds_count{route="/x"} 4',
+        ]
+
+    def test_recording_from_threads(self):
+        """Test samples recorded from threadpool threads aren't lost"""
+        histogram = Histogram("latency_seconds", "Latency", buckets=(0.1,))
+        counter = Counter("ops_total", "Operations")
+        
+        def record():
+            for _ in range(5000):
+                histogram.observe(0.05)
+                counter.inc()
+        
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert histogram.count() == 40000
+        assert counter.value() == 40000
+    
+    def test_requests_are_labelled_by_route_template(self, client, admin_headers):
+        """Test request latency is recorded per route template and status"""
+        before = http_request_duration.count("GET", "/api/sweets/{sweet_id}", "404")
+        client.get("/api/sweets/41", headers=admin_headers)
+        client.get("/api/sweets/42", headers=admin_headers)
+        assert http_request_duration.count("GET", "/api/sweets/{sweet_id}", "404") == before + 2
+
+        response = client.get("/metrics")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert (
+            'sweet_shop_http_request_duration_seconds_count{method="GET",route="/api/sweets/{sweet_id}",status="404"}'
+            in response.text
+        )
+        assert "sweet_shop_password_hash_busy_seconds" in response.text
+        assert 'sweet_shop_admission_in_flight{router="sweets"}' in response.text
+
+    def test_database_queries_are_timed(self, client, admin_headers):
+        """Test statements on an instrumented engine are counted by operation"""
+        instrument_engine(async_engine.sync_engine)
+        before = db_query_duration.count("SELECT")
+        client.get("/api/sweets", headers=admin_headers)
+        assert db_query_duration.count("SELECT") > before
+
+    def test_stock_counters(self, client, admin_headers):
+        """Test purchases and restocks count committed units"""
+        sweet_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 2.0, "quantity": 10},
+            headers=admin_headers
+        ).json()["id"]
+        purchased, restocked = stock_units.value("purchase"), stock_units.value("restock")
+        client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=admin_headers)
+        client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 30}, headers=admin_headers)
+        client.post(f"/api/sweets/{sweet_id}/restock", json={"quantity": 5}, headers=admin_headers)
+        assert stock_units.value("purchase") == purchased + 3
+        assert stock_units.value("restock") == restocked + 5
+
+    def test_metrics_token(self, client, monkeypatch):
+        """Test a configured token is required to scrape"""
+        monkeypatch.setattr(settings, "metrics_token", "scrape-secret")
+        assert client.get("/metrics").status_code == status.HTTP_401_UNAUTHORIZED
+        response = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+        assert response.status_code == status.HTTP_200_OK
@@ -0,0 +1,90 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from fastapi import status
+from ..events import StockEventHub
+from ..routes.stream import sse_events
+
+
+class FakeRequest:
+    """Stands in for a Starlette request that disconnects on demand"""
+    
+    def __init__(self):
+        self.disconnected = False
+    
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+class TestStockEventHub:
+    """Test fan-out, coalescing and backpressure of stock events"""
+    
+    def test_bursts_are_coalesced_per_sweet(self):
+        """Test only the latest quantity per sweet is kept while pending"""
+        hub = StockEventHub()
+        subscription = hub.subscribe(max_pending=10)
+        
+        hub.publish_stock([SimpleNamespace(id=1, quantity=q) for q in (9, 8, 7)])
+        hub.publish_stock([SimpleNamespace(id=2, quantity=5)])
+        
+        assert subscription.drain() == [
+            {"type": "stock", "id": 1, "quantity": 7},
+            {"type": "stock", "id": 2, "quantity": 5},
+        ]
+        assert subscription.coalesced == 2
+    
+    def test_slow_consumer_drops_oldest_and_resyncs(self):
+        """Test a full subscription drops the oldest sweets and flags a resync"""
+        hub = StockEventHub()
+        subscription = hub.subscribe(max_pending=2)
+        
+        hub.publish_stock([SimpleNamespace(id=i, quantity=i) for i in range(1, 5)])
+        
+        assert [event["id"] for event in subscription.drain()] == [3, 4]
+        assert subscription.dropped == 2
+        assert subscription.needs_resync
+    
+    def test_unsubscribed_clients_stop_receiving(self):
+        """Test unsubscribing removes the client from the fan-out"""
+        hub = StockEventHub()
+        subscription = hub.subscribe(max_pending=10)
+        hub.unsubscribe(subscription)
+        
+        hub.publish_stock([SimpleNamespace(id=1, quantity=1)])
+        
+        assert subscription.drain() == []
+        assert hub.stats()["subscribers"] == 0
+
+
+class TestStockStream:
+    """Test the server-sent events stream"""
+    
+    async def test_sse_messages(self):
+        """Test a burst goes out as one compact stock message and the stream cleans up"""
+        hub = StockEventHub()
+        request = FakeRequest()
+        stream = sse_events(request, hub)
+        
+        assert await stream.__anext__() == "retry: 3000\n\n"
+        hub.publish_stock([SimpleNamespace(id=1, quantity=4), SimpleNamespace(id=1, quantity=3)])
+        hub.publish_stock([SimpleNamespace(id=2, quantity=0)])
+        
+        message = await asyncio.wait_for(stream.__anext__(), timeout=2)
+        event_line, data_line = message.strip().split("\n")
+        assert event_line == "event: stock"
+        assert json.loads(data_line[len("data: "):]) == [
+            {"id": 1, "quantity": 3},
+            {"id": 2, "quantity": 0},
+        ]
+        
+        request.disconnected = True
+        await stream.aclose()
+        assert hub.stats()["subscribers"] == 0
+    
+    def test_stream_requires_authentication(self, client):
+        """Test the stream rejects anonymous clients"""
+        response = client.get("/api/sweets/stream")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        
+        response = client.get("/api/sweets/stream?access_token=not-a-token")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -1,5 +1,10 @@
+import asyncio
 import pytest
 from fastapi import status
+from ..catalog_import import import_sweets
+from ..models import StockMovement, StockRollup, Sweet
+from ..response_cache import InMemoryCacheBackend, ResponseCache, response_cache
+from ..routes import sweets as sweets_routes
 
 
 class TestCreateSweet:
@@ -147,6 +152,31 @@ class TestListSweets:
         assert response.status_code == status.HTTP_200_OK
         data = response.json()
         assert len(data) == 2
+    
+    def test_list_matches_single_sweet_encoding(self, client, test_admin):
+        """Test the row-encoded listing carries the same objects as the detail endpoint"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        sweet_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 6, "quantity": 50},
+            headers=headers
+        ).json()["id"]
+        
+        detail = client.get(f"/api/sweets/{sweet_id}", headers=headers).json()
+        assert client.get("/api/sweets", headers=headers).json() == [detail]
+        assert client.get("/api/sweets/search?name=Chocolate", headers=headers).json() == [detail]
+        assert isinstance(detail["price"], float)
+    
+    def test_list_schema_is_documented(self, client):
+        """Test the fast path keeps SweetResponse in the OpenAPI schema"""
+        paths = client.get("/openapi.json").json()["paths"]
+        for path in ("/api/sweets", "/api/sweets/search"):
+            schema = paths[path]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+            assert schema["items"]["$ref"] == "#/components/schemas/SweetResponse"
 
 
 class TestSearchSweets:
@@ -435,3 +465,401 @@ class TestDeleteSweet:
         )
         assert response.status_code == status.HTTP_403_FORBIDDEN
 
+
+
+class TestImportSweets:
+    """Test bulk importing sweets"""
+    
+    def test_import_csv_upserts_by_name(self, client, test_admin):
+        """Test CSV import creates new sweets, updates existing ones and reports bad rows"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        
+        client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 50},
+            headers=headers
+        )
+        
+        csv_data = (
+            "name,category,price,quantity\n"
+            "Chocolate Bar,Chocolate,6.49,80\n"
+            "Gummy Bears,Gummies,3.99,100\n"
+            "Broken,Candy,not-a-price,1\n"
+        )
+        response = client.post(
+            "/api/sweets/import",
+            files={"file": ("catalogue.csv", csv_data, "text/csv")},
+            headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["imported"] == 2
+        assert data["failed"] == 1
+        assert data["errors"][0]["line"] == 4
+        
+        sweets = {s["name"]: s for s in client.get("/api/sweets", headers=headers).json()}
+        assert sweets["Chocolate Bar"]["price"] == 6.49
+        assert sweets["Chocolate Bar"]["quantity"] == 80
+        assert sweets["Gummy Bears"]["quantity"] == 100
+    
+    def test_import_records_adjustments(self, client, test_admin, db_session):
+        """Test imported quantity changes are written to the stock ledger"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 50},
+            headers=headers
+        )
+        
+        csv_data = (
+            "name,category,price,quantity\n"
+            "Chocolate Bar,Chocolate,6.49,80\n"
+            "Gummy Bears,Gummies,3.99,100\n"
+            "Toffee,Toffee,1.50,0\n"
+        )
+        client.post(
+            "/api/sweets/import",
+            files={"file": ("catalogue.csv", csv_data, "text/csv")},
+            headers=headers
+        )
+        client.post(
+            "/api/sweets/import",
+            files={"file": ("catalogue.csv", "name,category,price,quantity\nGummy Bears,Gummies,3.99,100\n", "text/csv")},
+            headers=headers
+        )
+        
+        movements = (
+            db_session.query(Sweet.name, StockMovement.kind, StockMovement.delta)
+            .join(Sweet, Sweet.id == StockMovement.sweet_id)
+            .order_by(StockMovement.id)
+        )
+        assert [tuple(m) for m in movements] == [
+            ("Chocolate Bar", "adjustment", 50),
+            ("Chocolate Bar", "adjustment", 30),
+            ("Gummy Bears", "adjustment", 100),
+        ]
+        rollups = db_session.query(StockRollup).filter_by(kind="adjustment").all()
+        assert sum(r.quantity for r in rollups) == 180
+    
+    def test_import_updates_reorder_threshold(self, client, test_admin):
+        """Test re-importing a sweet replaces its reorder threshold"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        for threshold in (3, 7):
+            client.post(
+                "/api/sweets/import",
+                files={"file": (
+                    "catalogue.csv",
+                    f"name,category,price,quantity,reorder_threshold\nFudge,Fudge,3.0,5,{threshold}\n",
+                    "text/csv",
+                )},
+                headers=headers
+            )
+        low = client.get("/api/admin/low-stock", headers=headers).json()
+        assert [(s["name"], s["reorder_threshold"]) for s in low] == [("Fudge", 7)]
+    
+    def test_import_runs_off_the_event_loop(self, client, test_admin, monkeypatch):
+        """Test parsing and validation happen in the threadpool, not on the event loop"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        loops = []
+        
+        def recording_import(*args, **kwargs):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            return import_sweets(*args, **kwargs)
+        
+        monkeypatch.setattr(sweets_routes, "import_sweets", recording_import)
+        response = client.post(
+            "/api/sweets/import",
+            files={"file": ("catalogue.csv", "name,category,price,quantity\nFudge,Fudge,2.5,10\n", "text/csv")},
+            headers=headers
+        )
+        assert response.json()["imported"] == 1
+        assert loops == [None]
+    
+    def test_import_ndjson(self, client, test_admin):
+        """Test NDJSON import with an explicit format"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        
+        ndjson_data = (
+            '{"name": "Lollipop", "category": "Hard Candy", "price": 0.99, "quantity": 200}\n'
+            "\n"
+            "{not json}\n"
+        )
+        response = client.post(
+            "/api/sweets/import?format=ndjson",
+            files={"file": ("upload.txt", ndjson_data, "application/x-ndjson")},
+            headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["imported"] == 1
+        assert data["failed"] == 1
+        assert data["errors"][0]["line"] == 3
+    
+    def test_import_as_regular_user(self, client, test_user):
+        """Test regular user cannot import sweets"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "testuser", "password": "testpassword"}
+        )
+        token = login_response.json()["access_token"]
+        
+        response = client.post(
+            "/api/sweets/import",
+            files={"file": ("catalogue.csv", "name,category,price,quantity\n", "text/csv")},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+class TestListSweetsPagination:
+    """Test keyset pagination and field projection on the listing"""
+    
+    def _create_sweets(self, client, count):
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        for i in range(count):
+            client.post(
+                "/api/sweets",
+                json={"name": f"Sweet {i}", "category": "Candy", "price": 1.0 + i, "quantity": i},
+                headers=headers
+            )
+        return headers
+    
+    def test_pages_follow_cursor(self, client, test_admin):
+        """Test walking every page returns each sweet exactly once"""
+        headers = self._create_sweets(client, 5)
+        
+        response = client.get("/api/sweets?limit=2&include_total=true", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["X-Total-Count"] == "5"
+        names = [s["name"] for s in response.json()]
+        
+        cursor = response.headers.get("X-Next-Cursor")
+        while cursor:
+            response = client.get(f"/api/sweets?limit=2&cursor={cursor}", headers=headers)
+            assert "X-Total-Count" not in response.headers
+            names.extend(s["name"] for s in response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+        
+        assert names == [f"Sweet {i}" for i in range(5)]
+    
+    def test_fields_projection(self, client, test_admin):
+        """Test only the requested fields (plus id) are returned"""
+        headers = self._create_sweets(client, 1)
+        
+        response = client.get("/api/sweets?fields=name,price", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == [{"id": 1, "name": "Sweet 0", "price": 1.0}]
+    
+    def test_invalid_cursor_and_fields(self, client, test_admin):
+        """Test malformed cursors and unknown fields are rejected"""
+        headers = self._create_sweets(client, 0)
+        
+        response = client.get("/api/sweets?cursor=not-a-cursor", headers=headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        
+        response = client.get("/api/sweets?fields=name,secret", headers=headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestFullTextSearch:
+    """Test the full-text search index behind /api/sweets/search"""
+    
+    def _setup(self, client):
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        ids = {}
+        for name, category in [
+            ("Dark Chocolate Bar", "Chocolate"),
+            ("Milk Chocolate Truffle", "Chocolate"),
+            ("Gummy Bears", "Gummies"),
+        ]:
+            response = client.post(
+                "/api/sweets",
+                json={"name": name, "category": category, "price": 2.5, "quantity": 10},
+                headers=headers
+            )
+            ids[name] = response.json()["id"]
+        return ids, headers
+    
+    def _names(self, client, headers, query):
+        response = client.get(f"/api/sweets/search?{query}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        return sorted(s["name"] for s in response.json())
+    
+    def test_prefix_and_multi_word_match(self, client, test_admin):
+        """Test each word is matched as a prefix"""
+        _, headers = self._setup(client)
+        
+        assert self._names(client, headers, "name=choc") == [
+            "Dark Chocolate Bar", "Milk Chocolate Truffle"
+        ]
+        assert self._names(client, headers, "name=milk%20choc") == ["Milk Chocolate Truffle"]
+        assert self._names(client, headers, "name=choc&category=gumm") == []
+    
+    def test_fuzzy_match(self, client, test_admin):
+        """Test typo tolerance is opt-in"""
+        _, headers = self._setup(client)
+        
+        assert self._names(client, headers, "name=gumy%20bears") == []
+        assert self._names(client, headers, "name=gumy%20bears&fuzzy=true") == ["Gummy Bears"]
+    
+    def test_index_follows_updates_and_deletes(self, client, test_admin):
+        """Test renamed and deleted sweets are reflected in search"""
+        ids, headers = self._setup(client)
+        
+        client.put(
+            f"/api/sweets/{ids['Gummy Bears']}",
+            json={"name": "Sour Worms"},
+            headers=headers
+        )
+        client.delete(f"/api/sweets/{ids['Dark Chocolate Bar']}", headers=headers)
+        
+        assert self._names(client, headers, "name=gummy") == []
+        assert self._names(client, headers, "name=sour") == ["Sour Worms"]
+        assert self._names(client, headers, "name=choc") == ["Milk Chocolate Truffle"]
+
+
+class TestResponseCache:
+    """Test caching of catalogue responses"""
+    
+    def test_repeated_reads_are_served_from_cache(self, client, test_admin, app_statements):
+        """Test repeated reads skip the sweets table and writes invalidate them"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        sweet_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 50},
+            headers=headers
+        ).json()["id"]
+        
+        app_statements.clear()
+        for _ in range(3):
+            assert client.get("/api/sweets", headers=headers).json()[0]["quantity"] == 50
+            assert client.get(f"/api/sweets/{sweet_id}", headers=headers).json()["quantity"] == 50
+            assert len(client.get("/api/sweets/search?name=choc", headers=headers).json()) == 1
+        assert len([sql for sql in app_statements if "FROM sweets" in sql]) == 3
+        assert response_cache.stats()["hits"] == 6
+        
+        client.post(f"/api/sweets/{sweet_id}/restock", json={"quantity": 5}, headers=headers)
+        
+        assert client.get("/api/sweets", headers=headers).json()[0]["quantity"] == 55
+        assert client.get(f"/api/sweets/{sweet_id}", headers=headers).json()["quantity"] == 55
+        assert client.get("/api/sweets/search?name=choc", headers=headers).json()[0]["quantity"] == 55
+    
+    async def test_detail_invalidation_is_scoped(self, db_session, async_session_factory):
+        """Test a write only invalidates the detail entries of the sweets it touched"""
+        cache = ResponseCache(InMemoryCacheBackend(max_entries=10, ttl_seconds=60))
+        async with async_session_factory() as db:
+            cache.set(cache.sweet_key(await cache.generations(db, 1), 1), b"one")
+            cache.set(cache.sweet_key(await cache.generations(db, 2), 2), b"two")
+            cache.set(cache.catalog_key(await cache.generations(db), "list", {"limit": 10}), b"[]")
+            
+            await cache.invalidate_sweets(db, [1])
+            await db.commit()
+            
+            assert cache.get(cache.sweet_key(await cache.generations(db, 1), 1)) is None
+            assert cache.get(cache.sweet_key(await cache.generations(db, 2), 2)) == (b"two", {})
+            assert cache.get(cache.catalog_key(await cache.generations(db), "list", {"limit": 10})) is None
+        assert cache.stats()["invalidations"] == 2
+    
+    async def test_invalidation_reaches_other_workers(self, db_session, async_session_factory):
+        """Test a write committed through one worker's cache invalidates another worker's entries"""
+        writer = ResponseCache(InMemoryCacheBackend(max_entries=10, ttl_seconds=60))
+        reader = ResponseCache(InMemoryCacheBackend(max_entries=10, ttl_seconds=60))
+        async with async_session_factory() as db:
+            reader.set(reader.sweet_key(await reader.generations(db, 1), 1), b"one")
+            await db.commit()
+            
+            await writer.invalidate_sweets(db, [1])
+            await db.commit()
+            
+            assert reader.get(reader.sweet_key(await reader.generations(db, 1), 1)) is None
+
+
+class TestConditionalGet:
+    """Test ETag / If-None-Match support on the sweets endpoints"""
+    
+    def test_not_modified_until_catalogue_changes(self, client, test_admin, app_statements):
+        """Test a matching ETag gets 304 without a query, and any write changes the ETag"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        sweet_id = client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 50},
+            headers=headers
+        ).json()["id"]
+        
+        for url in ["/api/sweets", f"/api/sweets/{sweet_id}", "/api/sweets/search?name=choc"]:
+            response = client.get(url, headers=headers)
+            assert response.status_code == status.HTTP_200_OK
+            etag = response.headers["ETag"]
+            
+            app_statements.clear()
+            response = client.get(url, headers={**headers, "If-None-Match": etag})
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+            assert response.content == b""
+            assert not [sql for sql in app_statements if "FROM sweets" in sql]
+        
+        client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 1}, headers=headers)
+        
+        response = client.get("/api/sweets", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["ETag"] != etag
+        assert response.json()[0]["quantity"] == 49
+    
+    def test_etag_changes_on_writes_outside_this_worker(self, client, test_admin, db_session):
+        """Test a write committed elsewhere (here, the import script's session) changes the ETag"""
+        login_response = client.post(
+            "/api/auth/login",
+            data={"username": "admin", "password": "adminpassword"}
+        )
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        client.post(
+            "/api/sweets",
+            json={"name": "Chocolate Bar", "category": "Chocolate", "price": 5.99, "quantity": 50},
+            headers=headers
+        )
+        etag = client.get("/api/sweets", headers=headers).headers["ETag"]
+        
+        import_sweets(db_session, ["name,category,price,quantity\n", "Chocolate Bar,Chocolate,5.99,10\n"], "csv")
+        
+        response = client.get("/api/sweets", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["ETag"] != etag
+        assert response.json()[0]["quantity"] == 10
@@ -0,0 +1,183 @@
+"""
+Access token signing and verification.
+
+Keys come from a local JWKS file when ``jwks_path`` is set, otherwise from
+the shared ``jwt_secret_key`` (HS256). With a JWKS file, tokens are signed
+with an asymmetric key (ES256) and carry its ``kid``. Workers that only
+verify need nothing but the public keys. To rotate, append a new key to
+the file (scripts/rotate_jwt_key.py), keeping the old one until its
+tokens have expired: workers sign with the newest private key unless
+``jwt_signing_kid`` pins one, and notice file changes within
+``jwks_reload_seconds``. A file that fails to parse on reload is logged
+and ignored; the previous keys stay in use until it is fixed.
+
+Parsed keys are kept in memory, and verified tokens are cached until
+they expire, so a repeated token costs a dictionary lookup rather than a
+signature check.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from jose import JWTError, jwk, jwt
+from jose.backends.base import Key
+from .config import settings
+from .ttl_cache import TTLCache
+
+# Asymmetric algorithms accepted in a JWKS file (python-jose has no EdDSA)
+ASYMMETRIC_ALGORITHMS = ("ES256", "ES384", "ES512", "RS256", "RS384", "RS512")
+_DEFAULT_ALGORITHMS = {"EC": "ES256", "RSA": "RS256"}
+_PRIVATE_MEMBERS = ("d", "p", "q", "dp", "dq", "qi", "k")
+
+logger = logging.getLogger(__name__)
+
+
+def generate_signing_jwk(kid: str) -> Dict[str, Any]:
+    """Create a new ES256 private key as a JWK"""
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return {**jwk.construct(pem, "ES256").to_dict(), "kid": kid}
+
+
+class TokenKeyring:
+    """Parsed signing and verification keys, indexed by kid"""
+
+    def __init__(
+        self,
+        algorithm: str,
+        secret_key: str,
+        jwks_path: Optional[str] = None,
+        signing_kid: Optional[str] = None,
+        reload_seconds: float = 30.0,
+        verified_cache_size: int = 4096,
+    ):
+        self.algorithm = algorithm
+        self.secret_key = secret_key
+        self.jwks_path = jwks_path
+        self.signing_kid = signing_kid
+        self.reload_seconds = reload_seconds
+        self._verified = TTLCache(max_size=verified_cache_size, ttl_seconds=reload_seconds)
+        self._lock = threading.Lock()
+        self._keys: Dict[Optional[str], Tuple[Key, str]] = {}
+        self._signing: Optional[Tuple[Optional[str], Key, str]] = None
+        self._public_jwks: List[Dict[str, Any]] = []
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.load()
+
+    # -- key loading -------------------------------------------------------
+
+    def load(self) -> None:
+        """(Re)parse the keys; raises ValueError for an unusable JWKS file"""
+        if self.jwks_path is None:
+            key = jwk.construct(self.secret_key, self.algorithm)
+            keys = {None: (key, self.algorithm)}
+            signing = (None, key, self.algorithm)
+            public_jwks: List[Dict[str, Any]] = []
+            mtime = None
+        else:
+            mtime = os.stat(self.jwks_path).st_mtime
+            with open(self.jwks_path, encoding="utf-8") as f:
+                entries = json.load(f)["keys"]
+            keys, signing, public_jwks = {}, None, []
+            for entry in entries:
+                kid = entry.get("kid")
+                if not kid:
+                    raise ValueError("Every JWKS key needs a kid")
+                algorithm = entry.get("alg") or _DEFAULT_ALGORITHMS.get(entry.get("kty"))
+                if algorithm not in ASYMMETRIC_ALGORITHMS:
+                    raise ValueError(f"Unsupported JWKS algorithm for key {kid}: {algorithm}")
+                key = jwk.construct(entry, algorithm)
+                keys[kid] = (key.public_key() if "d" in entry else key, algorithm)
+                public_jwks.append({
+                    **{k: v for k, v in entry.items() if k not in _PRIVATE_MEMBERS},
+                    "alg": algorithm,
+                    "use": "sig",
+                })
+                # Sign with the pinned private key, else the newest one in the
+                # file; verify-only workers may hold public keys alone
+                if "d" in entry and (kid == self.signing_kid or self.signing_kid is None):
+                    signing = (kid, key, algorithm)
+        with self._lock:
+            self._keys, self._signing, self._public_jwks = keys, signing, public_jwks
+            self._mtime = mtime
+            self._checked_at = time.monotonic()
+        # Tokens signed by a removed key must stop verifying
+        self._verified.clear()
+
+    def _maybe_reload(self, force: bool = False) -> None:
+        if self.jwks_path is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.reload_seconds:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.jwks_path).st_mtime
+        except OSError:
+            return  # keep serving with the keys we have
+        if mtime == self._mtime:
+            return
+        try:
+            self.load()
+        except Exception:
+            # A half-written or invalid file mustn't fail every request; keep
+            # the current keys and don't retry until the file changes again
+            self._mtime = mtime
+            logger.exception("Failed to reload JWKS from %s; keeping the current keys", self.jwks_path)
+
+    def public_jwks(self) -> Dict[str, Any]:
+        """Public half of every verification key, for other services"""
+        self._maybe_reload()
+        return {"keys": list(self._public_jwks)}
+
+    # -- tokens ------------------------------------------------------------
+
+    def sign(self, claims: Dict[str, Any]) -> str:
+        self._maybe_reload()
+        if self._signing is None:
+            raise RuntimeError("No private key available to sign tokens")
+        kid, key, algorithm = self._signing
+        headers = {"kid": kid} if kid else None
+        return jwt.encode(claims, key, algorithm=algorithm, headers=headers)
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """Return the token's claims, raising JWTError if it isn't valid"""
+        cached = self._verified.get(token)
+        if cached is not None:
+            return cached  # cached no longer than the token is valid
+
+        self._maybe_reload()
+        kid = jwt.get_unverified_header(token).get("kid")
+        entry = self._keys.get(kid)
+        if entry is None and self.jwks_path is not None:
+            # A key added to the file since our last check
+            self._maybe_reload(force=True)
+            entry = self._keys.get(kid)
+        if entry is None:
+            raise JWTError("Unknown signing key")
+        key, algorithm = entry
+        claims = jwt.decode(token, key, algorithms=[algorithm])
+
+        lifetime = claims.get("exp", 0) - time.time()
+        if lifetime > 0:
+            self._verified.set(token, claims, ttl_seconds=min(lifetime, self.reload_seconds))
+        return claims
+
+
+keyring = TokenKeyring(
+    algorithm=settings.jwt_algorithm,
+    secret_key=settings.jwt_secret_key,
+    jwks_path=settings.jwks_path,
+    signing_kid=settings.jwt_signing_kid,
+    reload_seconds=settings.jwks_reload_seconds,
+    verified_cache_size=settings.token_cache_max_size,
+)
@@ -11,7 +11,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.database import SessionLocal, init_db
 from app.models import User
-from app.auth import get_password_hash, get_user_by_username
+from app.auth import get_password_hash
 
 def create_admin(username: str, email: str, password: str):
     """Create an admin user"""
@@ -20,7 +20,7 @@ def create_admin(username: str, email: str, password: str):
     
     try:
         # Check if admin already exists
-        existing_user = get_user_by_username(db, username)
+        existing_user = db.query(User).filter(User.username == username).first()
         if existing_user:
             print(f"User '{username}' already exists!")
             return False
@@ -0,0 +1,47 @@
+"""
+Script to bulk import sweets into the Sweet Shop Management System
+Run: python scripts/import_sweets.py catalogue.csv [--format csv|ndjson] [--chunk-size 500]
+"""
+import sys
+import os
+import argparse
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal, init_db
+from app.catalog_import import IMPORT_CHUNK_SIZE, SUPPORTED_FORMATS, detect_format, import_sweets
+
+def run_import(path: str, fmt: str, chunk_size: int) -> bool:
+    """Import sweets from a CSV or NDJSON file"""
+    init_db()
+    db = SessionLocal()
+    
+    try:
+        with open(path, encoding="utf-8", newline="") as lines:
+            result = import_sweets(db, lines, fmt, chunk_size=chunk_size)
+        print(f"Imported {result.imported} sweets, {result.failed} rows failed")
+        for error in result.errors:
+            print(f"  line {error.line}: {error.error}")
+        if result.failed > len(result.errors):
+            print(f"  ... {result.failed - len(result.errors)} more errors not shown")
+        return result.failed == 0
+    except Exception as e:
+        print(f"Error importing sweets: {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import sweets by name")
+    parser.add_argument("path", help="CSV or NDJSON file to import")
+    parser.add_argument("--format", choices=SUPPORTED_FORMATS, help="Input format (default: from file extension)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="Rows per INSERT statement")
+    args = parser.parse_args()
+    
+    fmt = args.format or detect_format(args.path)
+    if fmt is None:
+        parser.error("Could not detect the input format, pass --format")
+    
+    sys.exit(0 if run_import(args.path, fmt, args.chunk_size) else 1)
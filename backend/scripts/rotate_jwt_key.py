@@ -0,0 +1,51 @@
+"""
+Script to add (or retire) access token signing keys in a JWKS file
+Run: python scripts/rotate_jwt_key.py keys.json [--kid KID] [--retire OLD_KID]
+
+Workers sign with the newest key unless SWEET_SHOP_JWT_SIGNING_KID pins one.
+Retire the previous key only once every token it signed has expired.
+"""
+import sys
+import os
+import json
+import argparse
+from datetime import datetime
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.tokens import generate_signing_jwk
+
+def rotate(path: str, kid: str, retire: list) -> bool:
+    """Append a new ES256 key and drop retired ones"""
+    keys = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            keys = json.load(f)["keys"]
+    if any(key.get("kid") == kid for key in keys):
+        print(f"Key '{kid}' already exists!")
+        return False
+    
+    keys = [key for key in keys if key.get("kid") not in retire]
+    keys.append(generate_signing_jwk(kid))
+    
+    # Write atomically so running workers never read a half-written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"keys": keys}, f, indent=2)
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+    
+    print(f"Added signing key '{kid}' to {path}")
+    print("Workers start signing with it once they reload the file")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add or retire JWT signing keys")
+    parser.add_argument("path", help="JWKS file (created if missing)")
+    parser.add_argument("--kid", default=datetime.utcnow().strftime("%Y%m%d%H%M%S"), help="Id for the new key")
+    parser.add_argument("--retire", action="append", default=[], help="Kid of a key to remove (repeatable)")
+    args = parser.parse_args()
+    
+    success = rotate(args.path, args.kid, args.retire)
+    sys.exit(0 if success else 1)
@@ -94,9 +94,10 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
       },
     });
     
-    const { access_token } = response.data;
+    const { access_token, refresh_token } = response.data;
     setToken(access_token);
     localStorage.setItem('token', access_token);
+    localStorage.setItem('refresh_token', refresh_token);
     
     // Load user info after login
     await loadUser();
@@ -119,9 +120,12 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
   };
 
   const logout = () => {
+    // Revoke the session server-side; the local sign-out doesn't wait for it
+    api.post('/auth/logout').catch(() => undefined);
     setToken(null);
     setUser(null);
     localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
     delete api.defaults.headers.common['Authorization'];
   };
 
@@ -13,5 +13,49 @@ if (token) {
   api.defaults.headers.common['Authorization'] = `Bearer ${token}`;
 }
 
+// Access tokens are short-lived: on a 401, swap the refresh token for a
+// new pair once and retry. Concurrent failures share one refresh call.
+let refreshing: Promise<string | null> | null = null;
+
+const refreshAccessToken = async (): Promise<string | null> => {
+  const refreshToken = localStorage.getItem('refresh_token');
+  if (!refreshToken) return null;
+  try {
+    const response = await axios.post(`${api.defaults.baseURL}/auth/refresh`, {
+      refresh_token: refreshToken,
+    });
+    const { access_token, refresh_token } = response.data;
+    localStorage.setItem('token', access_token);
+    localStorage.setItem('refresh_token', refresh_token);
+    api.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+    return access_token;
+  } catch {
+    localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
+    delete api.defaults.headers.common['Authorization'];
+    return null;
+  }
+};
+
+api.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const original = error.config;
+    if (error.response?.status !== 401 || !original || original._retried || original.url?.startsWith('/auth/')) {
+      return Promise.reject(error);
+    }
+    original._retried = true;
+    refreshing = refreshing || refreshAccessToken().finally(() => {
+      refreshing = null;
+    });
+    const accessToken = await refreshing;
+    if (!accessToken) {
+      return Promise.reject(error);
+    }
+    original.headers['Authorization'] = `Bearer ${accessToken}`;
+    return api(original);
+  }
+);
+
 export default api;
 
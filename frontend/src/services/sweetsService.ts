@@ -6,6 +6,7 @@ export interface Sweet {
   category: string;
   price: number;
   quantity: number;
+  reorder_threshold: number;
 }
 
 export interface SweetCreate {
@@ -13,6 +14,7 @@ export interface SweetCreate {
   category: string;
   price: number;
   quantity: number;
+  reorder_threshold?: number;
 }
 
 export interface SearchParams {
@@ -24,8 +26,15 @@ export interface SearchParams {
 
 export const sweetsService = {
   getAll: async (): Promise<Sweet[]> => {
-    const response = await api.get('/sweets');
-    return response.data;
+    // The listing is keyset-paginated; follow X-Next-Cursor until exhausted
+    const sweets: Sweet[] = [];
+    let cursor: string | undefined;
+    do {
+      const response = await api.get('/sweets', { params: { cursor, limit: 500 } });
+      sweets.push(...response.data);
+      cursor = response.headers['x-next-cursor'];
+    } while (cursor);
+    return sweets;
   },
 
   search: async (params: SearchParams): Promise<Sweet[]> => {